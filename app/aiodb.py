@@ -0,0 +1,79 @@
+import logging
+from contextlib import asynccontextmanager
+
+from psycopg import AsyncClientCursor
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+logger = logging.getLogger(__name__)
+
+_pool = None
+
+
+async def open_pool(minconn, maxconn, timeout, max_idle=300, **dsn):
+    """Open the process-wide asyncio connection pool (psycopg 3).
+
+    Takes the settings of db.configure_pool. Connections use client-side
+    parameter binding, so the %s statements shared with the sync app, including
+    the multi-statement borrow and return batches, run unchanged.
+    """
+    global _pool
+    if _pool is not None:
+        raise RuntimeError("Async connection pool is already open")
+    _pool = AsyncConnectionPool(
+        make_conninfo(**dsn),
+        min_size=minconn,
+        max_size=maxconn,
+        timeout=timeout,
+        max_idle=max_idle,
+        kwargs={"cursor_factory": AsyncClientCursor},
+        open=False,
+    )
+    await _pool.open(wait=minconn > 0)
+    logger.info("Opened async connection pool (%d-%d connections).", minconn, maxconn)
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+
+
+def get_pool():
+    if _pool is None:
+        raise RuntimeError("Async connection pool is not open")
+    return _pool
+
+
+@asynccontextmanager
+async def db_connection():
+    """Check out a pooled connection; the transaction is rolled back unless committed."""
+    async with get_pool().connection() as conn:
+        try:
+            yield conn
+        finally:
+            await conn.rollback()
+
+
+async def fetch_last(cursor):
+    """Rows of the last result set of a multi-statement execute.
+
+    psycopg2 leaves the cursor on the last result; psycopg 3 starts at the first.
+    """
+    while cursor.nextset():
+        pass
+    return await cursor.fetchall()
+
+
+def stats():
+    stats = get_pool().get_stats()
+    return {
+        "size": stats.get("pool_size", 0),
+        "available": stats.get("pool_available", 0),
+        "waiting": stats.get("requests_waiting", 0),
+        "checkouts": stats.get("requests_num", 0),
+        "timeouts": stats.get("requests_errors", 0),
+        "connects": stats.get("connections_num", 0),
+    }
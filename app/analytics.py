@@ -0,0 +1,369 @@
+import logging
+import threading
+import time
+from datetime import date
+
+from psycopg2.errors import LockNotAvailable
+
+from .db import db_connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 100_000
+INTERVALS = ('day', 'week', 'month', 'year')
+DEFAULT_TOP_BOOKS = 10
+MAX_TOP_BOOKS = 100
+
+ROLLUP_LOCK_ID = 7_201_304
+
+# How long committed_ids() waits for its table lock before giving up the run;
+# borrows and returns queue behind the lock request while it waits
+COMMITTED_IDS_LOCK_TIMEOUT = '2s'
+
+ROLLUP_TABLES = ('daily_circulation', 'daily_genre_loans', 'daily_shelf_loans', 'monthly_book_loans', 'book_loan_totals')
+
+# Added to the rollups for the borrows with low < borrow_id <= high
+BORROW_ROLLUPS = """
+    INSERT INTO daily_circulation AS d (day, loans)
+    SELECT borrow_date, COUNT(*)
+    FROM borrows
+    WHERE borrow_id > %(low)s AND borrow_id <= %(high)s
+    GROUP BY borrow_date
+    ON CONFLICT (day) DO UPDATE SET loans = d.loans + EXCLUDED.loans;
+
+    INSERT INTO daily_genre_loans AS d (day, genre_id, loans)
+    SELECT bo.borrow_date, bg.genre_id, COUNT(*)
+    FROM borrows bo
+    JOIN book_genres bg ON bg.book_id = bo.book_id
+    WHERE bo.borrow_id > %(low)s AND bo.borrow_id <= %(high)s
+    GROUP BY bo.borrow_date, bg.genre_id
+    ON CONFLICT (day, genre_id) DO UPDATE SET loans = d.loans + EXCLUDED.loans;
+
+    INSERT INTO daily_shelf_loans AS d (day, shelf_location, loans)
+    SELECT bo.borrow_date, COALESCE(b.shelf_location, ''), COUNT(*)
+    FROM borrows bo
+    JOIN books b ON b.book_id = bo.book_id
+    WHERE bo.borrow_id > %(low)s AND bo.borrow_id <= %(high)s
+    GROUP BY bo.borrow_date, COALESCE(b.shelf_location, '')
+    ON CONFLICT (day, shelf_location) DO UPDATE SET loans = d.loans + EXCLUDED.loans;
+
+    INSERT INTO monthly_book_loans AS d (month, book_id, loans)
+    SELECT date_trunc('month', borrow_date)::date, book_id, COUNT(*)
+    FROM borrows
+    WHERE borrow_id > %(low)s AND borrow_id <= %(high)s
+    GROUP BY 1, 2
+    ON CONFLICT (month, book_id) DO UPDATE SET loans = d.loans + EXCLUDED.loans;
+
+    INSERT INTO book_loan_totals AS d (book_id, loans)
+    SELECT book_id, COUNT(*)
+    FROM borrows
+    WHERE borrow_id > %(low)s AND borrow_id <= %(high)s
+    GROUP BY book_id
+    ON CONFLICT (book_id) DO UPDATE SET loans = d.loans + EXCLUDED.loans;
+"""
+
+# Added to the rollups for the returns with low < return_id <= high
+RETURN_ROLLUPS = """
+    INSERT INTO daily_circulation AS d (day, returns, late_returns, fines)
+    SELECT return_date, COUNT(*), COUNT(*) FILTER (WHERE overdue_status), COALESCE(SUM(fine), 0)
+    FROM returns
+    WHERE return_id > %(low)s AND return_id <= %(high)s
+    GROUP BY return_date
+    ON CONFLICT (day) DO UPDATE SET
+        returns = d.returns + EXCLUDED.returns,
+        late_returns = d.late_returns + EXCLUDED.late_returns,
+        fines = d.fines + EXCLUDED.fines;
+"""
+
+# source -> (table, key, rollup statements)
+ROLLUP_SOURCES = {
+    'borrows': ('borrows', 'borrow_id', BORROW_ROLLUPS),
+    'returns': ('returns', 'return_id', RETURN_ROLLUPS),
+}
+
+WATERMARK_UPSERT = """
+    INSERT INTO rollup_watermarks (source, last_id)
+    VALUES (%s, %s)
+    ON CONFLICT (source) DO UPDATE SET last_id = EXCLUDED.last_id, updated_at = now()
+"""
+
+
+def committed_ids(conn):
+    """Highest id of each source table below which every row is committed.
+
+    ``SHARE`` mode waits for the transactions inserting into the tables, and
+    an id is only taken by an INSERT already holding its lock, so no row
+    with a lower id can appear later. While the lock request waits, new
+    borrows and returns queue behind it, so it waits at most
+    COMMITTED_IDS_LOCK_TIMEOUT; returns None when a long write transaction
+    held the tables that long, and the caller skips its run.
+    """
+    with conn.cursor() as cursor:
+        cursor.execute("SET LOCAL lock_timeout = %s", (COMMITTED_IDS_LOCK_TIMEOUT,))
+        try:
+            cursor.execute("LOCK TABLE borrows, returns IN SHARE MODE")
+        except LockNotAvailable:
+            conn.rollback()
+            logger.warning("Borrows and returns stayed locked for %s; skipping this run.", COMMITTED_IDS_LOCK_TIMEOUT)
+            return None
+        cursor.execute("""
+            SELECT
+                (SELECT COALESCE(MAX(borrow_id), 0) FROM borrows),
+                (SELECT COALESCE(MAX(return_id), 0) FROM returns)
+        """)
+        borrows, returns = cursor.fetchone()
+    conn.commit()
+    return {'borrows': borrows, 'returns': returns}
+
+
+def roll_up(conn, full=False, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Add the borrows and returns made since the last run to the rollup tables.
+
+    Rows are read by id range after each source's watermark, ``chunk_size``
+    ids per transaction, and the watermark moves in the same transaction as
+    the counts, so an interrupted run resumes where it stopped and never
+    counts a row twice. ``full`` empties the rollups and counts everything
+    again in one transaction, so readers see the old totals until it
+    commits; it also happens when a source's ids are below its watermark
+    (the data was replaced). Returns ``{source: rows_rolled_up}`` and the
+    seconds taken, or None when committed_ids() could not lock the sources.
+    """
+    started = time.monotonic()
+    high = committed_ids(conn)
+    if high is None:
+        return None
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT source, last_id FROM rollup_watermarks")
+        watermarks = dict(cursor.fetchall())
+        if any(watermarks.get(source, 0) > high[source] for source in ROLLUP_SOURCES):
+            logger.warning("Rollup watermarks are ahead of the data; rebuilding the rollups.")
+            full = True
+
+        if full:
+            cursor.execute(';'.join(f"DELETE FROM {table}" for table in ROLLUP_TABLES + ('rollup_watermarks',)))
+            watermarks = {}
+            chunk_size = max(high.values()) or 1
+
+        # Planner statistics are refreshed after filling empty rollups, not left to autovacuum
+        bulk = full or not watermarks
+        counts = {}
+        for source, (table, key, statements) in ROLLUP_SOURCES.items():
+            low = watermarks.get(source, 0)
+            counts[source] = 0
+            while low < high[source]:
+                chunk_high = min(low + chunk_size, high[source])
+                cursor.execute(statements, {'low': low, 'high': chunk_high})
+                cursor.execute(f"SELECT COUNT(*) FROM {table} WHERE {key} > %s AND {key} <= %s", (low, chunk_high))
+                counts[source] += cursor.fetchone()[0]
+                cursor.execute(WATERMARK_UPSERT, (source, chunk_high))
+                if not full:
+                    conn.commit()
+                low = chunk_high
+                if progress:
+                    progress(source, counts[source])
+        conn.commit()
+        if bulk:
+            cursor.execute(f"ANALYZE {', '.join(ROLLUP_TABLES)}")
+            conn.commit()
+
+    seconds = time.monotonic() - started
+    if any(counts.values()) or full:
+        logger.info("Rolled up %d borrows and %d returns%s in %.1fs.",
+                    counts['borrows'], counts['returns'], " (full rebuild)" if full else "", seconds)
+    return counts, seconds
+
+
+class RollupRefresher(threading.Thread):
+    """Background thread that runs roll_up() every ``interval`` seconds.
+
+    Runs in different processes take turns through an advisory lock.
+    """
+
+    def __init__(self, interval):
+        super().__init__(name='rollup-refresh', daemon=True)
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                with db_connection() as conn, conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s)", (ROLLUP_LOCK_ID,))
+                    if not cursor.fetchone()[0]:
+                        continue
+                    try:
+                        roll_up(conn)
+                    finally:
+                        cursor.execute("SELECT pg_advisory_unlock(%s)", (ROLLUP_LOCK_ID,))
+                        conn.commit()
+            except Exception as e:
+                if not self._stopped.is_set():
+                    logger.error("Rollup refresh failed: %s", e)
+
+    def stop(self):
+        self._stopped.set()
+
+
+def _parse_date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+
+
+def parse_analytics_args(args):
+    """Validate /api/analytics/* query parameters; raises ValueError."""
+    since = _parse_date(args, 'from')
+    until = _parse_date(args, 'to')
+    if since and until and since > until:
+        raise ValueError("from must not be after to")
+
+    interval = args.get('interval', 'month')
+    if interval not in INTERVALS:
+        raise ValueError(f"interval must be one of: {', '.join(INTERVALS)}")
+
+    try:
+        limit = int(args.get('limit', DEFAULT_TOP_BOOKS))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_TOP_BOOKS:
+        raise ValueError(f"limit must be between 1 and {MAX_TOP_BOOKS}")
+
+    return {"since": since, "until": until, "interval": interval, "limit": limit}
+
+
+def rollup_status(cursor):
+    """The period covered by the rollups and when they were last brought up to date."""
+    cursor.execute("""
+        SELECT
+            (SELECT MIN(day) FROM daily_circulation),
+            (SELECT MAX(day) FROM daily_circulation),
+            (SELECT MAX(updated_at) FROM rollup_watermarks)
+    """)
+    first_day, last_day, updated_at = cursor.fetchone()
+    return {
+        "first_day": first_day.isoformat() if first_day else None,
+        "last_day": last_day.isoformat() if last_day else None,
+        "updated_at": updated_at.isoformat() if updated_at else None,
+    }
+
+
+def circulation_series(cursor, since=None, until=None, interval='month'):
+    """Loans, returns, late returns, fines and average utilization per ``interval``.
+
+    Utilization is the share of today's books on loan, averaged over the
+    days of the period. Books on loan on a day are the loans up to that day
+    minus the returns up to it, summed over every rolled-up day (one row
+    per day, a few thousand for a decade).
+    """
+    cursor.execute("""
+        WITH bounds AS (
+            SELECT MIN(day) AS first_day, COALESCE(%(until)s, MAX(day)) AS last_day FROM daily_circulation
+        ),
+        running AS (
+            SELECT
+                s.day::date AS day,
+                COALESCE(c.loans, 0) AS loans,
+                COALESCE(c.returns, 0) AS returns,
+                COALESCE(c.late_returns, 0) AS late_returns,
+                COALESCE(c.fines, 0) AS fines,
+                SUM(COALESCE(c.loans, 0) - COALESCE(c.returns, 0)) OVER (ORDER BY s.day) AS on_loan
+            FROM bounds, generate_series(bounds.first_day, bounds.last_day, interval '1 day') AS s(day)
+            LEFT JOIN daily_circulation c ON c.day = s.day
+        )
+        SELECT
+            date_trunc(%(interval)s, day)::date,
+            SUM(loans),
+            SUM(returns),
+            SUM(late_returns),
+            SUM(fines),
+            AVG(on_loan) / NULLIF((SELECT COUNT(*) FROM books), 0)
+        FROM running
+        WHERE %(since)s::date IS NULL OR day >= %(since)s
+        GROUP BY 1
+        ORDER BY 1
+    """, {'since': since, 'until': until, 'interval': interval})
+    return [
+        {
+            "period": period.isoformat(),
+            "loans": loans,
+            "returns": returns,
+            "late_returns": late_returns,
+            "fines": float(fines),
+            "utilization": round(float(utilization), 4) if utilization is not None else None,
+        }
+        for period, loans, returns, late_returns, fines, utilization in cursor.fetchall()
+    ]
+
+
+def _day_range(since, until, column='d.day'):
+    conditions, params = [], []
+    if since is not None:
+        conditions.append(f"{column} >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append(f"{column} <= %s")
+        params.append(until)
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+
+def loans_by_genre(cursor, since=None, until=None):
+    where, params = _day_range(since, until)
+    cursor.execute(f"""
+        SELECT g.genre_id, g.name, SUM(d.loans) AS loans
+        FROM daily_genre_loans d
+        JOIN genres g ON g.genre_id = d.genre_id
+        {where}
+        GROUP BY g.genre_id, g.name
+        ORDER BY loans DESC, g.genre_id
+    """, params)
+    return [{"genre_id": genre_id, "name": name, "loans": loans} for genre_id, name, loans in cursor.fetchall()]
+
+
+def loans_by_shelf(cursor, since=None, until=None):
+    where, params = _day_range(since, until)
+    cursor.execute(f"""
+        SELECT d.shelf_location, SUM(d.loans) AS loans
+        FROM daily_shelf_loans d
+        {where}
+        GROUP BY d.shelf_location
+        ORDER BY loans DESC, d.shelf_location
+    """, params)
+    return [{"shelf_location": shelf or None, "loans": loans} for shelf, loans in cursor.fetchall()]
+
+
+def top_books(cursor, since=None, until=None, limit=DEFAULT_TOP_BOOKS):
+    """Most borrowed books; counted by whole months, those containing ``since`` and ``until``.
+
+    Without a period this reads the top of the all-time totals index; a
+    period sums the monthly counts of every book borrowed in it.
+    """
+    if since is None and until is None:
+        cursor.execute("""
+            SELECT t.book_id, b.title, t.loans
+            FROM book_loan_totals t
+            JOIN books b ON b.book_id = t.book_id
+            ORDER BY t.loans DESC, t.book_id
+            LIMIT %s
+        """, (limit,))
+        return [{"book_id": book_id, "title": title, "loans": loans} for book_id, title, loans in cursor.fetchall()]
+
+    where, params = _day_range(since.replace(day=1) if since else None, until, column='d.month')
+    cursor.execute(f"""
+        SELECT t.book_id, b.title, t.loans
+        FROM (
+            SELECT d.book_id, SUM(d.loans) AS loans
+            FROM monthly_book_loans d
+            {where}
+            GROUP BY d.book_id
+            ORDER BY loans DESC, d.book_id
+            LIMIT %s
+        ) t
+        JOIN books b ON b.book_id = t.book_id
+        ORDER BY t.loans DESC, t.book_id
+    """, params + [limit])
+    return [{"book_id": book_id, "title": title, "loans": loans} for book_id, title, loans in cursor.fetchall()]
@@ -1,39 +1,51 @@
-from flask import Flask, render_template, jsonify, request, redirect
+from flask import Flask, Response, render_template, jsonify, request, redirect, make_response, stream_with_context
 import configparser
-import requests
 import logging
+import math
+import threading
+import time
 from flask_cors import CORS
-import psycopg2
-from psycopg2 import OperationalError, DatabaseError
-from collections import defaultdict
+from psycopg2 import DatabaseError
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
+
+from .bundle import IMMUTABLE_MAX_AGE, BundleStore, build_bundle, catalog_revision
+from .cache import VersionedCache
+from .catalog import book_to_json, parse_page_args, refresh_catalog_entries
+from .circulation import (
+    ERROR_STATUS, FINE_PER_DAY, borrow_books, configure_fines, parse_bulk_rows, read_bulk_rows, return_books
+)
+from .cli import db_cli
+from .db import close_pool, configure_pool, db_connection, get_pool
+from . import analytics
+from . import descriptions
+from .descriptions import DESCRIBED_ENTITIES, DescriptionUnavailable, Prefetcher
+from .export import (
+    MAX_CONCURRENT_EXPORTS, MEDIA_TYPES, RETRY_AFTER_SECONDS, encode_rows, export_rows, gzip_chunks, parse_export_args
+)
+from . import logs
+from . import metrics
+from .notify import READY_TIMEOUT, ChangeListener, announce_change, notify_change
+from .overdue import overdue_report, parse_report_args
+from . import recommendations
+from . import replicas
+from .replicas import read_connection, record_write
+from .repository import PostgresRepository
+from .search import parse_choice_args, parse_search_args, parse_suggest_args, suggest
+from .seed import reset_seed_data
+from .viewer import VIEWER_QUERIES
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__, static_url_path='/static', static_folder='static')
 CORS(app)
-
-# Configure logging to DEBUG level for detailed logs
-logging.basicConfig(
-    level=logging.DEBUG,  # Changed from INFO to DEBUG
-    format='%(asctime)s %(levelname)s %(message)s',
-    handlers=[
-        logging.StreamHandler()
-    ]
-)
+app.cli.add_command(db_cli)
 
 # Load the configuration from the config.ini file
 config = configparser.ConfigParser()
 config.read('config.ini')
 
-# # Get the API key and URL from the configuration
-# try:
-#     GEMINI_API_KEY = config.get('API', 'GEMINI_API_KEY')
-#     GEMINI_API_URL = config.get('API', 'GEMINI_API_URL')
-#     logging.info("Gemini API configuration loaded successfully.")
-# except Exception as e:
-#     logging.error("Error reading config.ini: %s", e)
-#     GEMINI_API_KEY = None
-#     GEMINI_API_URL = None
+# Structured logging, written off the request path (see [LOGGING] in config.ini)
+logs.configure_logging(config)
 
 # Database configuration
 DB_USER = config.get('DATABASE', 'DB_USER')
@@ -42,511 +54,754 @@ DB_HOST = config.get('DATABASE', 'DB_HOST')
 DB_PORT = config.get('DATABASE', 'DB_PORT')
 DB_NAME = config.get('DATABASE', 'DB_NAME')
 
-def get_db_connection():
-    try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME,
-            user=DB_USER,
-            password=DB_PASSWORD,
-            host=DB_HOST,
-            port=DB_PORT
+configure_pool(
+    minconn=config.getint('DATABASE', 'DB_POOL_MIN', fallback=1),
+    maxconn=config.getint('DATABASE', 'DB_POOL_MAX', fallback=10),
+    timeout=config.getfloat('DATABASE', 'DB_POOL_TIMEOUT', fallback=5),
+    check_interval=config.getfloat('DATABASE', 'DB_POOL_CHECK_INTERVAL', fallback=30),
+    max_idle=config.getfloat('DATABASE', 'DB_POOL_MAX_IDLE', fallback=300),
+    dbname=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    host=DB_HOST,
+    port=DB_PORT,
+    cursor_factory=metrics.InstrumentedCursor
+)
+
+# Streaming replicas serving the read-only pages (none: everything reads from DB_HOST)
+replicas.configure(
+    hosts=config.get('DATABASE', 'DB_REPLICA_HOSTS', fallback='').split(','),
+    default_port=DB_PORT,
+    read_your_writes=config.getfloat('DATABASE', 'DB_READ_YOUR_WRITES_SECONDS',
+                                     fallback=replicas.READ_YOUR_WRITES_SECONDS),
+    retry_seconds=config.getfloat('DATABASE', 'DB_REPLICA_RETRY_SECONDS', fallback=replicas.RETRY_SECONDS),
+    minconn=config.getint('DATABASE', 'DB_REPLICA_POOL_MIN', fallback=0),
+    maxconn=config.getint('DATABASE', 'DB_POOL_MAX', fallback=10),
+    timeout=config.getfloat('DATABASE', 'DB_REPLICA_POOL_TIMEOUT', fallback=1),
+    check_interval=config.getfloat('DATABASE', 'DB_POOL_CHECK_INTERVAL', fallback=30),
+    max_idle=config.getfloat('DATABASE', 'DB_POOL_MAX_IDLE', fallback=300),
+    dbname=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    cursor_factory=metrics.InstrumentedCursor
+)
+
+# Queries slower than this are logged with their parameters (0 = off)
+metrics.configure(slow_query_ms=config.getfloat('METRICS', 'SLOW_QUERY_MS', fallback=0))
+
+# Fine policy for returns and the overdue sweep
+configure_fines(
+    per_day=config.getfloat('FINES', 'PER_DAY', fallback=FINE_PER_DAY),
+    grace_days=config.getint('FINES', 'GRACE_DAYS', fallback=0),
+    max_fine=config.getfloat('FINES', 'MAX_FINE', fallback=0) or None,
+)
+
+# Descriptions for the viewer from the model endpoint (off without API_URL and API_KEY)
+descriptions.configure(
+    url=config.get('DESCRIPTIONS', 'API_URL', fallback=None),
+    api_key=config.get('DESCRIPTIONS', 'API_KEY', fallback=None),
+    timeout=config.getfloat('DESCRIPTIONS', 'TIMEOUT', fallback=descriptions.DEFAULT_TIMEOUT),
+    workers=config.getint('DESCRIPTIONS', 'WORKERS', fallback=descriptions.DEFAULT_WORKERS),
+    max_pending=config.getint('DESCRIPTIONS', 'MAX_PENDING', fallback=descriptions.DEFAULT_MAX_PENDING),
+    failure_threshold=config.getint('DESCRIPTIONS', 'FAILURE_THRESHOLD',
+                                    fallback=descriptions.DEFAULT_FAILURE_THRESHOLD),
+    reset_seconds=config.getfloat('DESCRIPTIONS', 'RESET_SECONDS', fallback=descriptions.DEFAULT_RESET_SECONDS),
+)
+prefetch_interval = config.getfloat('DESCRIPTIONS', 'PREFETCH_INTERVAL', fallback=0)
+description_prefetcher = None
+if descriptions.service is not None and prefetch_interval > 0:
+    description_prefetcher = Prefetcher(
+        descriptions.service,
+        interval=prefetch_interval,
+        batch=config.getint('DESCRIPTIONS', 'PREFETCH_BATCH', fallback=descriptions.DEFAULT_PREFETCH_BATCH),
+    )
+
+# Streaming exports hold a connection throughout, so only a few run at once
+export_slots = threading.BoundedSemaphore(config.getint('EXPORTS', 'MAX_CONCURRENT', fallback=MAX_CONCURRENT_EXPORTS))
+
+# Cache for catalog and viewer data, invalidated by every write
+catalog_cache = VersionedCache(maxsize=config.getint('CACHE', 'CACHE_MAX_ENTRIES', fallback=512))
+
+# Storage behind the catalog, viewer, borrow, return and search routes
+repository = PostgresRepository(on_change=catalog_cache.bump)
+
+# "Patrons also borrowed" neighbours on book pages, built from the borrows table
+recommendations.configure(
+    top_n=config.getint('RECOMMENDATIONS', 'TOP_N', fallback=recommendations.DEFAULT_TOP_N),
+    co_borrow_weight=config.getfloat('RECOMMENDATIONS', 'CO_BORROW_WEIGHT',
+                                     fallback=recommendations.CO_BORROW_WEIGHT),
+    author_weight=config.getfloat('RECOMMENDATIONS', 'AUTHOR_WEIGHT', fallback=recommendations.AUTHOR_WEIGHT),
+    genre_weight=config.getfloat('RECOMMENDATIONS', 'GENRE_WEIGHT', fallback=recommendations.GENRE_WEIGHT),
+    shrinkage=config.getfloat('RECOMMENDATIONS', 'SHRINKAGE', fallback=recommendations.SHRINKAGE),
+    max_reader_books=config.getint('RECOMMENDATIONS', 'MAX_READER_BOOKS', fallback=recommendations.MAX_READER_BOOKS),
+)
+refresh_interval = config.getfloat('RECOMMENDATIONS', 'REFRESH_INTERVAL', fallback=0)
+recommendation_refresher = None
+if refresh_interval > 0 and recommendations.sparse is not None:
+    recommendation_refresher = recommendations.Refresher(refresh_interval, on_change=catalog_cache.bump)
+
+# Daily circulation rollups behind /api/analytics, brought up to date in the background if set
+rollup_interval = config.getfloat('ANALYTICS', 'REFRESH_INTERVAL', fallback=0)
+rollup_refresher = None
+if rollup_interval > 0:
+    rollup_refresher = analytics.RollupRefresher(rollup_interval)
+
+# The three refreshers above only run in server processes; see start_background_work()
+background_workers = [
+    worker for worker in (description_prefetcher, recommendation_refresher, rollup_refresher) if worker is not None
+]
+background_started = threading.Event()
+background_lock = threading.Lock()
+
+
+def catalog_changed(lsn=None, data_version=None):
+    """Another process changed the catalog: hold replica reads until they have it, and invalidate the cache."""
+    if lsn is not None:
+        replicas.router.note_write(lsn)
+    catalog_cache.bump(data_version)
+
+
+# Writes in other processes (workers, the CLI) announce themselves with NOTIFY
+catalog_listener = ChangeListener(
+    catalog_changed,
+    with_lsn=replicas.router is not None,
+    dbname=DB_NAME,
+    user=DB_USER,
+    password=DB_PASSWORD,
+    host=DB_HOST,
+    port=DB_PORT,
+)
+
+
+def load_bundle():
+    with read_connection() as conn, conn.cursor() as cursor:
+        return build_bundle(cursor)
+
+
+def load_bundle_revision():
+    with read_connection() as conn, conn.cursor() as cursor:
+        return catalog_revision(cursor)
+
+
+# Compact JSON catalog for client-side pages, rebuilt when the books, authors,
+# publishers or genres change (loans only change the data version)
+catalog_bundles = BundleStore(load_bundle, load_bundle_revision)
+
+
+def pool_metrics():
+    stats = get_pool().stats()
+    return [
+        ('db_pool_connections', 'gauge', "Open pooled connections.", stats['size']),
+        ('db_pool_connections_in_use', 'gauge', "Pooled connections checked out.", stats['in_use']),
+        ('db_pool_checkouts_total', 'counter', "Connection checkouts.", stats['checkouts']),
+        ('db_pool_timeouts_total', 'counter', "Checkouts that timed out.", stats['timeouts']),
+        ('db_pool_connects_total', 'counter', "Connections opened.", stats['connects']),
+        ('db_pool_discarded_total', 'counter', "Connections discarded as broken.", stats['discarded']),
+    ]
+
+
+def cache_metrics():
+    stats = catalog_cache.stats()
+    return [
+        ('catalog_cache_hits_total', 'counter', "Catalog cache hits.", stats['hits']),
+        ('catalog_cache_misses_total', 'counter', "Catalog cache misses.", stats['misses']),
+        ('catalog_cache_evictions_total', 'counter', "Catalog cache LRU evictions.", stats['evictions']),
+        ('catalog_cache_invalidations_total', 'counter', "Catalog cache invalidations.", stats['invalidations']),
+        ('catalog_cache_entries', 'gauge', "Entries in the catalog cache.", stats['entries']),
+    ]
+
+
+def logging_metrics():
+    stats = logs.stats()
+    return [
+        ('log_records_dropped_total', 'counter', "Log records dropped because the queue was full.", stats['dropped']),
+        ('log_records_sampled_out_total', 'counter', "Log records discarded by sampling.", stats['sampled_out']),
+        ('log_queue_length', 'gauge', "Log records waiting to be written.", stats['queued']),
+    ]
+
+
+def replica_metrics():
+    if replicas.router is None:
+        return []
+    stats = replicas.router.stats()
+    return [
+        ('db_replica_connections', 'gauge', "Open pooled replica connections.",
+         sum(replica['size'] for replica in stats)),
+        ('db_replicas_down', 'gauge', "Replicas skipped after refusing connections.",
+         sum(replica['down'] for replica in stats)),
+    ]
+
+
+def description_metrics():
+    if descriptions.service is None:
+        return []
+    stats = descriptions.service.stats()
+    return [
+        ('description_cache_hits_total', 'counter', "Descriptions served from entity_descriptions.", stats['hits']),
+        ('description_upstream_calls_total', 'counter', "Calls to the description endpoint.",
+         stats['upstream_calls']),
+        ('description_upstream_failures_total', 'counter', "Failed calls to the description endpoint.",
+         stats['upstream_failures']),
+        ('description_coalesced_total', 'counter', "Requests that joined a call already in flight.",
+         stats['coalesced']),
+        ('description_rejected_total', 'counter', "Requests refused by the circuit breaker or the queue limit.",
+         stats['rejected']),
+        ('description_inflight', 'gauge', "Description calls queued or running.", stats['inflight']),
+        ('description_circuit_open', 'gauge', "1 while calls to the description endpoint are paused.",
+         int(stats['circuit'] == 'open')),
+    ]
+
+
+metrics.registry.add_collector(pool_metrics)
+metrics.registry.add_collector(cache_metrics)
+metrics.registry.add_collector(logging_metrics)
+metrics.registry.add_collector(description_metrics)
+metrics.registry.add_collector(replica_metrics)
+
+
+@app.before_request
+def start_request_metrics():
+    catalog_listener.ensure_running()
+    start_background_work()
+    replicas.pin_primary_until(request.cookies.get(replicas.PRIMARY_READS_COOKIE))
+    logs.start_request(request.headers.get('X-Request-ID'))
+    metrics.start_request(request.endpoint)
+
+
+@app.after_request
+def record_request_metrics(response):
+    metrics.finish_request(request.method, response.status_code)
+    response.headers['X-Request-ID'] = logs.current_request_id()
+    return response
+
+
+@app.teardown_request
+def finish_request_logging(exc):
+    logs.finish_request()
+
+
+def conditional_response(render):
+    """Answer with 304 if the client's ETag matches the current data version, else render."""
+    etag = catalog_cache.etag()
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+def read_your_writes(response):
+    """Keep this client's reads on the primary for a while, so its next pages show its own change."""
+    if replicas.router is not None:
+        response.set_cookie(
+            replicas.PRIMARY_READS_COOKIE,
+            f"{replicas.primary_window_end():.3f}",
+            max_age=math.ceil(replicas.read_your_writes_seconds),
+            httponly=True,
+            samesite='Lax',
         )
-        logging.info("Database connection successful.")
-        return conn
-    except psycopg2.Error as e:
-        logging.error(f"Database connection failed: {e}")
-        return None
+    return response
+
+
+def start_background_work():
+    """Start this process's background refreshers, once.
+
+    Called from warm_up() in each gunicorn worker and on every request (for
+    `flask run`), but never on import, so `flask db ...` commands do not
+    start them.
+    """
+    if background_started.is_set():
+        return
+    with background_lock:
+        if not background_started.is_set():
+            for worker in background_workers:
+                worker.start()
+            background_started.set()
+
+
+def warm_up():
+    """Load what the first requests need before this process takes traffic.
+
+    Opens the pool, starts listening for changes and the background
+    refreshers, and fills the cache with the first catalog page and the
+    first API page, compiling their templates on the way. The catalog bundle
+    is left to its first request: no page loads it yet, and building it is
+    most of a warm-up. Returns the seconds taken.
+    """
+    started = time.perf_counter()
+    get_pool()
+    catalog_listener.ensure_running()
+    start_background_work()
+    # Its first connect invalidates the cache, so fill it after that
+    catalog_listener.ready.wait(READY_TIMEOUT)
+    for path, endpoint in (('/', 'index'), ('/api/books', 'api_books')):
+        with app.test_request_context(path):
+            app.view_functions[endpoint]()
+    return time.perf_counter() - started
+
+
+def shut_down():
+    """Release this process's connections and threads, e.g. when a server worker exits."""
+    catalog_listener.stop()
+    if description_prefetcher is not None:
+        description_prefetcher.stop()
+    if recommendation_refresher is not None:
+        recommendation_refresher.stop()
+    if rollup_refresher is not None:
+        rollup_refresher.stop()
+    if descriptions.service is not None:
+        descriptions.service.shutdown()
+    if replicas.router is not None:
+        replicas.router.close()
+    close_pool()
+
 
 # Initialize the database schema
-def initialize_database():
-    conn = None
-    cursor = None
+def initialize_database(full=False):
+    mode, seconds, data_version = None, None, None
     try:
-        conn = get_db_connection()
-        if conn is None:
-            logging.error("Database connection could not be established.")
-            return
-
-        cursor = conn.cursor()
-        schema_sql = 'schema/schema.sql'
-        data_sql = 'schema/data.sql'
-        drop_sql = 'schema/drop.sql'
-
-        for file, log_message in zip(
-            [drop_sql, schema_sql, data_sql],
-            ["All tables dropped successfully.", "Database schema initialized.", "Initial data loaded into the database."]
-        ):
-            with open(file, 'r') as f:
-                sql = f.read()
-                cursor.execute(sql)
-                logging.info(log_message)
-                conn.commit()
-
+        with db_connection() as conn:
+            mode, seconds = reset_seed_data(conn, full=full)
+            data_version = announce_change(conn)
+            record_write(conn)
     except Exception as e:
-        logging.error(f"Error initializing the database: {e}")
+        logger.error("Error initializing the database: %s", e)
     else:
-        logging.info("Database initialized successfully.")
+        logger.info("Database initialized successfully (%s reset in %.0f ms).", mode, seconds * 1000)
     finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
+        catalog_cache.bump(data_version)
+    return mode, seconds
 
 
 # Route to serve the home page
 @app.route('/init')
 def initialise():
-    initialize_database()
+    mode, seconds = initialize_database(full=request.args.get('full') == '1')
 
-    return redirect('/')
+    response = redirect('/')
+    if mode:
+        response.headers['Server-Timing'] = f'reset;desc="{mode}";dur={seconds * 1000:.1f}'
+    return response
 
 
 # Book Cateloge
 @app.route('/')
 def index():
-    conn = None
-    cursor = None
     try:
-        conn = get_db_connection()
-        if conn is None:
-            logging.error("Unable to connect to the database")
-            return []
-
-        cursor = conn.cursor()
-
-        # Fetch book info with borrower data if unavailable
-        book_query = """
-            WITH LatestBorrows AS (
-                SELECT 
-                    bo.book_id,
-                    bo.user_id,
-                    bo.borrow_date,
-                    bo.due_date,
-                    ROW_NUMBER() OVER (PARTITION BY bo.book_id ORDER BY bo.borrow_id DESC) AS rn
-                FROM borrows bo
-                LEFT JOIN books b ON bo.book_id = b.book_id
-                WHERE b.is_available=FALSE
-            )
-            SELECT 
-                b.book_id,
-                b.title,
-                b.is_available,
-                u.name AS borrower,
-                lb.borrow_date,
-                lb.due_date,
-                u.user_id
-            FROM books b
-            LEFT JOIN LatestBorrows lb ON lb.book_id = b.book_id AND lb.rn = 1
-            LEFT JOIN users u ON u.user_id = lb.user_id
-            ORDER BY b.book_id;
-        """
-        cursor.execute(book_query)
-        books = cursor.fetchall()
-
-        # Fetch authors, publishers, genres
-        def fetch_and_map(query):
-            cursor.execute(query)
-            results = cursor.fetchall()
-            mapping = defaultdict(dict)
-            for book_id, entity_id, entity_name in results:
-                mapping[book_id][entity_id] = entity_name
-            return mapping
-
-        author_query = """
-            SELECT b.book_id, a.author_id, a.name
-            FROM books b
-            JOIN book_authors ba ON ba.book_id = b.book_id
-            JOIN authors a ON a.author_id = ba.author_id
-            ORDER BY b.book_id
-        """
-
-        publisher_query = """
-            SELECT b.book_id, p.publisher_id, p.name
-            FROM books b
-            JOIN book_publishers bp ON bp.book_id = b.book_id
-            JOIN publishers p ON p.publisher_id = bp.publisher_id
-            ORDER BY b.book_id
-        """
-
-        genre_query = """
-            SELECT b.book_id, g.genre_id, g.name
-            FROM books b
-            JOIN book_genres bg ON bg.book_id = b.book_id
-            JOIN genres g ON g.genre_id = bg.genre_id
-            ORDER BY b.book_id
-        """
-
-        author_map = fetch_and_map(author_query)
-        publisher_map = fetch_and_map(publisher_query)
-        genre_map = fetch_and_map(genre_query)
-
-        # Combine all info into structured list of dicts
-        book_info = []
-        for row in books:
-            book_id, title, is_available, borrower_name, borrow_date, due_date, borrower_id = row
-            book_info.append({
-                "book_id": book_id,
-                "title": title,
-                "is_available": is_available,
-                "authors": author_map.get(book_id, {}),
-                "publishers": publisher_map.get(book_id, {}),
-                "genres": genre_map.get(book_id, {}),
-                "borrower": {borrower_id: borrower_name} if borrower_id else None,
-                "borrow_date": borrow_date,
-                "due_date": due_date,
-            })
-
-        # Get user list
-        user_query = """
-            SELECT 
-                user_id, 
-                name 
-            FROM users 
-            ORDER BY name
-        """
-        cursor.execute(user_query)
-        users = cursor.fetchall()
-
-        # Get unavailable books
-        unavailable_books_query = """
-            SELECT 
-                book_id, 
-                title 
-            FROM books 
-            WHERE is_available = FALSE 
-            ORDER BY title
-        """
-        cursor.execute(unavailable_books_query)
-        unavailable_books = cursor.fetchall()
-
-        return render_template('/index.html', info=book_info, users=users, unavailable_books=unavailable_books)
+        page_args = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def load():
+        # One page of book info with borrower data if unavailable; the loan forms look up the rest
+        return repository.catalog_page(**page_args)
 
+    def render():
+        book_info, next_cursor = catalog_cache.get_or_load(
+            ('index', tuple(sorted(page_args.items()))), load
+        )
+        return render_template(
+            '/index.html',
+            info=book_info,
+            next_cursor=next_cursor,
+            page_args=request.args.to_dict(),
+        )
+
+    try:
+        return conditional_response(render)
     except DatabaseError as e:
-        logging.error(f"Database error occurred: {e}")
+        logger.error("Database error occurred: %s", e)
         return []
 
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
+# Book Catalogue API: keyset-paginated, filterable
+@app.route('/api/books')
+def api_books():
+    try:
+        page_args = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def load():
+        return repository.catalog_page(**page_args)
+
+    def render():
+        book_info, next_cursor = catalog_cache.get_or_load(
+            ('api_books', tuple(sorted(page_args.items()))), load
+        )
+        return jsonify({
+            'books': [book_to_json(book) for book in book_info],
+            'limit': page_args['limit'],
+            'next_cursor': next_cursor,
+        })
 
-# Route to serve viewer.html: Query for Book, Author, Publisher, Genre, 
+    try:
+        return conditional_response(render)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+
+# Whole catalog as one precompressed JSON document: redirects to its content-hashed URL
+@app.route('/api/catalog-bundle')
+def catalog_bundle():
+    try:
+        bundle = catalog_bundles.current(catalog_cache.version)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+    response = redirect(f'/bundle/{bundle.filename}')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@app.route('/bundle/catalog.<digest>.json')
+def catalog_bundle_file(digest):
+    bundle = catalog_bundles.get(digest)
+    if bundle is None:
+        # Superseded long ago (or from another process): send the client to the current one
+        return catalog_bundle()
+
+    body, encoding = bundle.negotiate(request.accept_encodings)
+    response = make_response(body)
+    response.mimetype = 'application/json'
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Vary'] = 'Accept-Encoding'
+    response.headers['Cache-Control'] = f'public, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    response.set_etag(bundle.digest)
+    return response.make_conditional(request)
+
+
+# Catalog search: ranked full-text matches over titles, authors, genres and publishers
+@app.route('/api/search')
+def api_search():
+    try:
+        search_args = parse_search_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def load():
+        return repository.search(**search_args)
+
+    def render():
+        books, next_cursor, fuzzy = catalog_cache.get_or_load(
+            ('api_search', tuple(sorted(search_args.items()))), load
+        )
+        return jsonify({
+            'query': search_args['text'],
+            'results': [dict(book_to_json(book), rank=book['rank']) for book in books],
+            'fuzzy': fuzzy,
+            'limit': search_args['limit'],
+            'next_cursor': next_cursor,
+        })
+
+    try:
+        return conditional_response(render)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+
+# Search-as-you-type suggestions: matching titles and author names
+@app.route('/api/search/suggest')
+def api_search_suggest():
+    try:
+        suggest_args = parse_suggest_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def load():
+        with read_connection() as conn, conn.cursor() as cursor:
+            return suggest(cursor, **suggest_args)
+
+    def render():
+        return jsonify(catalog_cache.get_or_load(('api_search_suggest', tuple(sorted(suggest_args.items()))), load))
+
+    try:
+        return conditional_response(render)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+
+# Lookups for the borrow and return forms: books (optionally only available or borrowed ones) or users
+@app.route('/api/loan-choices/<any(books, users):kind>')
+def api_loan_choices(kind):
+    try:
+        choice_args = parse_choice_args(kind, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    def load():
+        return repository.loan_choices(kind, **choice_args)
+
+    def render():
+        choices = catalog_cache.get_or_load(('api_loan_choices', kind, tuple(sorted(choice_args.items()))), load)
+        return jsonify({'choices': choices, 'limit': choice_args['limit']})
+
+    try:
+        return conditional_response(render)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+
+# Streaming exports for reporting: the whole catalog or the loan history, in constant memory
+@app.route('/export/<any(books, loans):kind>.<any(csv, jsonl):fmt>')
+def export(kind, fmt):
+    try:
+        filters = parse_export_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    compress = request.args.get('gzip', '').lower() in ('1', 'true')
+
+    if not export_slots.acquire(blocking=False):
+        response = jsonify({'error': 'Too many exports running, try again later'})
+        response.headers['Retry-After'] = str(RETRY_AFTER_SECONDS)
+        return response, 503
+
+    def generate():
+        try:
+            # Off the primary where replicas are configured, so exports never starve borrows and returns
+            with read_connection() as conn:
+                chunks = encode_rows(kind, fmt, export_rows(conn, kind, **filters))
+                if compress:
+                    yield from gzip_chunks(chunks)
+                else:
+                    for chunk in chunks:
+                        yield chunk.encode('utf-8')
+        except DatabaseError as e:
+            # Headers are already sent: abort the stream, so the client sees an
+            # incomplete transfer rather than a well-formed, truncated file
+            logger.error("Database error during %s export: %s", kind, e)
+            raise
+
+    filename = f"{kind}.{fmt}" + ('.gz' if compress else '')
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='application/gzip' if compress else MEDIA_TYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'},
+    )
+    # Released when the server closes the response, also if the client goes away first
+    response.call_on_close(export_slots.release)
+    return response
+
+
+# Route to serve viewer.html: Query for Book, Author, Publisher, Genre, User
 @app.route('/viewer.html')
 def viewer():
     type = request.args.get('type')
     id = request.args.get('id')
-    
-    borrower = None
+
+    if type not in VIEWER_QUERIES:
+        return jsonify({'error': f"Unknown type: {type}"}), 400
+    try:
+        entity_id = int(id)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'id must be an integer'}), 400
+
     heading = type.capitalize()
 
-    try: 
-        conn = get_db_connection()
-        if conn is None:
-            print("Unable to connect to the database")
-            return []
-        
-        cursor = conn.cursor()
-
-        columns = {
-            "book": ['Title', 'Edition', 'ISBN', 'Publication Year', 'Shelf Location', 'Status'],
-            "author": ['Name'],
-            "publisher": ["Name"],
-            "genre": ["Name"], 
-            "user": ["Name", "Email", "Tel-No"]
-        }
-
-        queries = {
-            "book": f"""
-                SELECT b.title, b.edition, b.isbn, b.publication_year, b.shelf_location, b.is_available
-                FROM books b
-                WHERE book_id = %s
-            """,
-            "author": f"""
-                SELECT name
-                FROM authors
-                WHERE author_id = %s
-            """,
-            "publisher": f"""
-                SELECT name
-                FROM publishers
-                WHERE publisher_id = %s
-            """,
-            "genre": f"""
-                SELECT name
-                FROM genres
-                WHERE genre_id = %s
-            """, 
-            "user": f"""
-                SELECT name, email, tel_no
-                FROM users
-                WHERE user_id = %s
-            """
-        }
-
-        book_specific_queries = {
-            "author": f"""
-                SELECT 
-                    a.author_id,
-                    a.name
-                FROM books b
-                LEFT JOIN book_authors ba ON ba.book_id = b.book_id
-                LEFT JOIN authors a ON a.author_id = ba.author_id
-                WHERE b.book_id = %s
-                ORDER BY a.name
-            """,
-            "publisher": f"""
-                SELECT 
-                    p.publisher_id,
-                    p.name
-                FROM books b
-                LEFT JOIN book_publishers bp ON bp.book_id = b.book_id
-                LEFT JOIN publishers p ON p.publisher_id = bp.publisher_id
-                WHERE b.book_id = %s
-                ORDER BY p.name
-            """, 
-            "genre": f"""
-                SELECT 
-                    g.genre_id,
-                    g.name
-                FROM books b
-                LEFT JOIN book_genres bg ON bg.book_id = b.book_id
-                LEFT JOIN genres g ON g.genre_id = bg.genre_id
-                WHERE b.book_id = %s
-                ORDER BY g.name
-            """
-        }
-
-        # Get information based on type
-        query = queries[type]
-        column = columns[type]
-
-        cursor.execute(query, id)
-        result = cursor.fetchall()
-        info = dict(zip(column, result[0])) if result else {}
-
-
-        if type == 'book':
-            # Get related information for books: Author, Publisher, Genre
-            for label, query in book_specific_queries.items():
-                cursor.execute(query, id)
-                results = cursor.fetchall()
-                info[label.capitalize()] = dict(results) if results else {}
-
-            # If book is not available, get borrower details
-            if not info["Status"]:
-                borrower_query = f"""
-                    SELECT u.name, u.email, u.tel_no
-                    FROM books b
-                    JOIN borrows br ON br.book_id = b.book_id
-                    JOIN users u ON br.user_id = u.user_id
-                    WHERE 
-                        b.is_available = FALSE
-                        AND b.book_id = %s
-                    ORDER BY br.borrow_id DESC
-                    LIMIT 1
-                """
-
-                cursor.execute(borrower_query, id)
-                borrower_result = cursor.fetchone()
-
-                borrower = dict(zip(columns['user'], borrower_result)) if borrower_result else {}
-
-        cursor.close()
-        conn.close()
+    def load():
+        return repository.entity(type, entity_id)
+
+    def render():
+        info, borrower, recommended = catalog_cache.get_or_load(('viewer', type, entity_id), load)
+        return render_template('viewer.html', heading=heading, type=type, entity_id=entity_id, info=info,
+                               borrower=borrower, recommendations=recommended)
+
+    try:
+        return conditional_response(render)
     except DatabaseError as e:
-        logging.error(f"Database error occurred: {e}")
+        logger.error("Database error occurred: %s", e)
         return []
-    
-    return render_template('viewer.html', heading=heading, info=info, borrower=borrower)
-
-# # API route to fetch description from Gemini API
-# @app.route('/api/description', methods=['GET'])
-# def get_description():
-#     entity_name = request.args.get('name')
-#     logging.debug(f"Received request for entity name: {entity_name}")  # Changed to DEBUG
-
-#     if not entity_name:
-#         logging.warning("Missing entity name in request.")
-#         return jsonify({'error': 'Missing entity name'}), 400
-
-#     if not GEMINI_API_URL or not GEMINI_API_KEY:
-#         logging.error("Gemini API configuration missing.")
-#         return jsonify({'error': 'Server configuration error'}), 500
-
-#     # Prepare the JSON payload with explicit instructions
-#     payload = {
-#         "contents": [
-#             {
-#                 "parts": [
-#                     {
-#                         "text": (
-#                             f"Provide a detailed description of '{entity_name}'"
-#                             "If it is a book include information about the setting, characters, themes, key concepts, and its influence. "
-#                             "Do not include any concluding remarks or questions."
-#                             "Do not mention any Note at the end about not including concluding remarks or questions."
-#                         )
-#                     }
-#                 ]
-#             }
-#         ]
-#     }
-
-#     # Construct the API URL with the API key as a query parameter
-#     api_url_with_key = f"{GEMINI_API_URL}?key={GEMINI_API_KEY}"
-
-#     headers = {
-#         "Content-Type": "application/json"
-#     }
-
-#     # Log the API URL and payload for debugging
-#     logging.debug(f"API URL: {api_url_with_key}")
-#     logging.debug(f"Payload: {payload}")
-
-#     try:
-#         # Make the POST request to the Gemini API
-#         response = requests.post(
-#             api_url_with_key,  # Include the API key in the URL
-#             headers=headers,
-#             json=payload,
-#             timeout=10  # seconds
-#         )
-#         logging.debug(f"Gemini API response status: {response.status_code}")  # Changed to DEBUG
-
-#         if response.status_code != 200:
-#             logging.error(f"Failed to fetch description from Gemini API. Status code: {response.status_code}")
-#             logging.error(f"Response content: {response.text}")
-#             return jsonify({
-#                 'error': 'Failed to fetch description from Gemini API',
-#                 'status_code': response.status_code,
-#                 'response': response.text
-#             }), 500
-
-#         response_data = response.json()
-#         # Extract the description from the response
-#         description = response_data.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', 'No description available.')
-#         logging.debug(f"Fetched description: {description}")  # Changed to DEBUG
-
-#         return jsonify({'description': description})
-
-#     except requests.exceptions.RequestException as e:
-#         logging.error(f"Exception during Gemini API request: {e}")
-#         return jsonify({'error': 'Failed to connect to Gemini API', 'message': str(e)}), 500
-#     except ValueError as e:
-#         logging.error(f"JSON decoding failed: {e}")
-#         return jsonify({'error': 'Invalid JSON response from Gemini API', 'message': str(e)}), 500
-#     except Exception as e:
-#         logging.exception(f"Unexpected error: {e}")
-#         return jsonify({'error': 'An unexpected error occurred', 'message': str(e)}), 500
+
+# Generated description of a book, author, publisher or genre, loaded by the viewer page
+@app.route('/api/description')
+def get_description():
+    entity_type = request.args.get('type')
+    if entity_type not in DESCRIBED_ENTITIES:
+        return jsonify({'error': f"type must be one of: {', '.join(DESCRIBED_ENTITIES)}"}), 400
+    try:
+        entity_id = int(request.args.get('id'))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'id must be an integer'}), 400
+
+    if descriptions.service is None:
+        return jsonify({'error': 'Descriptions are not configured'}), 503
+    try:
+        result = descriptions.service.describe(entity_type, entity_id)
+    except DescriptionUnavailable as e:
+        response = jsonify({'error': str(e)})
+        if e.retry_after:
+            response.headers['Retry-After'] = str(e.retry_after)
+        return response, 503
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+    if result is None:
+        return jsonify({'error': f"No {entity_type} with id {entity_id}"}), 404
+    description, cached = result
+    return jsonify({'description': description, 'cached': cached})
 
 
 @app.route('/borrow', methods=['POST'])
 def borrow_book():
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        book_id = int(request.form.get('borrowBookId'))
+        user_id = int(request.form.get('borrowerName'))
+        # Parse string to date
+        borrow_date = datetime.strptime(request.form.get('borrowDate'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid book, user or borrow date'}), 400
 
-    book_id = request.form.get('borrowBookId')
-    user_id = request.form.get('borrowerName')
-    borrow_date_str = request.form.get('borrowDate')
+    result = repository.borrow(book_id, user_id, borrow_date)
+    if result['status'] != 'ok':
+        logger.info("Borrow of book %s rejected: %s", book_id, result['error'])
+        return jsonify({'error': result['error']}), ERROR_STATUS[result['code']]
 
-    # Parse string to date
-    borrow_date = datetime.strptime(borrow_date_str, '%Y-%m-%d').date()
-    due_date = borrow_date + relativedelta(months=1)
+    return read_your_writes(redirect('/'))
 
 
-    borrow_insert_query = """
-        INSERT INTO borrows (user_id, book_id, borrow_date, due_date)
-        VALUES (%s, %s, %s, %s)
-    """
-    cursor.execute(borrow_insert_query, (user_id, book_id, borrow_date.strftime('%Y-%m-%d'), due_date.strftime('%Y-%m-%d')))
+@app.route('/return', methods=['POST'])
+def return_book():
+    try:
+        book_id = int(request.form.get('returnBookId'))
+        return_date = datetime.strptime(request.form.get('returnDate'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid book or return date'}), 400
 
-    book_update_query = """
-        UPDATE books
-        SET is_available = FALSE
-        WHERE book_id = %s
-    """
-    cursor.execute(book_update_query, (book_id,))
+    result = repository.return_book(book_id, return_date)
+    if result['status'] != 'ok':
+        logger.info("Return of book %s rejected: %s", book_id, result['error'])
+        return jsonify({'error': result['error']}), ERROR_STATUS[result['code']]
 
-    user_update_query = """
-        UPDATE users
-        SET books_borrowed = books_borrowed + 1
-        WHERE user_id = %s
-    """
-    cursor.execute(user_update_query, (user_id,))
+    return read_your_writes(redirect('/'))
 
-    conn.commit()
-    conn.close()
 
-    return redirect('/')
+def apply_bulk(kind, operation):
+    try:
+        valid, errors = parse_bulk_rows(read_bulk_rows(request), kind)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
+    try:
+        with db_connection() as conn, conn.cursor() as cursor:
+            results = operation(cursor, valid)
+            changed = [result['book_id'] for result in results if result['status'] == 'ok']
+            if changed:
+                refresh_catalog_entries(cursor, changed)
+                data_version = notify_change(cursor)
+            conn.commit()
+            if changed:
+                record_write(conn)
+    except DatabaseError as e:
+        logger.error("Database error during bulk %s: %s", kind, e)
+        return jsonify({'error': 'Database error'}), 500
 
-@app.route('/return', methods=['POST'])
-def return_book():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-
-    book_id = request.form.get('returnBookId')
-    return_date_str = request.form.get('returnDate')
-    return_date = datetime.strptime(return_date_str, '%Y-%m-%d').date()
-
-    # Get borrow_id, due_date, user_id using parameterized query
-    borrow_record_query = """
-        SELECT borrow_id, user_id, due_date
-        FROM borrows
-        WHERE book_id = %s
-        ORDER BY borrow_id DESC
-        LIMIT 1
-    """
-    cursor.execute(borrow_record_query, (book_id,))
-    borrow_record = cursor.fetchone()
+    if changed:
+        catalog_cache.bump(data_version)
 
-    if not borrow_record:
-        cursor.close()
-        conn.close()
-        return jsonify({'error': 'No active borrow record found for this book'}), 404
+    results = sorted(results + errors, key=lambda result: result['row'])
+    logger.info("Bulk %s: %d of %d rows applied.", kind, len(changed), len(results))
+    response = jsonify({
+        'processed': len(results),
+        'succeeded': len(changed),
+        'failed': len(results) - len(changed),
+        'results': results,
+    })
+    return read_your_writes(response) if changed else response
 
-    borrow_id, user_id, due_date_obj = borrow_record
-    due_date = due_date_obj if isinstance(due_date_obj, datetime) else datetime.strptime(str(due_date_obj), '%Y-%m-%d').date()
 
+# Bulk checkout: JSON rows or CSV with columns book_id,user_id,borrow_date
+@app.route('/api/borrows/bulk', methods=['POST'])
+def bulk_borrow_books():
+    return apply_bulk('borrow', borrow_books)
 
-    # Check for overdue
-    overdue_status = return_date > due_date
-    fine_amount_per_day = 1
-    fine = 0.0
-    if overdue_status:
-        days_late = (return_date - due_date).days
-        fine = round(days_late * fine_amount_per_day, 2)
 
+# Bulk return: JSON rows or CSV with columns book_id,return_date
+@app.route('/api/returns/bulk', methods=['POST'])
+def bulk_return_books():
+    return apply_bulk('return', return_books)
 
-    # Insert into returns using parameterized query
-    returns_query = """
-        INSERT INTO returns (borrow_id, return_date, fine, overdue_status)
-        VALUES (%s, %s, %s, %s)
-    """
-    cursor.execute(returns_query, (borrow_id, return_date, fine, overdue_status))
 
-    # Update book availability
-    update_book_query = """
-        UPDATE books
-        SET is_available = TRUE
-        WHERE book_id = %s
-    """
-    cursor.execute(update_book_query, (book_id,))
+# Overdue report: open loans past due with accrued fines, as of the last overdue sweep
+@app.route('/api/overdue')
+def api_overdue():
+    try:
+        report_args = parse_report_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # Update user's borrowed book count
-    update_user_query = """
-        UPDATE users
-        SET books_borrowed = books_borrowed - 1
-        WHERE user_id = %s
-    """
-    cursor.execute(update_user_query, (user_id,))
+    try:
+        with read_connection() as conn, conn.cursor() as cursor:
+            sweep, loans, next_cursor = overdue_report(cursor, **report_args)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+    if sweep is None:
+        return jsonify({'error': 'No overdue sweep has run yet'}), 404
+    return jsonify({
+        'as_of': sweep['as_of'].isoformat(),
+        'swept_at': sweep['finished_at'].isoformat(),
+        'total_loans': sweep['outstanding_loans'],
+        'total_fine': float(sweep['outstanding_fine']),
+        'loans': loans,
+        'limit': report_args['limit'],
+        'next_cursor': next_cursor,
+    })
+
+
+# Circulation reports, answered from the daily rollup tables
+ANALYTICS_REPORTS = {
+    'circulation': lambda cursor, a: analytics.circulation_series(cursor, a['since'], a['until'], a['interval']),
+    'genres': lambda cursor, a: analytics.loans_by_genre(cursor, a['since'], a['until']),
+    'shelves': lambda cursor, a: analytics.loans_by_shelf(cursor, a['since'], a['until']),
+    'top-books': lambda cursor, a: analytics.top_books(cursor, a['since'], a['until'], a['limit']),
+}
+
+
+@app.route("/api/analytics/<any(circulation, genres, shelves, 'top-books'):report>")
+def api_analytics(report):
+    try:
+        report_args = analytics.parse_analytics_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
+    try:
+        with read_connection() as conn, conn.cursor() as cursor:
+            rows = ANALYTICS_REPORTS[report](cursor, report_args)
+            status = analytics.rollup_status(cursor)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+    return jsonify(dict(status, rows=rows))
+
+
+# Dashboard with every circulation report for the requested period
+@app.route('/analytics')
+def analytics_dashboard():
+    try:
+        report_args = analytics.parse_analytics_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    conn.commit()
-    conn.close()
+    try:
+        with read_connection() as conn, conn.cursor() as cursor:
+            reports = {name: report(cursor, report_args) for name, report in ANALYTICS_REPORTS.items()}
+            status = analytics.rollup_status(cursor)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
 
-    return redirect('/')
+    return render_template('analytics.html', reports=reports, status=status, args=report_args,
+                           intervals=analytics.INTERVALS)
 
 
 @app.route('/reset', methods=['POST'])
@@ -555,5 +810,26 @@ def reset_database():
     return redirect('/init')
 
 
-if __name__ == '__main__':
-    app.run(debug=True)
+# Connection pool statistics
+@app.route('/api/pool')
+def pool_stats():
+    return jsonify(get_pool().stats())
+
+
+# Read replica pools and routing state (empty without DB_REPLICA_HOSTS)
+@app.route('/api/replicas')
+def replica_stats():
+    return jsonify(replicas.router.stats() if replicas.router is not None else [])
+
+
+# Prometheus metrics for this process
+@app.route('/metrics')
+def prometheus_metrics():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+# Catalog cache statistics
+@app.route('/api/cache')
+def cache_stats():
+    return jsonify(catalog_cache.stats())
+
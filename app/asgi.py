@@ -0,0 +1,332 @@
+"""Async serving mode: the catalog, viewer, borrow and return pages on ASGI.
+
+Run with an ASGI server from the app directory, for example::
+
+    uvicorn --app-dir .. app.asgi:app --workers 2
+
+The handlers run the same SQL as the Flask app (app.py) through psycopg 3's
+asyncio driver, so a request waiting on Postgres holds no thread. Everything
+else (imports, exports, bulk circulation, the CLI) stays in the Flask app.
+"""
+import configparser
+import logging
+from datetime import datetime
+
+from psycopg import DatabaseError
+from quart import Quart, jsonify, make_response, redirect, render_template, request
+
+from . import aiodb
+from . import logs
+from . import metrics
+from .cache import VersionedCache
+from .catalog import (
+    book_page_results,
+    book_page_statement,
+    book_to_json,
+    parse_page_args,
+    refresh_statement,
+)
+from .circulation import (
+    ERROR_STATUS,
+    FINE_PER_DAY,
+    borrow_results,
+    borrow_statement,
+    configure_fines,
+    return_results,
+    return_statement,
+)
+from .notify import CHANNEL, NOTIFY_QUERY, ChangeListener, process_token
+from .recommendations import RECOMMENDATIONS_QUERY
+from .search import choice_results, choice_statement, parse_choice_args
+from .viewer import VIEWER_QUERIES, viewer_info
+
+logger = logging.getLogger(__name__)
+
+app = Quart(__name__, static_url_path='/static', static_folder='static')
+
+config = configparser.ConfigParser()
+config.read('config.ini')
+
+logs.configure_logging(config)
+
+configure_fines(
+    per_day=config.getfloat('FINES', 'PER_DAY', fallback=FINE_PER_DAY),
+    grace_days=config.getint('FINES', 'GRACE_DAYS', fallback=0),
+    max_fine=config.getfloat('FINES', 'MAX_FINE', fallback=0) or None,
+)
+
+# Each worker process has its own cache, as with the Flask app
+catalog_cache = VersionedCache(maxsize=config.getint('CACHE', 'CACHE_MAX_ENTRIES', fallback=512))
+
+
+def pool_metrics():
+    stats = aiodb.stats()
+    return [
+        ('db_pool_connections', 'gauge', "Open pooled connections.", stats['size']),
+        ('db_pool_connections_in_use', 'gauge', "Pooled connections checked out.",
+         stats['size'] - stats['available']),
+        ('db_pool_checkouts_total', 'counter', "Connection checkouts.", stats['checkouts']),
+        ('db_pool_timeouts_total', 'counter', "Checkouts that timed out.", stats['timeouts']),
+        ('db_pool_connects_total', 'counter', "Connections opened.", stats['connects']),
+    ]
+
+
+def cache_metrics():
+    stats = catalog_cache.stats()
+    return [
+        ('catalog_cache_hits_total', 'counter', "Catalog cache hits.", stats['hits']),
+        ('catalog_cache_misses_total', 'counter', "Catalog cache misses.", stats['misses']),
+        ('catalog_cache_evictions_total', 'counter', "Catalog cache LRU evictions.", stats['evictions']),
+        ('catalog_cache_invalidations_total', 'counter', "Catalog cache invalidations.", stats['invalidations']),
+        ('catalog_cache_entries', 'gauge', "Entries in the catalog cache.", stats['entries']),
+    ]
+
+
+metrics.registry.add_collector(pool_metrics)
+metrics.registry.add_collector(cache_metrics)
+
+
+DSN = dict(
+    dbname=config.get('DATABASE', 'DB_NAME'),
+    user=config.get('DATABASE', 'DB_USER'),
+    password=config.get('DATABASE', 'DB_PASSWORD'),
+    host=config.get('DATABASE', 'DB_HOST'),
+    port=config.get('DATABASE', 'DB_PORT'),
+)
+
+# Writes made by other processes (Flask or ASGI workers, the CLI) arrive by NOTIFY
+catalog_listener = ChangeListener(catalog_cache.bump, **DSN)
+
+
+@app.before_serving
+async def open_pool():
+    await aiodb.open_pool(
+        minconn=config.getint('DATABASE', 'DB_POOL_MIN', fallback=1),
+        maxconn=config.getint('DATABASE', 'DB_POOL_MAX', fallback=10),
+        timeout=config.getfloat('DATABASE', 'DB_POOL_TIMEOUT', fallback=5),
+        max_idle=config.getfloat('DATABASE', 'DB_POOL_MAX_IDLE', fallback=300),
+        **DSN,
+    )
+    catalog_listener.ensure_running()
+
+
+@app.after_serving
+async def close_pool():
+    catalog_listener.stop()
+    await aiodb.close_pool()
+
+
+@app.before_request
+async def start_request_metrics():
+    logs.start_request(request.headers.get('X-Request-ID'))
+    metrics.start_request(request.endpoint)
+
+
+@app.after_request
+async def record_request_metrics(response):
+    metrics.finish_request(request.method, response.status_code)
+    response.headers['X-Request-ID'] = logs.current_request_id()
+    return response
+
+
+async def conditional_response(render):
+    """Answer with 304 if the client's ETag matches the current data version, else render."""
+    etag = catalog_cache.etag()
+    if request.if_none_match.contains(etag):
+        response = await make_response('', 304)
+    else:
+        response = await make_response(await render())
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+async def fetch_all(query, params=None):
+    async with aiodb.db_connection() as conn, conn.cursor() as cursor:
+        await cursor.execute(query, params)
+        return await cursor.fetchall()
+
+
+async def fetch_book_page(page_args):
+    rows = await fetch_all(*book_page_statement(**page_args))
+    return book_page_results(rows, page_args['sort'], page_args['limit'])
+
+
+# Book Catalogue
+@app.route('/')
+async def index():
+    try:
+        page_args = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    async def render():
+        # One page of book info with borrower data if unavailable; the loan forms look up the rest
+        book_info, next_cursor = await catalog_cache.get_or_load_async(
+            ('index', tuple(sorted(page_args.items()))), lambda: fetch_book_page(page_args)
+        )
+        return await render_template(
+            '/index.html',
+            info=book_info,
+            next_cursor=next_cursor,
+            page_args=request.args.to_dict(),
+        )
+
+    try:
+        return await conditional_response(render)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+
+# Book Catalogue API: keyset-paginated, filterable
+@app.route('/api/books')
+async def api_books():
+    try:
+        page_args = parse_page_args(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    async def render():
+        book_info, next_cursor = await catalog_cache.get_or_load_async(
+            ('api_books', tuple(sorted(page_args.items()))), lambda: fetch_book_page(page_args)
+        )
+        return jsonify({
+            'books': [book_to_json(book) for book in book_info],
+            'limit': page_args['limit'],
+            'next_cursor': next_cursor,
+        })
+
+    try:
+        return await conditional_response(render)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+
+# Lookups for the borrow and return forms: books (optionally only available or borrowed ones) or users
+@app.route('/api/loan-choices/<any(books, users):kind>')
+async def api_loan_choices(kind):
+    try:
+        choice_args = parse_choice_args(kind, request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    async def load():
+        return choice_results(await fetch_all(*choice_statement(kind, **choice_args)))
+
+    async def render():
+        choices = await catalog_cache.get_or_load_async(
+            ('api_loan_choices', kind, tuple(sorted(choice_args.items()))), load
+        )
+        return jsonify({'choices': choices, 'limit': choice_args['limit']})
+
+    try:
+        return await conditional_response(render)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+
+@app.route('/viewer.html')
+async def viewer():
+    type = request.args.get('type')
+    id = request.args.get('id')
+
+    if type not in VIEWER_QUERIES:
+        return jsonify({'error': f"Unknown type: {type}"}), 400
+    try:
+        entity_id = int(id)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'id must be an integer'}), 400
+
+    heading = type.capitalize()
+
+    async def load():
+        rows = await fetch_all(VIEWER_QUERIES[type], (entity_id,))
+        recommended = {}
+        if type == 'book' and rows:
+            recommended = dict(await fetch_all(RECOMMENDATIONS_QUERY, (entity_id,)))
+        return viewer_info(type, rows[0] if rows else None) + (recommended,)
+
+    async def render():
+        info, borrower, recommended = await catalog_cache.get_or_load_async(('viewer', type, entity_id), load)
+        return await render_template('viewer.html', heading=heading, type=type, entity_id=entity_id, info=info,
+                                     borrower=borrower, recommendations=recommended)
+
+    try:
+        return await conditional_response(render)
+    except DatabaseError as e:
+        logger.error("Database error occurred: %s", e)
+        return jsonify({'error': 'Database error'}), 500
+
+
+async def apply_circulation(statement, results, book_id):
+    """Run a one-row borrow or return batch and refresh the book's catalog entry in one transaction.
+
+    Returns the batch result; the transaction is committed only if it
+    succeeded, and then the cache is invalidated.
+    """
+    async with aiodb.db_connection() as conn, conn.cursor() as cursor:
+        await cursor.execute(*statement)
+        result, = results(await aiodb.fetch_last(cursor))
+        if result['status'] == 'ok':
+            await cursor.execute(*refresh_statement([book_id]))
+            await cursor.execute(NOTIFY_QUERY, (CHANNEL, process_token()))
+            data_version, _ = await cursor.fetchone()
+            await conn.commit()
+            catalog_cache.bump(data_version)
+    return result
+
+
+@app.route('/borrow', methods=['POST'])
+async def borrow_book():
+    form = await request.form
+    try:
+        book_id = int(form.get('borrowBookId'))
+        user_id = int(form.get('borrowerName'))
+        # Parse string to date
+        borrow_date = datetime.strptime(form.get('borrowDate'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid book, user or borrow date'}), 400
+
+    result = await apply_circulation(borrow_statement([(1, book_id, user_id, borrow_date)]), borrow_results, book_id)
+    if result['status'] != 'ok':
+        logger.info("Borrow of book %s rejected: %s", book_id, result['error'])
+        return jsonify({'error': result['error']}), ERROR_STATUS[result['code']]
+
+    return redirect('/')
+
+
+@app.route('/return', methods=['POST'])
+async def return_book():
+    form = await request.form
+    try:
+        book_id = int(form.get('returnBookId'))
+        return_date = datetime.strptime(form.get('returnDate'), '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid book or return date'}), 400
+
+    result = await apply_circulation(return_statement([(1, book_id, return_date)]), return_results, book_id)
+    if result['status'] != 'ok':
+        logger.info("Return of book %s rejected: %s", book_id, result['error'])
+        return jsonify({'error': result['error']}), ERROR_STATUS[result['code']]
+
+    return redirect('/')
+
+
+# Connection pool statistics
+@app.route('/api/pool')
+async def pool_stats():
+    return jsonify(aiodb.stats())
+
+
+# Prometheus metrics for this process
+@app.route('/metrics')
+async def prometheus_metrics():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+@app.route('/api/cache')
+async def cache_stats():
+    return jsonify(catalog_cache.stats())
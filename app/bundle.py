@@ -0,0 +1,149 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:  # optional: without it the bundle is offered gzipped only
+    brotli = None
+
+# Content codings a bundle is precompressed with, in order of preference
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Compression settings: brotli quality 10 and up (and gzip 9) cost seconds on a
+# large catalog for a few percent, and the bundle is rebuilt after every change
+BROTLI_QUALITY = 9
+BROTLI_WINDOW = 24
+GZIP_LEVEL = 6
+
+# Hashed bundle URLs never change content, so clients may keep them this long
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+BUNDLE_FORMAT = 2
+
+# Changes only with the bundle's content (see migration 0011), not with loans
+CATALOG_REVISION_QUERY = "SELECT revision FROM catalog_revision"
+
+
+class CatalogBundle:
+    """The catalog encoded once as compact JSON, with gzip and brotli variants.
+
+    ``digest`` is a hash of the JSON, so a URL containing it always names
+    the same content and can be cached indefinitely.
+    """
+
+    __slots__ = ('data', 'digest', 'encoded')
+
+    def __init__(self, data):
+        self.data = data
+        self.digest = hashlib.sha256(data).hexdigest()[:16]
+        self.encoded = {'gzip': gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)}
+        if brotli is not None:
+            self.encoded['br'] = brotli.compress(data, quality=BROTLI_QUALITY, lgwin=BROTLI_WINDOW)
+
+    @property
+    def filename(self):
+        return f"catalog.{self.digest}.json"
+
+    def negotiate(self, accept_encodings):
+        """``(body, content_encoding)`` for a client accepting ``accept_encodings`` (a werkzeug MIMEAccept)."""
+        for encoding in ENCODINGS:
+            if accept_encodings[encoding]:
+                return self.encoded[encoding], encoding
+        return self.data, None
+
+
+class BundleStore:
+    """Builds the bundle when the catalog's content changes and keeps the last few.
+
+    ``build`` is called with no arguments and returns a CatalogBundle.
+    ``revision``, if given, is called with no arguments whenever the data
+    version changes, and the bundle is only rebuilt when the revision it
+    returns differs from the one the held bundle was built at; loans change
+    the version but not the revision. One thread builds while concurrent
+    callers wait for its result. Recent bundles stay available by digest,
+    so a page rendered just before a change can still load the bundle it
+    links to.
+    """
+
+    def __init__(self, build, revision=None, keep=4):
+        self.build = build
+        self.revision = revision
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._digest_lock = threading.Lock()
+        self._version = None
+        self._revision = None
+        self._current = None
+        self._by_digest = OrderedDict()
+
+    def current(self, version):
+        """The bundle for data ``version``, building it if the content changed since the one held."""
+        current = self._current
+        if current is not None and self._version == version:
+            return current
+        with self._lock:
+            if self._current is None or self._version != version:
+                # Read before building: a change committing meanwhile moves the revision on again
+                revision = self.revision() if self.revision is not None else version
+                if self._current is None or revision is None or revision != self._revision:
+                    bundle = self.build()
+                    with self._digest_lock:
+                        self._by_digest[bundle.digest] = bundle
+                        self._by_digest.move_to_end(bundle.digest)
+                        while len(self._by_digest) > self.keep:
+                            self._by_digest.popitem(last=False)
+                    self._current, self._revision = bundle, revision
+                self._version = version
+            return self._current
+
+    def get(self, digest):
+        with self._digest_lock:
+            return self._by_digest.get(digest)
+
+
+def catalog_revision(cursor):
+    """The revision of the bundle's content, or None before one was recorded."""
+    cursor.execute(CATALOG_REVISION_QUERY)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def build_bundle(cursor):
+    """Read the catalog into a CatalogBundle.
+
+    The JSON holds id -> name maps of the authors, publishers and genres, and
+    one ``[book_id, title, author_ids, publisher_ids, genre_ids]`` row per
+    book; names are not repeated per book. Availability and borrowers are
+    left out: the bundle is cached publicly, and is not rebuilt for loans.
+    """
+    cursor.execute("SELECT author_id, name FROM authors ORDER BY author_id")
+    authors = {str(author_id): name for author_id, name in cursor.fetchall()}
+    cursor.execute("SELECT publisher_id, name FROM publishers ORDER BY publisher_id")
+    publishers = {str(publisher_id): name for publisher_id, name in cursor.fetchall()}
+    cursor.execute("SELECT genre_id, name FROM genres ORDER BY genre_id")
+    genres = {str(genre_id): name for genre_id, name in cursor.fetchall()}
+
+    cursor.execute("""
+        SELECT
+            c.book_id,
+            c.title,
+            ARRAY(SELECT (e->>'id')::int FROM jsonb_array_elements(c.authors) e),
+            ARRAY(SELECT (e->>'id')::int FROM jsonb_array_elements(c.publishers) e),
+            ARRAY(SELECT (e->>'id')::int FROM jsonb_array_elements(c.genres) e)
+        FROM catalog_entries c
+        ORDER BY c.book_id
+    """)
+    books = [list(row) for row in cursor.fetchall()]
+
+    catalog = {
+        "format": BUNDLE_FORMAT,
+        "columns": ["book_id", "title", "author_ids", "publisher_ids", "genre_ids"],
+        "authors": authors,
+        "publishers": publishers,
+        "genres": genres,
+        "books": books,
+    }
+    return CatalogBundle(json.dumps(catalog, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
@@ -0,0 +1,101 @@
+import os
+import threading
+from collections import OrderedDict
+
+_MISSING = object()
+
+
+class VersionedCache:
+    """Bounded LRU cache whose entries are tied to a data version.
+
+    Writers call ``bump()`` after committing a change; every entry cached under
+    an older version becomes unreachable and the cache is cleared. Values are
+    stored under the version read *before* they were loaded, so a load that
+    races with a write can never be served as current.
+
+    The version is this process's own count. ETags come from the shared
+    ``data_version`` in Postgres instead, passed to ``bump()`` by writers and
+    the change listener, so every worker gives the same data the same ETag.
+    After a change without it, the ETag is one only this process uses.
+    """
+
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = 0
+        self._data_version = None
+        # Distinguishes this process's own ETags across processes and restarts
+        self._instance = os.urandom(4).hex()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    @property
+    def version(self):
+        return self._version
+
+    def etag(self):
+        data_version = self._data_version
+        if data_version is not None:
+            return f"v{data_version}"
+        return f"{self._instance}-{self._version}"
+
+    def bump(self, data_version=None):
+        """Invalidate every entry; ``data_version`` is the shared version covering the change, if known."""
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+            self._counters["invalidations"] += 1
+            # A listener may read a version before a write of this process
+            # moved it on, and report it after; versions never go back
+            if data_version is None or self._data_version is None or data_version > self._data_version:
+                self._data_version = data_version
+            return self._version
+
+    def get_or_load(self, key, loader):
+        version = self._version
+        entry = self._lookup(version, key)
+        if entry is not _MISSING:
+            return entry
+        value = loader()
+        self._store(version, key, value)
+        return value
+
+    async def get_or_load_async(self, key, loader):
+        """get_or_load for the async app: ``loader`` is a coroutine function."""
+        version = self._version
+        entry = self._lookup(version, key)
+        if entry is not _MISSING:
+            return entry
+        value = await loader()
+        self._store(version, key, value)
+        return value
+
+    def _lookup(self, version, key):
+        with self._lock:
+            entry = self._entries.get((version, key), _MISSING)
+            if entry is not _MISSING:
+                self._entries.move_to_end((version, key))
+                self._counters["hits"] += 1
+            else:
+                self._counters["misses"] += 1
+            return entry
+
+    def _store(self, version, key, value):
+        with self._lock:
+            if version == self._version:
+                self._entries[(version, key)] = value
+                self._entries.move_to_end((version, key))
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+                    self._counters["evictions"] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats.update({
+                "version": self._version,
+                "data_version": self._data_version,
+                "entries": len(self._entries),
+                "maxsize": self.maxsize,
+            })
+        return stats
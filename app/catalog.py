@@ -0,0 +1,260 @@
+import base64
+import binascii
+import json
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+SORT_KEYS = ('book_id', 'title')
+
+
+def encode_cursor(sort, book):
+    key = [book["book_id"]] if sort == 'book_id' else [book["title"], book["book_id"]]
+    raw = json.dumps([sort] + key, separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token, sort):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("Malformed cursor")
+
+    if not isinstance(key, list) or not key or key[0] != sort:
+        raise ValueError("Cursor does not match the requested sort order")
+    if sort == 'book_id' and len(key) == 2 and isinstance(key[1], int):
+        return tuple(key[1:])
+    if sort == 'title' and len(key) == 3 and isinstance(key[1], str) and isinstance(key[2], int):
+        return tuple(key[1:])
+    raise ValueError("Malformed cursor")
+
+
+def parse_page_args(args):
+    """Validate catalog paging/filter query parameters; raises ValueError."""
+    sort = args.get('sort', 'book_id')
+    if sort not in SORT_KEYS:
+        raise ValueError(f"sort must be one of: {', '.join(SORT_KEYS)}")
+
+    try:
+        limit = int(args.get('limit', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    available = args.get('available')
+    if available is not None:
+        if available.lower() not in ('true', 'false'):
+            raise ValueError("available must be 'true' or 'false'")
+        available = available.lower() == 'true'
+
+    filters = {}
+    for name in ('genre', 'author'):
+        value = args.get(name)
+        if value is not None:
+            try:
+                filters[name] = int(value)
+            except ValueError:
+                raise ValueError(f"{name} must be an integer id")
+
+    cursor = args.get('cursor')
+    after = decode_cursor(cursor, sort) if cursor else None
+
+    return {
+        "sort": sort,
+        "limit": limit,
+        "after": after,
+        "available": available,
+        "genre_id": filters.get('genre'),
+        "author_id": filters.get('author'),
+    }
+
+
+def refresh_catalog_entries(cursor, book_ids=None):
+    """Rebuild the catalog read model rows for ``book_ids`` (all books if None).
+
+    Call this inside the transaction that changed the books, their relations
+    or their loans, so the read model commits atomically with the change.
+    """
+    cursor.execute(*refresh_statement(book_ids))
+    return cursor.rowcount
+
+
+def refresh_statement(book_ids=None):
+    """``(sql, params)`` of refresh_catalog_entries."""
+    where = "WHERE b.book_id = ANY(%s::int[])" if book_ids is not None else ""
+
+    refresh_query = f"""
+        INSERT INTO catalog_entries (
+            book_id, title, is_available, authors, publishers, genres,
+            author_ids, genre_ids, borrower_id, borrower_name, borrow_date, due_date
+        )
+        SELECT
+            b.book_id,
+            b.title,
+            b.is_available,
+            COALESCE(a.authors, '[]'),
+            COALESCE(p.publishers, '[]'),
+            COALESCE(g.genres, '[]'),
+            COALESCE(a.author_ids, '{{}}'),
+            COALESCE(g.genre_ids, '{{}}'),
+            u.user_id,
+            u.name,
+            lb.borrow_date,
+            lb.due_date
+        FROM books b
+        LEFT JOIN LATERAL (
+            SELECT
+                jsonb_agg(jsonb_build_object('id', a.author_id, 'name', a.name) ORDER BY a.author_id) AS authors,
+                array_agg(a.author_id ORDER BY a.author_id) AS author_ids
+            FROM book_authors ba
+            JOIN authors a ON a.author_id = ba.author_id
+            WHERE ba.book_id = b.book_id
+        ) a ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT jsonb_agg(jsonb_build_object('id', p.publisher_id, 'name', p.name) ORDER BY p.publisher_id) AS publishers
+            FROM book_publishers bp
+            JOIN publishers p ON p.publisher_id = bp.publisher_id
+            WHERE bp.book_id = b.book_id
+        ) p ON TRUE
+        LEFT JOIN LATERAL (
+            SELECT
+                jsonb_agg(jsonb_build_object('id', g.genre_id, 'name', g.name) ORDER BY g.genre_id) AS genres,
+                array_agg(g.genre_id ORDER BY g.genre_id) AS genre_ids
+            FROM book_genres bg
+            JOIN genres g ON g.genre_id = bg.genre_id
+            WHERE bg.book_id = b.book_id
+        ) g ON TRUE
+        LEFT JOIN borrows lb ON lb.borrow_id = b.current_borrow_id
+        LEFT JOIN users u ON u.user_id = lb.user_id
+        {where}
+        ON CONFLICT (book_id) DO UPDATE SET
+            title = EXCLUDED.title,
+            is_available = EXCLUDED.is_available,
+            authors = EXCLUDED.authors,
+            publishers = EXCLUDED.publishers,
+            genres = EXCLUDED.genres,
+            author_ids = EXCLUDED.author_ids,
+            genre_ids = EXCLUDED.genre_ids,
+            borrower_id = EXCLUDED.borrower_id,
+            borrower_name = EXCLUDED.borrower_name,
+            borrow_date = EXCLUDED.borrow_date,
+            due_date = EXCLUDED.due_date
+    """
+    return refresh_query, (list(book_ids),) if book_ids is not None else None
+
+
+# Columns of catalog_entries read into a book; see row_to_book
+BOOK_COLUMNS = """
+    c.book_id,
+    c.title,
+    c.is_available,
+    c.authors,
+    c.publishers,
+    c.genres,
+    c.borrower_id,
+    c.borrower_name,
+    c.borrow_date,
+    c.due_date
+"""
+
+
+def row_to_book(row):
+    """Turn a ``BOOK_COLUMNS`` row into the book mapping the catalog template expects."""
+    book_id, title, is_available, authors, publishers, genres, borrower_id, borrower_name, borrow_date, due_date = row[:10]
+
+    def to_mapping(entities):
+        return {entity["id"]: entity["name"] for entity in entities}
+
+    return {
+        "book_id": book_id,
+        "title": title,
+        "is_available": is_available,
+        "authors": to_mapping(authors),
+        "publishers": to_mapping(publishers),
+        "genres": to_mapping(genres),
+        "borrower": {borrower_id: borrower_name} if borrower_id else None,
+        "borrow_date": borrow_date,
+        "due_date": due_date,
+    }
+
+
+def fetch_book_page(cursor, sort='book_id', limit=DEFAULT_PAGE_SIZE, after=None,
+                    available=None, genre_id=None, author_id=None):
+    """Fetch one keyset page of the catalog from the ``catalog_entries`` read model.
+
+    Returns ``(book_info, next_cursor)`` where ``book_info`` has the same shape
+    the catalog template expects and ``next_cursor`` is None on the last page.
+    """
+    cursor.execute(*book_page_statement(sort, limit, after, available, genre_id, author_id))
+    return book_page_results(cursor.fetchall(), sort, limit)
+
+
+def book_page_statement(sort='book_id', limit=DEFAULT_PAGE_SIZE, after=None,
+                        available=None, genre_id=None, author_id=None):
+    """``(sql, params)`` of fetch_book_page; its rows go to book_page_results."""
+    conditions = []
+    params = []
+
+    if after is not None:
+        if sort == 'book_id':
+            conditions.append("c.book_id > %s")
+        else:
+            conditions.append("(c.title, c.book_id) > (%s, %s)")
+        params.extend(after)
+
+    if available is not None:
+        conditions.append("c.is_available = %s")
+        params.append(available)
+
+    if genre_id is not None:
+        conditions.append("c.genre_ids @> ARRAY[%s]")
+        params.append(genre_id)
+
+    if author_id is not None:
+        conditions.append("c.author_ids @> ARRAY[%s]")
+        params.append(author_id)
+
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    order_by = "c.book_id" if sort == 'book_id' else "c.title, c.book_id"
+
+    # Fetch one extra row to know whether another page follows
+    book_query = f"""
+        SELECT {BOOK_COLUMNS}
+        FROM catalog_entries c
+        {where}
+        ORDER BY {order_by}
+        LIMIT %s
+    """
+    return book_query, params + [limit + 1]
+
+
+def book_page_results(books, sort, limit):
+    has_more = len(books) > limit
+    books = books[:limit]
+
+    book_info = [row_to_book(row) for row in books]
+    next_cursor = encode_cursor(sort, book_info[-1]) if has_more else None
+    return book_info, next_cursor
+
+
+def book_to_json(book):
+    def entities(mapping):
+        return [{"id": entity_id, "name": name} for entity_id, name in mapping.items()]
+
+    borrower = None
+    if book["borrower"]:
+        (user_id, name), = book["borrower"].items()
+        borrower = {"id": user_id, "name": name}
+
+    return {
+        "book_id": book["book_id"],
+        "title": book["title"],
+        "is_available": book["is_available"],
+        "authors": entities(book["authors"]),
+        "publishers": entities(book["publishers"]),
+        "genres": entities(book["genres"]),
+        "borrower": borrower,
+        "borrow_date": book["borrow_date"].isoformat() if book["borrow_date"] else None,
+        "due_date": book["due_date"].isoformat() if book["due_date"] else None,
+    }
@@ -0,0 +1,342 @@
+import csv
+import io
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+MAX_BULK_ROWS = 5000
+FINE_PER_DAY = 1
+
+BULK_COLUMNS = {
+    "borrow": ("book_id", "user_id", "borrow_date"),
+    "return": ("book_id", "return_date"),
+}
+
+ERROR_MESSAGES = {
+    "duplicate": "Book appears more than once in this batch",
+    "unknown_book": "No such book",
+    "unknown_user": "No such user",
+    "unavailable": "Book is already borrowed",
+    "not_borrowed": "No active borrow record found for this book",
+}
+
+# HTTP status for a rejected single borrow/return
+ERROR_STATUS = {
+    "unknown_book": 404,
+    "unknown_user": 404,
+    "unavailable": 409,
+    "not_borrowed": 409,
+}
+
+
+class FinePolicy:
+    """How late returns are charged: ``per_day`` for every day past the due date
+    after ``grace_days``, capped at ``max_fine`` per loan (None for no cap)."""
+
+    def __init__(self, per_day=FINE_PER_DAY, grace_days=0, max_fine=None):
+        self.per_day = per_day
+        self.grace_days = grace_days
+        self.max_fine = max_fine
+
+    def sql(self, days_late):
+        """SQL expression for the fine of a loan ``days_late`` (an SQL expression) days late.
+
+        Its parameters are ``params()``, in order.
+        """
+        return f"LEAST(ROUND(GREATEST(({days_late}) - %s::int, 0) * %s::numeric, 2), %s::numeric)"
+
+    def params(self):
+        return [self.grace_days, self.per_day, self.max_fine]
+
+    def fine(self, days_late):
+        """The fine sql() charges, computed in Python for loans written without it."""
+        fine = (max(days_late - self.grace_days, 0) * Decimal(str(self.per_day))).quantize(
+            Decimal('0.01'), ROUND_HALF_UP)
+        return fine if self.max_fine is None else min(fine, Decimal(str(self.max_fine)))
+
+    def __repr__(self):
+        return f"FinePolicy(per_day={self.per_day}, grace_days={self.grace_days}, max_fine={self.max_fine})"
+
+
+# Policy used for returns and the overdue sweep; set from [FINES] in config.ini
+fine_policy = FinePolicy()
+
+
+def configure_fines(per_day=FINE_PER_DAY, grace_days=0, max_fine=None):
+    global fine_policy
+    fine_policy = FinePolicy(per_day, grace_days, max_fine)
+
+
+# Lock the affected books, in id order so concurrent batches cannot deadlock, as a
+# statement of its own: the CTE sent after it in the same round trip then runs with
+# a snapshot taken once the locks are held and sees every loan committed before.
+LOCK_BOOKS_QUERY = """
+    SELECT book_id
+    FROM books
+    WHERE book_id = ANY(%s::int[])
+    ORDER BY book_id
+    FOR UPDATE;
+"""
+
+# Then the users whose books_borrowed the batch changes, in id order too: the
+# counted UPDATE would otherwise lock them in join order and overlapping batches
+# could deadlock. Returns find the borrowers through the books locked above.
+LOCK_USERS_QUERY = """
+    SELECT user_id
+    FROM users
+    WHERE user_id = ANY(%s::int[])
+    ORDER BY user_id
+    FOR UPDATE;
+"""
+
+LOCK_BORROWERS_QUERY = """
+    SELECT u.user_id
+    FROM users u
+    WHERE u.user_id IN (
+        SELECT bo.user_id
+        FROM books b
+        JOIN borrows bo ON bo.borrow_id = b.current_borrow_id
+        WHERE b.book_id = ANY(%s::int[])
+    )
+    ORDER BY u.user_id
+    FOR UPDATE;
+"""
+
+
+def read_bulk_rows(request):
+    """Read bulk rows from a JSON body, an uploaded CSV file or a text/csv body."""
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        rows = payload.get('rows') if isinstance(payload, dict) else payload
+        if not isinstance(rows, list):
+            raise ValueError("JSON body must be a list of rows or an object with a 'rows' list")
+        return rows
+
+    upload = request.files.get('file')
+    if upload is not None:
+        text = io.TextIOWrapper(upload.stream, encoding='utf-8-sig')
+    elif request.mimetype == 'text/csv':
+        text = io.StringIO(request.get_data(as_text=True))
+    else:
+        raise ValueError("Send JSON, text/csv, or a multipart upload named 'file'")
+    return list(csv.DictReader(text))
+
+
+def parse_bulk_rows(rows, kind):
+    """Validate raw rows; returns (valid, errors) where valid rows are typed tuples."""
+    if len(rows) > MAX_BULK_ROWS:
+        raise ValueError(f"At most {MAX_BULK_ROWS} rows per request")
+
+    book_column, *other_columns = BULK_COLUMNS[kind]
+    valid = []
+    errors = []
+    for row_no, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append({"row": row_no, "status": "error", "error": "Row must be an object"})
+            continue
+        try:
+            values = [int(row[book_column])]
+            for column in other_columns:
+                if column.endswith('_date'):
+                    values.append(datetime.strptime(str(row[column]).strip(), '%Y-%m-%d').date())
+                else:
+                    values.append(int(row[column]))
+        except KeyError as e:
+            errors.append({"row": row_no, "status": "error", "error": f"Missing column {e.args[0]}"})
+            continue
+        except (TypeError, ValueError) as e:
+            errors.append({"row": row_no, "status": "error", "error": f"Invalid value: {e}"})
+            continue
+        valid.append((row_no, *values))
+    return valid, errors
+
+
+def borrow_books(cursor, rows):
+    """Borrow one or many books atomically in a single round trip.
+
+    ``rows`` are ``(row_no, book_id, user_id, borrow_date)``. A book is only
+    claimed if it is available once its row lock is held, so concurrent
+    borrowers of the same book get a conflict instead of a double loan. The new
+    borrow becomes the book's ``current_borrow_id``. A book
+    listed more than once is only borrowed by its first row. Returns one
+    result per row.
+    """
+    if not rows:
+        return []
+    cursor.execute(*borrow_statement(rows))
+    return borrow_results(cursor.fetchall())
+
+
+def borrow_statement(rows):
+    """``(sql, params)`` of borrow_books; its last result set goes to borrow_results."""
+    row_nos, book_ids, user_ids, borrow_dates = (list(column) for column in zip(*rows))
+
+    borrow_query = """
+        WITH input AS (
+            SELECT *
+            FROM unnest(%s::int[], %s::int[], %s::int[], %s::date[])
+                AS t(row_no, book_id, user_id, borrow_date)
+        ),
+        ranked AS (
+            SELECT i.*, ROW_NUMBER() OVER (PARTITION BY i.book_id ORDER BY i.row_no) AS rn
+            FROM input i
+        ),
+        eligible AS (
+            SELECT r.row_no, r.book_id, r.user_id, r.borrow_date
+            FROM ranked r
+            JOIN users u ON u.user_id = r.user_id
+            JOIN books b ON b.book_id = r.book_id
+            WHERE r.rn = 1 AND b.is_available = TRUE
+        ),
+        inserted AS (
+            INSERT INTO borrows (user_id, book_id, borrow_date, due_date)
+            SELECT e.user_id, e.book_id, e.borrow_date, (e.borrow_date + INTERVAL '1 month')::date
+            FROM eligible e
+            RETURNING borrow_id, book_id, user_id, due_date
+        ),
+        claimed AS (
+            UPDATE books b
+            SET is_available = FALSE, current_borrow_id = i.borrow_id
+            FROM inserted i
+            WHERE b.book_id = i.book_id
+        ),
+        counted AS (
+            UPDATE users u
+            SET books_borrowed = u.books_borrowed + n.borrowed
+            FROM (
+                SELECT i.user_id, COUNT(*) AS borrowed
+                FROM inserted i
+                GROUP BY i.user_id
+            ) n
+            WHERE u.user_id = n.user_id
+        )
+        SELECT
+            r.row_no,
+            r.book_id,
+            r.user_id,
+            i.borrow_id,
+            i.due_date,
+            CASE
+                WHEN i.borrow_id IS NOT NULL THEN NULL
+                WHEN r.rn > 1 THEN 'duplicate'
+                WHEN NOT EXISTS (SELECT 1 FROM books b WHERE b.book_id = r.book_id) THEN 'unknown_book'
+                WHEN NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = r.user_id) THEN 'unknown_user'
+                ELSE 'unavailable'
+            END AS error
+        FROM ranked r
+        LEFT JOIN inserted i ON i.book_id = r.book_id AND r.rn = 1
+        ORDER BY r.row_no
+    """
+    return (LOCK_BOOKS_QUERY + LOCK_USERS_QUERY + borrow_query,
+            (book_ids, user_ids, row_nos, book_ids, user_ids, borrow_dates))
+
+
+def borrow_results(fetched):
+    results = []
+    for row_no, book_id, user_id, borrow_id, due_date, error in fetched:
+        result = {"row": row_no, "book_id": book_id, "user_id": user_id}
+        if error:
+            result.update({"status": "error", "code": error, "error": ERROR_MESSAGES[error]})
+        else:
+            result.update({"status": "ok", "borrow_id": borrow_id, "due_date": due_date.isoformat()})
+        results.append(result)
+    return results
+
+
+def return_books(cursor, rows, policy=None):
+    """Return one or many books atomically in a single round trip.
+
+    ``rows`` are ``(row_no, book_id, return_date)``. Each book's open loan,
+    referenced by ``books.current_borrow_id``, is closed and all fines are
+    computed in SQL with ``policy`` (default: the configured fine_policy).
+    Returns one result per row.
+    """
+    if not rows:
+        return []
+    cursor.execute(*return_statement(rows, policy))
+    return return_results(cursor.fetchall())
+
+
+def return_statement(rows, policy=None):
+    """``(sql, params)`` of return_books; its last result set goes to return_results."""
+    policy = policy or fine_policy
+    row_nos, book_ids, return_dates = (list(column) for column in zip(*rows))
+
+    return_query = f"""
+        WITH input AS (
+            SELECT *
+            FROM unnest(%s::int[], %s::int[], %s::date[])
+                AS t(row_no, book_id, return_date)
+        ),
+        ranked AS (
+            SELECT i.*, ROW_NUMBER() OVER (PARTITION BY i.book_id ORDER BY i.row_no) AS rn
+            FROM input i
+        ),
+        eligible AS (
+            SELECT r.row_no, r.book_id, r.return_date, bo.borrow_id, bo.user_id, bo.due_date
+            FROM ranked r
+            JOIN books b ON b.book_id = r.book_id
+            JOIN borrows bo ON bo.borrow_id = b.current_borrow_id
+            WHERE r.rn = 1
+        ),
+        released AS (
+            UPDATE books b
+            SET is_available = TRUE, current_borrow_id = NULL
+            FROM eligible e
+            WHERE b.book_id = e.book_id
+        ),
+        inserted AS (
+            INSERT INTO returns (borrow_id, return_date, fine, overdue_status)
+            SELECT
+                e.borrow_id,
+                e.return_date,
+                {policy.sql('e.return_date - e.due_date')},
+                e.return_date > e.due_date
+            FROM eligible e
+            RETURNING borrow_id, fine, overdue_status
+        ),
+        counted AS (
+            UPDATE users u
+            SET books_borrowed = u.books_borrowed - n.returned
+            FROM (
+                SELECT e.user_id, COUNT(*) AS returned
+                FROM eligible e
+                GROUP BY e.user_id
+            ) n
+            WHERE u.user_id = n.user_id
+        )
+        SELECT
+            r.row_no,
+            r.book_id,
+            i.borrow_id,
+            i.fine,
+            i.overdue_status,
+            CASE
+                WHEN i.borrow_id IS NOT NULL THEN NULL
+                WHEN r.rn > 1 THEN 'duplicate'
+                WHEN NOT EXISTS (SELECT 1 FROM books b WHERE b.book_id = r.book_id) THEN 'unknown_book'
+                ELSE 'not_borrowed'
+            END AS error
+        FROM ranked r
+        LEFT JOIN eligible e ON e.row_no = r.row_no
+        LEFT JOIN inserted i ON i.borrow_id = e.borrow_id
+        ORDER BY r.row_no
+    """
+    return (LOCK_BOOKS_QUERY + LOCK_BORROWERS_QUERY + return_query,
+            [book_ids, book_ids, row_nos, book_ids, return_dates] + policy.params())
+
+
+def return_results(fetched):
+    results = []
+    for row_no, book_id, borrow_id, fine, overdue_status, error in fetched:
+        result = {"row": row_no, "book_id": book_id}
+        if error:
+            result.update({"status": "error", "code": error, "error": ERROR_MESSAGES[error]})
+        else:
+            result.update({
+                "status": "ok",
+                "borrow_id": borrow_id,
+                "fine": float(fine),
+                "overdue": overdue_status,
+            })
+        results.append(result)
+    return results
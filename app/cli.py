@@ -0,0 +1,262 @@
+import click
+from flask.cli import AppGroup
+
+from . import analytics
+from . import descriptions
+from .db import db_connection
+from .export import EXPORT_FORMATS, EXPORT_KINDS, encode_rows, export_rows, gzip_chunks
+from .importer import (
+    CONFLICT_POLICIES, DEFAULT_CHUNK_SIZE, IMPORT_FORMATS, IMPORT_KINDS, import_records, open_records
+)
+from .migrations import MigrationError, check_query_plans, migrate, migration_status, stamp
+from .notify import announce_change
+from .overdue import DEFAULT_CHUNK_SIZE as SWEEP_CHUNK_SIZE, sweep_overdue
+from . import recommendations
+from .seed import reset_seed_data
+from .synthetic import generate_library
+
+db_cli = AppGroup('db', help="Database schema management.")
+
+
+@db_cli.command('upgrade')
+@click.option('--target', type=int, default=None, help="Stop after this migration version.")
+def db_upgrade(target):
+    """Apply pending schema migrations to the live database."""
+    with db_connection() as conn:
+        try:
+            applied = migrate(conn, target=target)
+        except MigrationError as e:
+            raise click.ClickException(str(e))
+    if applied:
+        click.echo(f"Applied migrations: {', '.join(f'{version:04d}' for version in applied)}")
+    else:
+        click.echo("Database is up to date.")
+
+
+@db_cli.command('status')
+def db_status():
+    """List migrations and whether they have been applied."""
+    with db_connection() as conn:
+        for version, name, applied in migration_status(conn):
+            click.echo(f"[{'x' if applied else ' '}] {version:04d}_{name}")
+
+
+@db_cli.command('stamp')
+@click.argument('version', type=int)
+def db_stamp(version):
+    """Mark migrations up to VERSION as applied without running them."""
+    with db_connection() as conn:
+        stamp(conn, version)
+    click.echo(f"Stamped database at {version:04d}.")
+
+
+@db_cli.command('reset')
+@click.option('--full', is_flag=True, help="Rebuild from the migrations and seed data even if a snapshot is usable.")
+def db_reset(full):
+    """Reset the database to the seed data, from the seed snapshot when possible."""
+    with db_connection() as conn:
+        mode, seconds = reset_seed_data(conn, full=full)
+        announce_change(conn)
+    click.echo(f"Database reset ({mode}) in {seconds * 1000:.0f} ms.")
+
+
+@db_cli.command('generate')
+@click.option('--books', 'book_count', type=click.IntRange(min=1), default=1000, show_default=True)
+@click.option('--users', 'user_count', type=click.IntRange(min=1), default=200, show_default=True)
+@click.option('--authors', 'author_count', type=click.IntRange(min=1), default=None,
+              help="Default: a quarter of the books.")
+@click.option('--publishers', 'publisher_count', type=click.IntRange(min=1), default=None,
+              help="Default: one per 50 books, at most 200.")
+@click.option('--years', type=click.FloatRange(min=0), default=3, show_default=True,
+              help="Years of borrow/return history.")
+@click.option('--loans-per-year', type=click.FloatRange(min=0), default=4, show_default=True,
+              help="Average loans per book and year.")
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Last day of the history (default: today).")
+@click.option('--seed', type=int, default=1, show_default=True)
+@click.confirmation_option(prompt="This replaces all data in the database. Continue?")
+def db_generate(until, **options):
+    """Replace all data with a deterministic synthetic library for benchmarking."""
+    def report(counts):
+        click.echo(f"{counts['books']} books, {counts['borrows']} borrows written")
+
+    with db_connection() as conn:
+        counts, seconds = generate_library(conn, until=until.date() if until else None, progress=report, **options)
+        announce_change(conn)
+    click.echo(f"Generated in {seconds:.1f}s:")
+    for table, count in counts.items():
+        click.echo(f"  {table}: {count}")
+
+
+@db_cli.command('check-plans')
+@click.option('--natural', is_flag=True,
+              help="Let the planner choose freely instead of pricing out sequential scans "
+                   "(only meaningful on large fixtures).")
+def db_check_plans(natural):
+    """EXPLAIN the hot queries and fail if any needs a sequential scan."""
+    with db_connection() as conn, conn.cursor() as cursor:
+        results = check_query_plans(cursor, force_indexes=not natural)
+
+    failed = False
+    for name, seq_scans in results.items():
+        if seq_scans:
+            failed = True
+            click.echo(f"FAIL {name}: sequential scan on {', '.join(sorted(set(seq_scans)))}")
+        else:
+            click.echo(f"ok   {name}")
+    if failed:
+        raise click.ClickException("Hot queries fall back to sequential scans")
+
+
+@db_cli.command('import')
+@click.argument('kind', type=click.Choice(IMPORT_KINDS))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(IMPORT_FORMATS), default=None,
+              help="Input format (default: from the file extension, .gz allowed).")
+@click.option('--chunk-size', type=click.IntRange(min=1), default=DEFAULT_CHUNK_SIZE, show_default=True,
+              help="Rows written and committed per COPY batch.")
+@click.option('--on-conflict', type=click.Choice(CONFLICT_POLICIES), default='skip', show_default=True,
+              help="What to do with a book whose ISBN (or a user whose email) already exists.")
+def db_import(kind, path, fmt, chunk_size, on_conflict):
+    """Stream a CSV or JSON Lines file of books or users into the database.
+
+    Book records have title, isbn, edition, publication_year, shelf_location
+    and authors, publishers and genres (lists, or '|'-separated in CSV).
+    User records have name, email and tel_no.
+    """
+    def report(stats):
+        click.echo(f"{stats['read']} rows read, {stats['inserted']} inserted, "
+                   f"{stats['rows_per_second'] or 0:.0f} rows/s")
+
+    with db_connection() as conn:
+        try:
+            stats = import_records(conn, kind, open_records(path, fmt), chunk_size=chunk_size,
+                                   on_conflict=on_conflict, progress=report)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+        announce_change(conn)
+
+    click.echo(f"Imported {kind} from {path} in {stats['seconds']:.1f}s "
+               f"({stats['rows_per_second'] or 0:.0f} rows/s)")
+    for key, value in stats.items():
+        if key not in ('seconds', 'rows_per_second'):
+            click.echo(f"  {key}: {value}")
+
+
+@db_cli.command('export')
+@click.argument('kind', type=click.Choice(EXPORT_KINDS))
+@click.argument('path', type=click.Path(dir_okay=False, allow_dash=True))
+@click.option('--format', 'fmt', type=click.Choice(EXPORT_FORMATS), default=None,
+              help="Output format (default: from the file extension; csv for stdout).")
+@click.option('--from', 'since', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Only loans borrowed on or after this date.")
+@click.option('--to', 'until', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Only loans borrowed on or before this date.")
+@click.option('--shelf', default=None, help="Only books whose shelf location starts with this (a branch).")
+def db_export(kind, path, fmt, since, until, shelf):
+    """Stream all books (with authors, publishers and genres) or the loan history to PATH.
+
+    PATH ending in .gz is gzipped; '-' writes to stdout. Book exports can be
+    imported again with `flask db import books`.
+    """
+    compress = path.endswith('.gz')
+    name = path[:-3] if compress else path
+    if fmt is None:
+        fmt = 'jsonl' if name.endswith(('.jsonl', '.ndjson')) else 'csv'
+
+    rows = 0
+
+    def counted(source):
+        nonlocal rows
+        for row in source:
+            rows += 1
+            yield row
+
+    with db_connection() as conn, click.open_file(path, 'wb') as f:
+        chunks = encode_rows(kind, fmt, counted(export_rows(
+            conn, kind, since=since.date() if since else None, until=until.date() if until else None, shelf=shelf
+        )))
+        for data in gzip_chunks(chunks) if compress else (chunk.encode('utf-8') for chunk in chunks):
+            f.write(data)
+    click.echo(f"Exported {rows} {kind} to {path}.", err=path == '-')
+
+
+@db_cli.command('sweep-overdue')
+@click.option('--as-of', type=click.DateTime(formats=['%Y-%m-%d']), default=None,
+              help="Day the fines are computed for (default: today).")
+@click.option('--chunk-size', type=click.IntRange(min=1), default=SWEEP_CHUNK_SIZE, show_default=True,
+              help="Open loans updated and committed per batch.")
+def db_sweep_overdue(as_of, chunk_size):
+    """Recompute overdue loans and their accrued fines for the /api/overdue report.
+
+    Meant to run daily from cron or another scheduler; fines follow the
+    [FINES] policy in config.ini.
+    """
+    def report(loans):
+        click.echo(f"{loans} overdue loans swept")
+
+    with db_connection() as conn:
+        summary = sweep_overdue(conn, as_of=as_of.date() if as_of else None, chunk_size=chunk_size, progress=report)
+    click.echo(f"Sweep {summary['sweep_id']} as of {summary['as_of']}: {summary['loans']} overdue loans, "
+               f"{summary['total_fine']} in accrued fines ({summary['seconds']:.1f}s).")
+
+
+@db_cli.command('prefetch-descriptions')
+@click.option('--limit', type=click.IntRange(min=1), default=descriptions.DEFAULT_PREFETCH_BATCH, show_default=True,
+              help="Most entities described in this run.")
+@click.option('--concurrency', type=click.IntRange(min=1), default=2, show_default=True,
+              help="Upstream calls made at once.")
+def db_prefetch_descriptions(limit, concurrency):
+    """Generate viewer descriptions for books, authors, publishers and genres that have none.
+
+    Uses the [DESCRIPTIONS] endpoint in config.ini; stops early if the
+    endpoint keeps failing.
+    """
+    if descriptions.service is None:
+        raise click.ClickException("Descriptions are not configured: set API_URL and API_KEY in [DESCRIPTIONS].")
+    generated, failed = descriptions.prefetch(descriptions.service, limit=limit, concurrency=concurrency)
+    click.echo(f"Generated {generated} descriptions ({failed} failed).")
+
+
+@db_cli.command('build-recommendations')
+@click.option('--full', is_flag=True, help="Recompute every book instead of those affected by new borrows.")
+@click.option('--chunk-size', type=click.IntRange(min=1), default=recommendations.DEFAULT_CHUNK_SIZE,
+              show_default=True, help="Books whose neighbours are computed per sparse product.")
+def db_build_recommendations(full, chunk_size):
+    """Update the "patrons also borrowed" neighbours shown on book pages.
+
+    Without --full only books whose co-borrowers changed since the last
+    build are recomputed. Meant to run from cron or another scheduler, or
+    set REFRESH_INTERVAL in [RECOMMENDATIONS].
+    """
+    with db_connection() as conn:
+        try:
+            summary = recommendations.build_recommendations(conn, full=full, chunk_size=chunk_size)
+        except RuntimeError as e:
+            raise click.ClickException(str(e))
+        if summary is None:
+            click.echo("No borrows since the last build, or the borrows stayed locked.")
+            return
+        announce_change(conn)
+    click.echo(f"Build {summary['build_id']} ({'full' if summary['full'] else 'incremental'}): "
+               f"{summary['recommendations']} neighbours for {summary['books']} books "
+               f"up to borrow {summary['last_borrow_id']} ({summary['seconds']:.1f}s).")
+
+
+@db_cli.command('rollup')
+@click.option('--full', is_flag=True, help="Empty the rollups and count every borrow and return again.")
+@click.option('--chunk-size', type=click.IntRange(min=1), default=analytics.DEFAULT_CHUNK_SIZE,
+              show_default=True, help="Borrow or return ids rolled up per transaction.")
+def db_rollup(full, chunk_size):
+    """Add new borrows and returns to the daily circulation rollups.
+
+    Only rows after the last rolled-up id are read. Meant to run from cron
+    or another scheduler, or set REFRESH_INTERVAL in [ANALYTICS].
+    """
+    with db_connection() as conn:
+        result = analytics.roll_up(conn, full=full, chunk_size=chunk_size)
+    if result is None:
+        raise click.ClickException("Borrows and returns stayed locked by a long transaction; try again later.")
+    counts, seconds = result
+    click.echo(f"Rolled up {counts['borrows']} borrows and {counts['returns']} returns"
+               f"{' (full rebuild)' if full else ''} in {seconds:.1f}s.")
@@ -0,0 +1,271 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+
+from .metrics import record_pool_wait
+
+logger = logging.getLogger(__name__)
+
+
+class PoolTimeout(psycopg2.OperationalError):
+    """Raised when no connection could be checked out before the timeout."""
+
+
+class ConnectionPool:
+    """Thread-safe pool of psycopg2 connections.
+
+    Connections are opened lazily up to ``maxconn``. Checkout blocks for at most
+    ``timeout`` seconds when the pool is exhausted. Connections that sat idle for
+    longer than ``check_interval`` seconds are pinged before being handed out, and
+    idle connections above ``minconn`` are closed after ``max_idle`` seconds.
+    """
+
+    def __init__(self, minconn, maxconn, timeout, check_interval=30, max_idle=300, **dsn):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Invalid pool size: min={minconn}, max={maxconn}")
+
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.max_idle = max_idle
+        self.pid = os.getpid()
+
+        self._dsn = dsn
+        self._idle = deque()  # (connection, returned_at), most recently used on the right
+        self._size = 0
+        self._in_use = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self._counters = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "connects": 0,
+            "discarded": 0,
+            "failed_checks": 0,
+            "wait_seconds": 0.0,
+        }
+
+    def _connect(self):
+        conn = psycopg2.connect(**self._dsn)
+        with self._cond:
+            self._counters["connects"] += 1
+        logger.debug("Opened new pooled database connection.")
+        return conn
+
+    def _close(self, conn):
+        try:
+            conn.close()
+        except psycopg2.Error as e:
+            logger.warning("Error closing pooled connection: %s", e)
+
+    def _is_healthy(self, conn, idle_for):
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if idle_for < self.check_interval:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def warm(self):
+        """Open connections until ``minconn`` are idle in the pool."""
+        while True:
+            with self._cond:
+                if self._closed or self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except psycopg2.Error:
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+                raise
+            with self._cond:
+                self._idle.append((conn, time.monotonic()))
+                self._cond.notify()
+
+    def getconn(self):
+        started = time.monotonic()
+        deadline = started + self.timeout
+        conn = None
+
+        with self._cond:
+            while True:
+                if self._closed:
+                    raise psycopg2.OperationalError("Connection pool is closed")
+                if self._idle:
+                    conn, returned_at = self._idle.pop()
+                    break
+                if self._size < self.maxconn:
+                    self._size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._counters["timeouts"] += 1
+                    raise PoolTimeout(
+                        f"Timed out after {self.timeout}s waiting for a database connection "
+                        f"({self._size} open, {self._in_use} in use)"
+                    )
+                self._cond.wait(remaining)
+
+            self._in_use += 1
+            self._counters["checkouts"] += 1
+            self._counters["wait_seconds"] += time.monotonic() - started
+
+        try:
+            if conn is not None and not self._is_healthy(conn, time.monotonic() - returned_at):
+                with self._cond:
+                    self._counters["failed_checks"] += 1
+                    self._counters["discarded"] += 1
+                logger.warning("Discarding broken pooled connection.")
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self._connect()
+        except psycopg2.Error:
+            with self._cond:
+                self._size -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        return conn
+
+    def putconn(self, conn, discard=False):
+        if not discard and not conn.closed:
+            status = conn.info.transaction_status
+            if status != extensions.TRANSACTION_STATUS_IDLE:
+                try:
+                    conn.rollback()
+                except psycopg2.Error:
+                    discard = True
+            if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                discard = True
+
+        now = time.monotonic()
+        to_close = []
+        with self._cond:
+            self._in_use -= 1
+            if discard or conn.closed or self._closed:
+                self._size -= 1
+                self._counters["discarded"] += 1
+                to_close.append(conn)
+            else:
+                self._idle.append((conn, now))
+
+            # Trim connections that have been idle too long, oldest first
+            while len(self._idle) > self.minconn and now - self._idle[0][1] > self.max_idle:
+                stale, _ = self._idle.popleft()
+                self._size -= 1
+                to_close.append(stale)
+            self._cond.notify()
+
+        for stale in to_close:
+            self._close(stale)
+
+    def closeall(self):
+        with self._cond:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._size -= len(idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._counters)
+            stats.update({
+                "min": self.minconn,
+                "max": self.maxconn,
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+            })
+        stats["wait_seconds"] = round(stats["wait_seconds"], 6)
+        return stats
+
+
+_pool = None
+_pool_settings = None
+_pool_lock = threading.Lock()
+
+# Pools inherited across fork() are kept referenced but never used or closed:
+# deallocating their connections would terminate the parent's sessions.
+_inherited_pools = []
+
+
+def configure_pool(minconn, maxconn, timeout, check_interval=30, max_idle=300, **dsn):
+    """Store pool settings; the pool itself is created on first use."""
+    global _pool_settings
+    _pool_settings = dict(
+        minconn=minconn,
+        maxconn=maxconn,
+        timeout=timeout,
+        check_interval=check_interval,
+        max_idle=max_idle,
+        **dsn
+    )
+
+
+def get_pool():
+    global _pool
+    pool = _pool
+    if pool is not None and pool.pid == os.getpid():
+        return pool
+
+    with _pool_lock:
+        if _pool is None or _pool.pid != os.getpid():
+            if _pool is not None:
+                _inherited_pools.append(_pool)
+            if _pool_settings is None:
+                raise RuntimeError("Connection pool has not been configured")
+            _pool = ConnectionPool(**_pool_settings)
+            try:
+                _pool.warm()
+            except psycopg2.Error as e:
+                logger.error("Could not open initial pool connections: %s", e)
+            else:
+                logger.info("Database connection pool ready (min=%d, max=%d).", _pool.minconn, _pool.maxconn)
+        return _pool
+
+
+def close_pool():
+    """Close this process's pool, e.g. when a server worker exits."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None and _pool.pid == os.getpid():
+            _pool.closeall()
+            _pool = None
+
+
+@contextmanager
+def db_connection():
+    """Check out a pooled connection and always hand it back.
+
+    Any open transaction is rolled back on return, so callers must commit
+    explicitly; a connection left in a broken state is discarded.
+    """
+    pool = get_pool()
+    started = time.perf_counter()
+    conn = pool.getconn()
+    record_pool_wait(time.perf_counter() - started)
+    try:
+        yield conn
+    finally:
+        pool.putconn(conn)
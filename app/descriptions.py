@@ -0,0 +1,375 @@
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+
+import requests
+
+from .db import db_connection
+
+logger = logging.getLogger(__name__)
+
+# Entities that get a description, with the table, key and name column they are read from
+DESCRIBED_ENTITIES = {
+    "book": ("books", "book_id", "title"),
+    "author": ("authors", "author_id", "name"),
+    "publisher": ("publishers", "publisher_id", "name"),
+    "genre": ("genres", "genre_id", "name"),
+}
+
+PROMPT = (
+    "Provide a detailed description of the {kind} '{name}'. "
+    "If it is a book include information about the setting, characters, themes, key concepts, and its influence. "
+    "Do not include any concluding remarks or questions."
+)
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_WORKERS = 4
+DEFAULT_MAX_PENDING = 64
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_RESET_SECONDS = 30
+DEFAULT_PREFETCH_BATCH = 100
+
+# Advisory lock held during a background prefetch pass, so with several app
+# processes only one of them prefetches at a time
+PREFETCH_LOCK_ID = 7_201_302
+
+# The configured DescriptionService, or None while descriptions are off; see configure()
+service = None
+
+
+class DescriptionUnavailable(Exception):
+    """No description can be had right now: the upstream failed, timed out or is being spared."""
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Stop calling a failing upstream for a while.
+
+    After ``threshold`` consecutive failures the circuit opens and calls are
+    refused for ``reset_seconds``. Then a single trial call is let through:
+    its success closes the circuit, its failure opens it again.
+    """
+
+    def __init__(self, threshold=DEFAULT_FAILURE_THRESHOLD, reset_seconds=DEFAULT_RESET_SECONDS):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            if self._trial or time.monotonic() - self._opened_at >= self.reset_seconds:
+                return "half-open"
+            return "open"
+
+    def allow(self):
+        """Whether a call may go upstream now; the caller must record its outcome."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.reset_seconds:
+                return False
+            self._trial = True
+            return True
+
+    def retry_after(self):
+        with self._lock:
+            if self._opened_at is None:
+                return 0
+            return max(1, round(self.reset_seconds - (time.monotonic() - self._opened_at)))
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial or (self._opened_at is None and self._failures >= self.threshold):
+                logger.warning("Description upstream failed %d times in a row; pausing calls for %ss.",
+                               self._failures, self.reset_seconds)
+                self._opened_at = time.monotonic()
+            self._trial = False
+
+
+class DescriptionClient:
+    """Calls the model endpoint (Gemini ``generateContent`` or anything answering like it)."""
+
+    def __init__(self, url, api_key, timeout=DEFAULT_TIMEOUT):
+        self.url = url
+        self.api_key = api_key
+        self.timeout = timeout
+        # requests sessions are not safe to share between threads; keep one per worker
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def describe(self, kind, name):
+        """Generate a description; raises requests.RequestException or ValueError."""
+        payload = {"contents": [{"parts": [{"text": PROMPT.format(kind=kind, name=name)}]}]}
+        # The key goes in a header, so it never shows up in logged URLs
+        response = self._session().post(
+            self.url, headers={"x-goog-api-key": self.api_key}, json=payload, timeout=self.timeout
+        )
+        response.raise_for_status()
+        data = response.json()
+        try:
+            text = data["candidates"][0]["content"]["parts"][0]["text"]
+        except (KeyError, IndexError, TypeError):
+            raise ValueError("Unexpected response shape from the description endpoint")
+        if not isinstance(text, str) or not text.strip():
+            raise ValueError("Empty description from the description endpoint")
+        return text
+
+
+class DescriptionService:
+    """Descriptions of catalog entities, generated once and kept in ``entity_descriptions``.
+
+    A stored description is served while the entity's name is unchanged.
+    Otherwise one upstream call per entity is made on a pool of ``workers``
+    threads; concurrent requests for the same entity wait on that call
+    instead of making their own. At most ``max_pending`` calls are queued or
+    running, and a CircuitBreaker stops calls to an upstream that keeps
+    failing. Viewers wait ``timeout`` seconds; a call that takes longer still
+    finishes and is stored for the next one.
+    """
+
+    def __init__(self, client, workers=DEFAULT_WORKERS, timeout=DEFAULT_TIMEOUT,
+                 max_pending=DEFAULT_MAX_PENDING, breaker=None):
+        self.client = client
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='description')
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._counters = {
+            "hits": 0,
+            "misses": 0,
+            "coalesced": 0,
+            "upstream_calls": 0,
+            "upstream_failures": 0,
+            "rejected": 0,
+        }
+
+    def describe(self, entity_type, entity_id):
+        """``(description, cached)`` for an entity, or None if it does not exist.
+
+        Raises DescriptionUnavailable if it has to be generated and cannot be.
+        """
+        table, key, name_column = DESCRIBED_ENTITIES[entity_type]
+        with db_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(f"""
+                SELECT e.{name_column}, d.name, d.description
+                FROM {table} e
+                LEFT JOIN entity_descriptions d ON d.entity_type = %s AND d.entity_id = e.{key}
+                WHERE e.{key} = %s
+            """, (entity_type, entity_id))
+            row = cursor.fetchone()
+        if row is None:
+            return None
+
+        name, described_name, description = row
+        if description is not None and described_name == name:
+            with self._lock:
+                self._counters["hits"] += 1
+            return description, True
+
+        with self._lock:
+            self._counters["misses"] += 1
+        future = self.fetch(entity_type, entity_id, name)
+        try:
+            return future.result(timeout=self.timeout), False
+        except FutureTimeout:
+            raise DescriptionUnavailable("Timed out waiting for the description",
+                                         retry_after=math.ceil(self.timeout))
+
+    def fetch(self, entity_type, entity_id, name):
+        """Start (or join) the upstream call for an entity; returns its Future.
+
+        The Future's result is the description; it raises DescriptionUnavailable
+        if the call failed.
+        """
+        entity = (entity_type, entity_id)
+        with self._lock:
+            future = self._inflight.get(entity)
+            if future is not None:
+                self._counters["coalesced"] += 1
+                return future
+            if len(self._inflight) >= self.max_pending:
+                self._counters["rejected"] += 1
+                raise DescriptionUnavailable("Too many descriptions are being generated", retry_after=1)
+            if not self.breaker.allow():
+                self._counters["rejected"] += 1
+                raise DescriptionUnavailable("The description service is unavailable",
+                                             retry_after=self.breaker.retry_after())
+            future = self._executor.submit(self._generate, entity_type, entity_id, name)
+            self._inflight[entity] = future
+        future.add_done_callback(lambda _: self._forget(entity))
+        return future
+
+    def _forget(self, entity):
+        with self._lock:
+            self._inflight.pop(entity, None)
+
+    def _generate(self, entity_type, entity_id, name):
+        with self._lock:
+            self._counters["upstream_calls"] += 1
+        try:
+            description = self.client.describe(entity_type, name)
+        except (requests.RequestException, ValueError) as e:
+            self.breaker.record_failure()
+            with self._lock:
+                self._counters["upstream_failures"] += 1
+            logger.warning("Description of %s %s failed: %s", entity_type, entity_id, e)
+            raise DescriptionUnavailable("The description could not be generated",
+                                         retry_after=self.breaker.retry_after() or None)
+        self.breaker.record_success()
+
+        try:
+            with db_connection() as conn, conn.cursor() as cursor:
+                cursor.execute("""
+                    INSERT INTO entity_descriptions (entity_type, entity_id, name, description)
+                    VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (entity_type, entity_id) DO UPDATE SET
+                        name = EXCLUDED.name,
+                        description = EXCLUDED.description,
+                        fetched_at = now()
+                """, (entity_type, entity_id, name, description))
+                conn.commit()
+        except Exception as e:
+            # Still worth returning; the next viewer generates it again
+            logger.error("Storing the description of %s %s failed: %s", entity_type, entity_id, e)
+        return description
+
+    def shutdown(self):
+        """Stop taking calls; calls already running finish in the background."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters)
+            stats["inflight"] = len(self._inflight)
+        stats["circuit"] = self.breaker.state
+        return stats
+
+
+def configure(url, api_key, timeout=DEFAULT_TIMEOUT, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+              failure_threshold=DEFAULT_FAILURE_THRESHOLD, reset_seconds=DEFAULT_RESET_SECONDS):
+    """Set up the module's DescriptionService; descriptions stay off without a URL and key."""
+    global service
+    if not url or not api_key:
+        service = None
+        return None
+    service = DescriptionService(
+        DescriptionClient(url, api_key, timeout=timeout),
+        workers=workers,
+        timeout=timeout,
+        max_pending=max_pending,
+        breaker=CircuitBreaker(failure_threshold, reset_seconds),
+    )
+    return service
+
+
+def undescribed_entities(cursor, limit):
+    """Up to ``limit`` ``(entity_type, entity_id, name)`` with no current description, books first."""
+    found = []
+    for entity_type, (table, key, name_column) in DESCRIBED_ENTITIES.items():
+        if len(found) >= limit:
+            break
+        cursor.execute(f"""
+            SELECT e.{key}, e.{name_column}
+            FROM {table} e
+            LEFT JOIN entity_descriptions d ON d.entity_type = %s AND d.entity_id = e.{key}
+            WHERE d.entity_id IS NULL OR d.name <> e.{name_column}
+            ORDER BY e.{key}
+            LIMIT %s
+        """, (entity_type, limit - len(found)))
+        found += [(entity_type, entity_id, name) for entity_id, name in cursor.fetchall()]
+    return found
+
+
+def prefetch(description_service, limit=DEFAULT_PREFETCH_BATCH, concurrency=2):
+    """Generate descriptions for up to ``limit`` undescribed catalog entities.
+
+    Runs at most ``concurrency`` upstream calls at a time, leaving the rest of
+    the service's workers to viewers, and stops early when the circuit opens.
+    Returns ``(generated, failed)``.
+    """
+    with db_connection() as conn, conn.cursor() as cursor:
+        pending = undescribed_entities(cursor, limit)
+
+    generated = failed = 0
+    running = set()
+    for entity_type, entity_id, name in pending:
+        if len(running) >= concurrency:
+            done, running = wait(running, return_when='FIRST_COMPLETED')
+            for future in done:
+                if future.exception() is None:
+                    generated += 1
+                else:
+                    failed += 1
+        try:
+            running.add(description_service.fetch(entity_type, entity_id, name))
+        except DescriptionUnavailable as e:
+            logger.info("Description prefetch stopped: %s", e)
+            break
+
+    for future in wait(running).done:
+        if future.exception() is None:
+            generated += 1
+        else:
+            failed += 1
+    return generated, failed
+
+
+class Prefetcher(threading.Thread):
+    """Background thread that runs prefetch() every ``interval`` seconds.
+
+    Passes in different processes take turns through an advisory lock.
+    """
+
+    def __init__(self, description_service, interval, batch=DEFAULT_PREFETCH_BATCH):
+        super().__init__(name='description-prefetch', daemon=True)
+        self.description_service = description_service
+        self.interval = interval
+        self.batch = batch
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                with db_connection() as conn, conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s)", (PREFETCH_LOCK_ID,))
+                    if not cursor.fetchone()[0]:
+                        continue
+                    try:
+                        generated, failed = prefetch(self.description_service, limit=self.batch)
+                    finally:
+                        cursor.execute("SELECT pg_advisory_unlock(%s)", (PREFETCH_LOCK_ID,))
+                        conn.commit()
+            except Exception as e:
+                if not self._stopped.is_set():
+                    logger.error("Description prefetch failed: %s", e)
+                continue
+            if generated or failed:
+                logger.info("Prefetched %d descriptions (%d failed).", generated, failed)
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,198 @@
+import csv
+import io
+import json
+import uuid
+import zlib
+from datetime import date
+
+from .importer import LIST_SEPARATOR
+
+EXPORT_KINDS = ('books', 'loans')
+EXPORT_FORMATS = ('csv', 'jsonl')
+
+# Rows fetched from the server-side cursor per round trip
+FETCH_SIZE = 2000
+
+# Encoded output is handed on in pieces of about this many bytes
+CHUNK_BYTES = 64 * 1024
+
+# Exports streamed at once by one server process: each holds a database
+# connection for as long as the client takes to download it
+MAX_CONCURRENT_EXPORTS = 2
+RETRY_AFTER_SECONDS = 30
+
+MEDIA_TYPES = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+# Column order of each export. Book exports use the import field names, so a
+# dump can be imported again with `flask db import books`.
+COLUMNS = {
+    'books': ('book_id', 'title', 'isbn', 'edition', 'publication_year', 'shelf_location', 'is_available',
+              'authors', 'publishers', 'genres'),
+    'loans': ('borrow_id', 'book_id', 'title', 'isbn', 'shelf_location', 'user_id', 'user_name', 'user_email',
+              'borrow_date', 'due_date', 'return_date', 'fine', 'overdue_status'),
+}
+
+# List columns, written '|'-separated in CSV and as arrays in JSON Lines
+LIST_COLUMNS = ('authors', 'publishers', 'genres')
+
+
+def _parse_date(args, name):
+    value = args.get(name)
+    if not value:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a date (YYYY-MM-DD)")
+
+
+def parse_export_args(args):
+    """Validate export filter query parameters; raises ValueError."""
+    since = _parse_date(args, 'from')
+    until = _parse_date(args, 'to')
+    if since and until and since > until:
+        raise ValueError("from must not be after to")
+    shelf = args.get('shelf') or None
+    if shelf is not None and len(shelf) > 10:
+        raise ValueError("shelf must be at most 10 characters")
+    return {"since": since, "until": until, "shelf": shelf}
+
+
+def _export_query(kind, since=None, until=None, shelf=None):
+    conditions = []
+    params = []
+    if shelf is not None:
+        # A shelf prefix selects a whole branch: 'A' matches A1, A2, ...
+        conditions.append("b.shelf_location LIKE %s")
+        params.append(shelf.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+
+    if kind == 'books':
+        where = "WHERE " + " AND ".join(conditions) if conditions else ""
+        query = f"""
+            SELECT
+                b.book_id,
+                b.title,
+                b.isbn,
+                b.edition,
+                b.publication_year,
+                b.shelf_location,
+                b.is_available,
+                ARRAY(SELECT e->>'name' FROM jsonb_array_elements(c.authors) e),
+                ARRAY(SELECT e->>'name' FROM jsonb_array_elements(c.publishers) e),
+                ARRAY(SELECT e->>'name' FROM jsonb_array_elements(c.genres) e)
+            FROM books b
+            LEFT JOIN catalog_entries c ON c.book_id = b.book_id
+            {where}
+            ORDER BY b.book_id
+        """
+        return query, params
+
+    if since is not None:
+        conditions.append("bo.borrow_date >= %s")
+        params.append(since)
+    if until is not None:
+        conditions.append("bo.borrow_date <= %s")
+        params.append(until)
+    where = "WHERE " + " AND ".join(conditions) if conditions else ""
+    query = f"""
+        SELECT
+            bo.borrow_id,
+            bo.book_id,
+            b.title,
+            b.isbn,
+            b.shelf_location,
+            bo.user_id,
+            u.name,
+            u.email,
+            bo.borrow_date::text,
+            bo.due_date::text,
+            r.return_date::text,
+            r.fine::text,
+            r.overdue_status
+        FROM borrows bo
+        JOIN books b ON b.book_id = bo.book_id
+        JOIN users u ON u.user_id = bo.user_id
+        LEFT JOIN returns r ON r.borrow_id = bo.borrow_id
+        {where}
+        ORDER BY bo.borrow_id
+    """
+    return query, params
+
+
+def export_rows(conn, kind, since=None, until=None, shelf=None, fetch_size=FETCH_SIZE):
+    """Yield the rows of an export as tuples in ``COLUMNS[kind]`` order.
+
+    The rows come from a server-side cursor ``fetch_size`` at a time, so
+    memory stays constant however large the tables are; they all come from
+    one snapshot. ``since``/``until`` limit loans by borrow date and
+    ``shelf`` limits both exports to shelf locations starting with it.
+    Dates and fines come as text: they are only written out again, so
+    converting them to Python objects would be wasted work.
+    """
+    if kind not in EXPORT_KINDS:
+        raise ValueError(f"kind must be one of: {', '.join(EXPORT_KINDS)}")
+    query, params = _export_query(kind, since, until, shelf)
+    try:
+        with conn.cursor(name=f"export_{kind}_{uuid.uuid4().hex[:8]}") as cursor:
+            cursor.itersize = fetch_size
+            cursor.execute(query, params)
+            yield from cursor
+    finally:
+        conn.rollback()
+
+
+def _chunked(pieces):
+    """Join small strings into pieces of about CHUNK_BYTES."""
+    buffer = []
+    size = 0
+    for piece in pieces:
+        buffer.append(piece)
+        size += len(piece)
+        if size >= CHUNK_BYTES:
+            yield ''.join(buffer)
+            buffer = []
+            size = 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def encode_rows(kind, fmt, rows):
+    """Encode export rows as CSV (with a header) or JSON Lines, yielding text chunks."""
+    columns = COLUMNS[kind]
+    lists = [index for index, column in enumerate(columns) if column in LIST_COLUMNS]
+
+    if fmt == 'jsonl':
+        def lines():
+            for row in rows:
+                yield json.dumps(dict(zip(columns, row)), ensure_ascii=False, default=str) + '\n'
+        return _chunked(lines())
+
+    def chunks():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for row in rows:
+            if lists:
+                row = list(row)
+                for index in lists:
+                    row[index] = LIST_SEPARATOR.join(row[index] or ())
+            writer.writerow(row)
+            if buffer.tell() >= CHUNK_BYTES:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    return chunks()
+
+
+def gzip_chunks(chunks, level=6):
+    """Compress text chunks into a gzip stream, yielding bytes."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
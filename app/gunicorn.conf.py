@@ -0,0 +1,53 @@
+"""Gunicorn settings for production serving.
+
+Run from the app directory (the container's working directory):
+
+    gunicorn -c gunicorn.conf.py
+
+Each worker imports the app after it is forked, so configuration, the
+connection pool, the caches and background threads belong to that worker and
+no database socket is shared between processes. A worker warms its caches
+before it accepts its first request and is replaced, gracefully, after
+serving about GUNICORN_MAX_REQUESTS requests. Settings come from the
+environment so the same file serves every deployment.
+"""
+import multiprocessing
+import os
+
+# The app is the package `app`; it is imported from the directory above
+wsgi_app = 'app.app:app'
+pythonpath = '..'
+
+bind = os.environ.get('GUNICORN_BIND', '0.0.0.0:5000')
+
+# One process per core; threads cover the time requests spend waiting on Postgres.
+# Each worker has its own pool of up to DB_POOL_MAX connections (config.ini).
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+# Never import the app in the master: pools, caches and threads must not be inherited
+preload_app = False
+
+# Recycle workers gracefully, staggered so they do not all restart at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = max_requests // 10
+graceful_timeout = 30
+timeout = 30
+keepalive = 5
+
+
+def post_worker_init(worker):
+    # Runs in the worker once the app is loaded, before it accepts connections
+    from app.app import warm_up
+    try:
+        seconds = warm_up()
+    except Exception as e:
+        worker.log.error("Worker %s warm-up failed, serving cold: %s", worker.pid, e)
+    else:
+        worker.log.info("Worker %s warmed up in %.0f ms", worker.pid, seconds * 1000)
+
+
+def worker_exit(server, worker):
+    from app.app import shut_down
+    shut_down()
@@ -0,0 +1,388 @@
+import csv
+import gzip
+import io
+import json
+import logging
+import time
+
+from .catalog import refresh_catalog_entries
+
+logger = logging.getLogger(__name__)
+
+IMPORT_KINDS = ('books', 'users')
+IMPORT_FORMATS = ('csv', 'jsonl')
+CONFLICT_POLICIES = ('skip', 'update')
+DEFAULT_CHUNK_SIZE = 10000
+
+# Separates names in the authors/publishers/genres columns of a CSV file
+LIST_SEPARATOR = '|'
+
+# Only the first few rejected records are logged individually
+MAX_LOGGED_REJECTS = 20
+
+# Column lengths from the schema; longer values are rejected rather than truncated
+FIELD_LIMITS = {
+    "books": {"title": 255, "isbn": 20, "shelf_location": 10},
+    "users": {"name": 100, "email": 100, "tel_no": 20},
+}
+
+# Record field -> (table, id column, link table, longest name)
+RELATIONS = {
+    "authors": ("authors", "author_id", "book_authors", 100),
+    "publishers": ("publishers", "publisher_id", "book_publishers", 100),
+    "genres": ("genres", "genre_id", "book_genres", 50),
+}
+
+BOOK_COLUMNS = ("title", "edition", "isbn", "publication_year", "shelf_location")
+USER_COLUMNS = ("name", "email", "tel_no")
+
+STAGING_TABLES = {
+    "books": """
+        CREATE TEMP TABLE import_books (
+            row_no INT,
+            title VARCHAR(255),
+            edition INT,
+            isbn VARCHAR(20),
+            publication_year INT,
+            shelf_location VARCHAR(10)
+        );
+        CREATE TEMP TABLE import_links (book_id INT, ref_id INT);
+    """,
+    "users": """
+        CREATE TEMP TABLE import_users (
+            row_no INT,
+            name VARCHAR(100),
+            email VARCHAR(100),
+            tel_no VARCHAR(20)
+        );
+    """,
+}
+
+DROP_STAGING_TABLES = "DROP TABLE IF EXISTS import_books, import_links, import_users"
+
+# Tables whose planner statistics go stale while an import grows them
+ANALYZE_TABLES = {
+    "books": "ANALYZE books, authors, publishers, genres, book_authors, book_publishers, book_genres",
+    "users": "ANALYZE users",
+}
+
+# Books on loan to any of the given users, whose catalog_entries rows show the borrower's name
+OPEN_LOAN_BOOKS_QUERY = """
+    SELECT b.book_id
+    FROM borrows bo
+    JOIN books b ON b.current_borrow_id = bo.borrow_id
+    WHERE bo.user_id = ANY(%s::int[])
+"""
+
+
+def open_records(path, fmt=None):
+    """Yield the records of a CSV or JSON Lines file (optionally gzipped) one at a time."""
+    name = path[:-3] if path.endswith('.gz') else path
+    if fmt is None:
+        fmt = 'csv' if name.endswith('.csv') else 'jsonl'
+    opener = gzip.open if path.endswith('.gz') else open
+
+    with opener(path, 'rt', encoding='utf-8-sig', newline='') as f:
+        if fmt == 'csv':
+            yield from csv.DictReader(f)
+            return
+        for line_no, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise ValueError(f"{path}:{line_no}: invalid JSON")
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_rows(cursor, table, columns, rows):
+    """Load ``rows`` (tuples in ``columns`` order) into ``table`` with one COPY."""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(value) for value in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = ' '.join(str(value).split())
+    return value or None
+
+
+def _int(value):
+    value = _text(value)
+    return int(value) if value is not None else None
+
+
+def _names(value):
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.split(LIST_SEPARATOR)
+    names = []
+    for name in value:
+        name = _text(name)
+        if name and name not in names:
+            names.append(name)
+    return names
+
+
+def _name_key(name):
+    return ' '.join(name.split()).casefold()
+
+
+def _check_lengths(kind, record):
+    for field, limit in FIELD_LIMITS[kind].items():
+        if record[field] is not None and len(record[field]) > limit:
+            raise ValueError(f"{field} longer than {limit} characters")
+
+
+def normalize_isbn(value):
+    """Strip hyphens and spaces so the same ISBN written differently still conflicts."""
+    if value is None:
+        return None
+    return ''.join(ch for ch in str(value) if ch.isalnum()).upper() or None
+
+
+def parse_book(record):
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+    book = {
+        "title": _text(record.get('title')),
+        "edition": _int(record.get('edition')),
+        "isbn": normalize_isbn(record.get('isbn')),
+        "publication_year": _int(record.get('publication_year')),
+        "shelf_location": _text(record.get('shelf_location')),
+    }
+    if not book["title"]:
+        raise ValueError("missing title")
+    if not book["isbn"]:
+        raise ValueError("missing isbn")
+    _check_lengths('books', book)
+
+    for field, (_, _, _, limit) in RELATIONS.items():
+        book[field] = _names(record.get(field))
+        if any(len(name) > limit for name in book[field]):
+            raise ValueError(f"{field} name longer than {limit} characters")
+    return book
+
+
+def parse_user(record):
+    if not isinstance(record, dict):
+        raise ValueError("record must be an object")
+    user = {
+        "name": _text(record.get('name')),
+        "email": _text(record.get('email')),
+        "tel_no": _text(record.get('tel_no')),
+    }
+    if not user["name"]:
+        raise ValueError("missing name")
+    if not user["email"]:
+        raise ValueError("missing email")
+    _check_lengths('users', user)
+    return user
+
+
+class NameLookup:
+    """In-memory name -> id table for authors, publishers or genres.
+
+    Names are matched case- and whitespace-insensitively. Missing names get ids
+    from the table's sequence and are written with a single COPY per chunk.
+    """
+
+    def __init__(self, table, id_column):
+        self.table = table
+        self.id_column = id_column
+        self.ids = {}
+        self.created = 0
+
+    def load(self, cursor):
+        cursor.execute(f"SELECT {self.id_column}, name FROM {self.table} ORDER BY {self.id_column}")
+        for ref_id, name in cursor.fetchall():
+            self.ids.setdefault(_name_key(name), ref_id)
+
+    def resolve(self, cursor, names):
+        missing = {}
+        for name in names:
+            key = _name_key(name)
+            if key not in self.ids and key not in missing:
+                missing[key] = name
+        if not missing:
+            return
+
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, %s)) FROM generate_series(1, %s)",
+            (self.table, self.id_column, len(missing))
+        )
+        new_ids = [row[0] for row in cursor.fetchall()]
+        copy_rows(cursor, self.table, (self.id_column, 'name'), zip(new_ids, missing.values()))
+        self.ids.update(zip(missing, new_ids))
+        self.created += len(new_ids)
+
+    def id(self, name):
+        return self.ids[_name_key(name)]
+
+
+def _dedupe(chunk, key, on_conflict, stats):
+    # Repeated keys: the first occurrence wins when skipping, the last when updating
+    records = {}
+    for record in chunk:
+        if record[key] in records:
+            stats["duplicates"] += 1
+            if on_conflict == 'skip':
+                continue
+        records[record[key]] = record
+    return list(records.values())
+
+
+def _upsert(cursor, table, id_column, columns, key, rows, on_conflict, stats):
+    """Stage ``rows`` with COPY and merge them into ``table``; returns ``[(id, key)]`` written."""
+    staging = f"import_{table}"
+    cursor.execute(f"TRUNCATE {staging}")
+    copy_rows(cursor, staging, ('row_no', *columns), (
+        (row_no, *(row[column] for column in columns)) for row_no, row in enumerate(rows)
+    ))
+
+    if on_conflict == 'update':
+        updates = ', '.join(f"{column} = EXCLUDED.{column}" for column in columns if column != key)
+        conflict = f"DO UPDATE SET {updates}"
+    else:
+        conflict = "DO NOTHING"
+    cursor.execute(f"""
+        INSERT INTO {table} ({', '.join(columns)})
+        SELECT {', '.join(columns)}
+        FROM {staging}
+        ORDER BY row_no
+        ON CONFLICT ({key}) {conflict}
+        RETURNING {id_column}, {key}, (xmax = 0) AS inserted
+    """)
+    written = cursor.fetchall()
+
+    inserted = sum(1 for _, _, is_new in written if is_new)
+    stats["inserted"] += inserted
+    stats["updated"] += len(written) - inserted
+    stats["skipped"] += len(rows) - len(written)
+    return [(row_id, row_key) for row_id, row_key, _ in written]
+
+
+def _load_books(cursor, chunk, lookups, on_conflict, stats):
+    """Write a chunk of books and their links; returns the ids of the books written."""
+    books = _dedupe(chunk, 'isbn', on_conflict, stats)
+    written = _upsert(cursor, 'books', 'book_id', BOOK_COLUMNS, 'isbn', books, on_conflict, stats)
+    book_ids = {isbn: book_id for book_id, isbn in written}
+    written = [book for book in books if book['isbn'] in book_ids]
+
+    # Links are only ever added; an updated book keeps the ones it already had
+    for field, (_, id_column, link_table, _) in RELATIONS.items():
+        lookup = lookups[field]
+        lookup.resolve(cursor, (name for book in written for name in book[field]))
+        links = {(book_ids[book['isbn']], lookup.id(name)) for book in written for name in book[field]}
+        if not links:
+            continue
+        cursor.execute("TRUNCATE import_links")
+        copy_rows(cursor, 'import_links', ('book_id', 'ref_id'), links)
+        cursor.execute(f"""
+            INSERT INTO {link_table} (book_id, {id_column})
+            SELECT book_id, ref_id FROM import_links
+            ON CONFLICT DO NOTHING
+        """)
+
+    return list(book_ids.values())
+
+
+def _load_users(cursor, chunk, on_conflict, stats):
+    """Write a chunk of users; returns the ids of the books they have on loan, if any was updated."""
+    users = _dedupe(chunk, 'email', on_conflict, stats)
+    written = _upsert(cursor, 'users', 'user_id', USER_COLUMNS, 'email', users, on_conflict, stats)
+    if on_conflict != 'update' or not written:
+        return []
+
+    # An updated user may have been renamed: their open loans show the name in catalog_entries
+    cursor.execute(OPEN_LOAN_BOOKS_QUERY, ([user_id for user_id, _ in written],))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def import_records(conn, kind, records, chunk_size=DEFAULT_CHUNK_SIZE, on_conflict='skip', progress=None):
+    """Stream ``records`` of ``kind`` ('books' or 'users') into the database.
+
+    Records are parsed and validated one at a time and written in chunks of
+    ``chunk_size``: each chunk is COPYed into a staging table and merged with
+    one INSERT ... ON CONFLICT on the natural key (ISBN or email), then
+    committed, so memory stays bounded and an interrupted import can simply be
+    rerun. ``progress`` is called with the running stats after every chunk.
+    Returns the final stats.
+    """
+    if kind not in IMPORT_KINDS:
+        raise ValueError(f"Unknown import kind: {kind}")
+    if on_conflict not in CONFLICT_POLICIES:
+        raise ValueError(f"Unknown conflict policy: {on_conflict}")
+
+    parse = parse_book if kind == 'books' else parse_user
+    stats = {"read": 0, "inserted": 0, "updated": 0, "skipped": 0, "duplicates": 0, "rejected": 0}
+    started = time.monotonic()
+
+    # Statistics are refreshed whenever the import has doubled the rows written;
+    # planning the catalog refresh on an empty table's statistics makes every
+    # chunk slower than the one before.
+    next_analyze = chunk_size
+
+    def flush(cursor, chunk, lookups):
+        nonlocal next_analyze
+        if kind == 'books':
+            book_ids = _load_books(cursor, chunk, lookups, on_conflict, stats)
+        else:
+            book_ids = _load_users(cursor, chunk, on_conflict, stats)
+        if stats["inserted"] >= next_analyze:
+            cursor.execute(ANALYZE_TABLES[kind])
+            next_analyze = stats["inserted"] * 2
+        if book_ids:
+            refresh_catalog_entries(cursor, book_ids)
+        conn.commit()
+        stats["seconds"] = round(time.monotonic() - started, 3)
+        stats["rows_per_second"] = round(stats["read"] / stats["seconds"], 1) if stats["seconds"] else None
+        if progress:
+            progress(stats)
+
+    with conn.cursor() as cursor:
+        try:
+            cursor.execute(STAGING_TABLES[kind])
+            lookups = {}
+            if kind == 'books':
+                for field, (table, id_column, _, _) in RELATIONS.items():
+                    lookups[field] = NameLookup(table, id_column)
+                    lookups[field].load(cursor)
+            conn.commit()
+
+            chunk = []
+            for record_no, record in enumerate(records, start=1):
+                stats["read"] += 1
+                try:
+                    chunk.append(parse(record))
+                except (TypeError, ValueError) as e:
+                    stats["rejected"] += 1
+                    if stats["rejected"] <= MAX_LOGGED_REJECTS:
+                        logger.warning("Import record %d rejected: %s", record_no, e)
+                    continue
+                if len(chunk) >= chunk_size:
+                    flush(cursor, chunk, lookups)
+                    chunk = []
+            flush(cursor, chunk, lookups)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cursor.execute(DROP_STAGING_TABLES)
+            conn.commit()
+
+    for field, lookup in lookups.items():
+        stats[f"{field}_created"] = lookup.created
+    return stats
@@ -0,0 +1,184 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+DEFAULT_QUEUE_SIZE = 10000
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'
+
+# Longest X-Request-ID accepted from a client; longer or odd ones are replaced
+MAX_REQUEST_ID_LENGTH = 64
+
+_request_id = ContextVar('request_id', default=None)
+
+_listener = None
+_handlers = {}
+
+
+def start_request(incoming=None):
+    """Adopt the client's X-Request-ID if it is sane, else make one; returns the id."""
+    if incoming and len(incoming) <= MAX_REQUEST_ID_LENGTH and incoming.isprintable() and ' ' not in incoming:
+        request_id = incoming
+    else:
+        request_id = uuid.uuid4().hex
+    _request_id.set(request_id)
+    return request_id
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def finish_request():
+    _request_id.set(None)
+
+
+class RequestContextFilter(logging.Filter):
+    """Stamp records with the current request id while still in the logging thread."""
+
+    def filter(self, record):
+        record.request_id = _request_id.get() or '-'
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Keep a fraction of the records below WARNING from the configured loggers.
+
+    ``rates`` maps a logger name to the fraction kept; it also applies to the
+    logger's children. Warnings and errors are never sampled out.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        # Longest name first, so the most specific rule wins
+        self.rates = sorted(rates.items(), key=lambda item: -len(item[0]))
+        self.sampled_out = 0
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not self.rates:
+            return True
+        for name, rate in self.rates:
+            if record.name == name or record.name.startswith(name + '.'):
+                if random.random() < rate:
+                    return True
+                self.sampled_out += 1
+                return False
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to the listener thread; drops (and counts) them when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The listener runs in this process, so the record needs no flattening:
+        # message formatting is left to the listener thread as well.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def stats():
+    queue_handler = _handlers.get('queue')
+    sampling = _handlers.get('sampling')
+    return {
+        'dropped': queue_handler.dropped if queue_handler else 0,
+        'queued': queue_handler.queue.qsize() if queue_handler else 0,
+        'sampled_out': sampling.sampled_out if sampling else 0,
+    }
+
+
+def stop_logging():
+    """Flush the queue and stop the listener thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def _restart_after_fork():
+    # The listener thread does not survive fork(); give the child its own
+    global _listener
+    if _listener is not None:
+        _listener = logging.handlers.QueueListener(_listener.queue, *_listener.handlers,
+                                                   respect_handler_level=True)
+        _listener.start()
+
+
+def configure_logging(config, stream=None):
+    """Set up logging from the [LOGGING] sections of config.ini.
+
+    Records are stamped with the request id and sampled in the calling thread,
+    then written by a background thread through a bounded queue, so a slow
+    log sink never stalls a request. With ASYNC=false they are written
+    synchronously instead.
+    """
+    stop_logging()
+
+    level = config.get('LOGGING', 'LEVEL', fallback='INFO').upper()
+    output = config.get('LOGGING', 'FORMAT', fallback='json')
+    asynchronous = config.getboolean('LOGGING', 'ASYNC', fallback=True)
+    queue_size = config.getint('LOGGING', 'QUEUE_SIZE', fallback=DEFAULT_QUEUE_SIZE)
+    levels = dict(config.items('LOGGING.LEVELS')) if config.has_section('LOGGING.LEVELS') else {}
+    rates = dict(config.items('LOGGING.SAMPLING')) if config.has_section('LOGGING.SAMPLING') else {}
+
+    writer = logging.StreamHandler(stream or sys.stderr)
+    writer.setFormatter(JsonFormatter() if output == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    sampling = SamplingFilter({name: float(rate) for name, rate in rates.items()})
+    if asynchronous:
+        handler = NonBlockingQueueHandler(queue.Queue(queue_size))
+        _handlers['queue'] = handler
+    else:
+        handler = writer
+        _handlers.pop('queue', None)
+    handler.addFilter(RequestContextFilter())
+    handler.addFilter(sampling)
+    _handlers['sampling'] = sampling
+
+    root = logging.getLogger()
+    for old in list(root.handlers):
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    for name, name_level in levels.items():
+        logging.getLogger(name).setLevel(name_level.upper())
+
+    if asynchronous:
+        global _listener
+        _listener = logging.handlers.QueueListener(handler.queue, writer, respect_handler_level=True)
+        _listener.start()
+
+
+atexit.register(stop_logging)
+os.register_at_fork(after_in_child=_restart_after_fork)
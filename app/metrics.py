@@ -0,0 +1,237 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# Histogram buckets: seconds, and queries per request
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+# Longest statement written to the slow-query log
+MAX_LOGGED_QUERY = 4000
+
+_slow_query_seconds = None
+
+# Per-request accumulator; None outside a request (CLI, startup)
+_current = ContextVar('request_metrics', default=None)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        with self._lock:
+            values = sorted(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram:
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        self._values = {}  # labels -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        with self._lock:
+            values = sorted((labels, list(series)) for labels, series in self._values.items())
+        for labels, series in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                bucket = _format_labels(self.labelnames, labels, [('le', _format_value(bound))])
+                yield f"{self.name}_bucket{bucket} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {series[-1]!r}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    """Metrics of this process, plus collectors that read other components' stats at scrape time."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, help, labelnames=()):
+        metric = Counter(name, help, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """``collector()`` returns ``[(name, type, help, value)]`` for gauges/counters kept elsewhere."""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                samples = collector()
+            except Exception as e:
+                logger.warning("Metrics collector failed: %s", e)
+                continue
+            for name, kind, help, value in samples:
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {_format_value(value)}"]
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    'http_requests_total', "HTTP requests handled.", ('endpoint', 'method', 'status'))
+http_duration = registry.histogram(
+    'http_request_duration_seconds', "Time spent handling a request.", ('endpoint',))
+http_queries = registry.histogram(
+    'http_request_queries', "Database queries issued per request.", ('endpoint',), QUERY_COUNT_BUCKETS)
+http_db_time = registry.histogram(
+    'http_request_db_seconds', "Time a request spent in database queries.", ('endpoint',))
+query_duration = registry.histogram(
+    'db_query_duration_seconds', "Time spent in a single database query.", ('endpoint',))
+query_rows = registry.counter(
+    'db_query_rows_total', "Rows returned or affected by database queries.", ('endpoint',))
+query_errors = registry.counter(
+    'db_query_errors_total', "Database queries that raised an error.", ('endpoint',))
+pool_wait = registry.histogram(
+    'db_pool_wait_seconds', "Time spent waiting to check out a pooled connection.", ('endpoint',))
+
+
+class RequestMetrics:
+    __slots__ = ('endpoint', 'started', 'queries', 'query_seconds')
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_seconds = 0.0
+
+
+def configure(slow_query_ms=0):
+    """Log queries slower than ``slow_query_ms`` with their parameters (0 disables the log)."""
+    global _slow_query_seconds
+    _slow_query_seconds = slow_query_ms / 1000 if slow_query_ms else None
+
+
+def start_request(endpoint):
+    _current.set(RequestMetrics(endpoint or 'unmatched'))
+
+
+def finish_request(method, status):
+    current = _current.get()
+    if current is None:
+        return
+    _current.set(None)
+    http_requests.inc(current.endpoint, method, str(status))
+    http_duration.observe(time.perf_counter() - current.started, current.endpoint)
+    http_queries.observe(current.queries, current.endpoint)
+    http_db_time.observe(current.query_seconds, current.endpoint)
+
+
+def _endpoint():
+    current = _current.get()
+    return current.endpoint if current is not None else 'none'
+
+
+def record_pool_wait(seconds):
+    pool_wait.observe(seconds, _endpoint())
+
+
+def _record_query(cursor, seconds, failed):
+    current = _current.get()
+    endpoint = current.endpoint if current is not None else 'none'
+    if current is not None:
+        current.queries += 1
+        current.query_seconds += seconds
+
+    query_duration.observe(seconds, endpoint)
+    if failed:
+        query_errors.inc(endpoint)
+    elif cursor.rowcount > 0:
+        query_rows.inc(endpoint, amount=cursor.rowcount)
+
+    if _slow_query_seconds is not None and seconds >= _slow_query_seconds:
+        query = cursor.query
+        if isinstance(query, bytes):
+            query = query.decode('utf-8', 'replace')
+        query = ' '.join((query or '').split())
+        if len(query) > MAX_LOGGED_QUERY:
+            query = query[:MAX_LOGGED_QUERY] + '...'
+        logger.warning("Slow query (%.1f ms, %d rows, %s): %s", seconds * 1000, max(cursor.rowcount, 0), endpoint, query)
+
+
+class InstrumentedCursor(extensions.cursor):
+    """Cursor that times every statement; install it with ``cursor_factory``."""
+
+    def _timed(self, method, *args):
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = method(*args)
+            failed = False
+            return result
+        finally:
+            _record_query(self, time.perf_counter() - started, failed)
+
+    def execute(self, query, vars=None):
+        return self._timed(super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._timed(super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._timed(super().copy_expert, sql, file, size)
+
+
+def render():
+    return registry.render()
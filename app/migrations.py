@@ -0,0 +1,288 @@
+import json
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS_DIR = 'schema/migrations'
+MIGRATION_FILE = re.compile(r'^(\d{4})_(\w+)\.sql$')
+
+# Migrations starting with this line run outside a transaction, one statement
+# at a time (needed for CREATE INDEX CONCURRENTLY)
+NO_TRANSACTION_MARKER = '-- migrate: no-transaction'
+
+# Index a CREATE INDEX CONCURRENTLY statement builds. A failed concurrent build
+# leaves the index behind marked invalid, which IF NOT EXISTS would then skip
+CONCURRENT_INDEX = re.compile(
+    r'CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+)', re.IGNORECASE
+)
+
+INVALID_INDEXES_QUERY = """
+    SELECT i.indexrelid::regclass::text
+    FROM pg_index i
+    WHERE i.indexrelid = ANY(SELECT to_regclass(name) FROM unnest(%s::text[]) AS name)
+      AND NOT i.indisvalid
+"""
+
+# Advisory lock key so concurrently starting instances never migrate in parallel
+MIGRATION_LOCK_ID = 7_201_301
+
+# Representative forms of the queries on the request hot paths. Each must be
+# answerable without a sequential scan of the tables it reads.
+HOT_QUERIES = {
+    "catalog page by book_id": """
+        SELECT * FROM catalog_entries c WHERE c.book_id > 1 ORDER BY c.book_id LIMIT 51
+    """,
+    "catalog page by title": """
+        SELECT * FROM catalog_entries c WHERE (c.title, c.book_id) > ('M', 1) ORDER BY c.title, c.book_id LIMIT 51
+    """,
+    "catalog filtered by genre": """
+        SELECT * FROM catalog_entries c WHERE c.genre_ids @> ARRAY[1] ORDER BY c.book_id LIMIT 51
+    """,
+    "catalog filtered by author": """
+        SELECT * FROM catalog_entries c WHERE c.author_ids @> ARRAY[1] ORDER BY c.book_id LIMIT 51
+    """,
+    "catalog search": """
+        SELECT c.book_id, ts_rank(c.search_vector, q.query) AS rank
+        FROM catalog_entries c, to_tsquery('english', 'silent & riv:*') AS q(query)
+        WHERE c.search_vector @@ q.query
+        ORDER BY rank DESC, c.book_id
+        LIMIT 21
+    """,
+    "author name prefix": """
+        SELECT author_id, name FROM authors WHERE lower(name) LIKE 'jan%' ORDER BY lower(name), author_id LIMIT 8
+    """,
+    "overdue report page": """
+        SELECT o.borrow_id, b.title, u.name, o.days_overdue, o.accrued_fine
+        FROM overdue_loans o
+        JOIN books b ON b.current_borrow_id = o.borrow_id
+        JOIN users u ON u.user_id = o.user_id
+        WHERE o.sweep_id = 1 AND (o.due_date, o.borrow_id) > ('2024-01-01', 1)
+        ORDER BY o.due_date, o.borrow_id
+        LIMIT 51
+    """,
+    "borrowed book lookup": """
+        SELECT c.book_id, c.title
+        FROM catalog_entries c
+        WHERE (c.book_id = 12 OR c.search_vector @@ to_tsquery('english', 'riv:*')) AND c.is_available = FALSE
+        ORDER BY (c.book_id = 12) IS TRUE DESC, c.title, c.book_id
+        LIMIT 8
+    """,
+    "user lookup": """
+        SELECT user_id, name FROM users
+        WHERE user_id = 12 OR lower(name) LIKE 'jan%'
+        ORDER BY (user_id = 12) IS TRUE DESC, lower(name), user_id
+        LIMIT 8
+    """,
+    "open loan of a book": """
+        SELECT bo.borrow_id, bo.user_id, bo.due_date
+        FROM books b
+        JOIN borrows bo ON bo.borrow_id = b.current_borrow_id
+        WHERE b.book_id = 1
+    """,
+    "open loans of a user": """
+        SELECT b.book_id, b.title
+        FROM borrows bo
+        JOIN books b ON b.current_borrow_id = bo.borrow_id
+        WHERE bo.user_id = 1
+    """,
+    "return of a borrow": """
+        SELECT 1 FROM returns r WHERE r.borrow_id = 1
+    """,
+    "books of an author": """
+        SELECT b.book_id, b.title FROM book_authors ba JOIN books b ON b.book_id = ba.book_id WHERE ba.author_id = 1
+    """,
+    "books of a publisher": """
+        SELECT b.book_id, b.title FROM book_publishers bp JOIN books b ON b.book_id = bp.book_id WHERE bp.publisher_id = 1
+    """,
+    "books of a genre": """
+        SELECT b.book_id, b.title FROM book_genres bg JOIN books b ON b.book_id = bg.book_id WHERE bg.genre_id = 1
+    """,
+    "relations of a book": """
+        SELECT a.name
+        FROM book_authors ba
+        JOIN authors a ON a.author_id = ba.author_id
+        WHERE ba.book_id = 1
+    """,
+}
+
+
+class MigrationError(Exception):
+    pass
+
+
+def discover_migrations(directory=MIGRATIONS_DIR):
+    """Return ``[(version, name, path)]`` for every migration file, in version order."""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise MigrationError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def split_statements(sql):
+    """Split a migration into statements on semicolons that end a line."""
+    statements = []
+    for chunk in re.split(r';\s*$', sql, flags=re.MULTILINE):
+        code = [line for line in chunk.splitlines() if line.strip() and not line.strip().startswith('--')]
+        if code:
+            statements.append(chunk.strip())
+    return statements
+
+
+def ensure_migrations_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        )
+    """)
+
+
+def applied_versions(cursor):
+    cursor.execute("SELECT version FROM schema_migrations ORDER BY version")
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _apply(conn, version, name, path):
+    with open(path, 'r') as f:
+        sql = f.read()
+
+    if sql.lstrip().startswith(NO_TRANSACTION_MARKER):
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                indexes = []
+                for statement in split_statements(sql):
+                    match = CONCURRENT_INDEX.search(statement)
+                    if match:
+                        indexes.append(match.group(1))
+                        _drop_invalid_indexes(cursor, [match.group(1)])
+                    cursor.execute(statement)
+                cursor.execute(INVALID_INDEXES_QUERY, (indexes,))
+                invalid = [row[0] for row in cursor.fetchall()]
+                if invalid:
+                    raise MigrationError(f"Indexes left invalid: {', '.join(invalid)}")
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                    (version, name)
+                )
+        finally:
+            conn.autocommit = False
+    else:
+        with conn.cursor() as cursor:
+            cursor.execute(sql)
+            cursor.execute(
+                "INSERT INTO schema_migrations (version, name) VALUES (%s, %s)",
+                (version, name)
+            )
+        conn.commit()
+
+
+def _drop_invalid_indexes(cursor, names):
+    """Drop what an earlier, interrupted CREATE INDEX CONCURRENTLY left of these indexes."""
+    cursor.execute(INVALID_INDEXES_QUERY, (names,))
+    for index, in cursor.fetchall():
+        logger.warning("Dropping invalid index %s left by an interrupted build", index)
+        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+
+
+def migrate(conn, target=None, directory=MIGRATIONS_DIR):
+    """Apply pending migrations up to ``target`` (all if None); returns the versions applied.
+
+    Each transactional migration commits together with its schema_migrations
+    row, so a failure leaves the database at the last fully applied version.
+    """
+    migrations = discover_migrations(directory)
+    applied = []
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    conn.commit()
+    try:
+        with conn.cursor() as cursor:
+            ensure_migrations_table(cursor)
+            done = set(applied_versions(cursor))
+        conn.commit()
+
+        for version, name, path in migrations:
+            if version in done or (target is not None and version > target):
+                continue
+            logger.info("Applying migration %04d_%s", version, name)
+            try:
+                _apply(conn, version, name, path)
+            except Exception as e:
+                conn.rollback()
+                raise MigrationError(f"Migration {version:04d}_{name} failed: {e}") from e
+            applied.append(version)
+    finally:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        conn.commit()
+
+    return applied
+
+
+def stamp(conn, version, directory=MIGRATIONS_DIR):
+    """Record migrations up to ``version`` as applied without running them.
+
+    For databases created before migrations existed (e.g. from the old schema.sql).
+    """
+    with conn.cursor() as cursor:
+        ensure_migrations_table(cursor)
+        for migration_version, name, _ in discover_migrations(directory):
+            if migration_version <= version:
+                cursor.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES (%s, %s) ON CONFLICT (version) DO NOTHING",
+                    (migration_version, name)
+                )
+    conn.commit()
+
+
+def migration_status(conn, directory=MIGRATIONS_DIR):
+    """Return ``[(version, name, applied)]`` for every known migration."""
+    with conn.cursor() as cursor:
+        ensure_migrations_table(cursor)
+        done = set(applied_versions(cursor))
+    conn.commit()
+    return [(version, name, version in done) for version, name, _ in discover_migrations(directory)]
+
+
+def _seq_scans(plan):
+    scans = []
+    if plan.get('Node Type') == 'Seq Scan':
+        scans.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        scans.extend(_seq_scans(child))
+    return scans
+
+
+def check_query_plans(cursor, force_indexes=True):
+    """EXPLAIN every hot query; returns ``{name: [tables scanned sequentially]}``.
+
+    With ``force_indexes`` sequential scans are priced out, so one still showing
+    up means no usable index exists, whatever the size of the fixture. Without
+    it, the planner's natural choice is checked, which is meaningful on large
+    fixtures only.
+    """
+    results = {}
+    try:
+        if force_indexes:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        for name, query in HOT_QUERIES.items():
+            cursor.execute("EXPLAIN (FORMAT JSON) " + query)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            results[name] = _seq_scans(plan[0]['Plan'])
+    finally:
+        cursor.connection.rollback()
+    return results
@@ -0,0 +1,146 @@
+import logging
+import os
+import select
+import threading
+import uuid
+
+import psycopg2
+from psycopg2 import extensions
+
+logger = logging.getLogger(__name__)
+
+# Postgres channel announcing committed changes to catalog data
+CHANNEL = 'catalog_changed'
+
+# Seconds between checks of the stop flag while no notification arrives, and
+# before reconnecting after the listening connection failed
+POLL_SECONDS = 5
+RECONNECT_SECONDS = 2
+
+# Moves the shared data version on and announces the change, in one statement;
+# returns the new version
+NOTIFY_QUERY = """
+    WITH bumped AS (UPDATE data_version SET version = version + 1 RETURNING version)
+    SELECT (SELECT version FROM bumped), pg_notify(%s, %s)
+"""
+CURRENT_LSN_QUERY = "SELECT pg_current_wal_lsn()::text"
+DATA_VERSION_QUERY = "SELECT version FROM data_version"
+
+# Seconds warm-up waits for the listener to connect before loading the caches
+READY_TIMEOUT = 5
+
+_token = None
+
+
+def process_token():
+    """Identifies this process in notification payloads, so it can skip its own."""
+    global _token
+    if _token is None or _token[0] != os.getpid():
+        _token = (os.getpid(), f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+    return _token[1]
+
+
+def notify_change(cursor):
+    """Announce a catalog change to every app process; returns the shared data version covering it.
+
+    Call it inside the transaction making the change: Postgres delivers the
+    notification when (and only if) that transaction commits.
+    """
+    cursor.execute(NOTIFY_QUERY, (CHANNEL, process_token()))
+    return cursor.fetchone()[0]
+
+
+def announce_change(conn):
+    """notify_change() for a change that is already committed."""
+    with conn.cursor() as cursor:
+        data_version = notify_change(cursor)
+    conn.commit()
+    return data_version
+
+
+class ChangeListener:
+    """Calls ``on_change`` whenever another process announces a catalog change.
+
+    Listens on a dedicated connection from a daemon thread. Threads and
+    sockets do not survive fork(), so ``ensure_running()`` starts a fresh
+    listener in each worker process the first time it is called there. Each
+    time the connection is (re-)established ``on_change`` is called once,
+    since notifications may have been missed; ``ready`` is set after the
+    first time.
+
+    ``on_change`` is passed ``data_version``, the shared version read after
+    the notification arrived, which covers the announced commit. With
+    ``with_lsn`` it is also passed the primary's WAL position, read at the
+    same time.
+    """
+
+    def __init__(self, on_change, with_lsn=False, **dsn):
+        self.on_change = on_change
+        self.with_lsn = with_lsn
+        self._dsn = dsn
+        self._lock = threading.Lock()
+        self._pid = None
+        self._stopped = threading.Event()
+        self.ready = threading.Event()
+        self.received = 0
+
+    def ensure_running(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped = threading.Event()
+            self.ready = threading.Event()
+            threading.Thread(target=self._run, name='catalog-listener', daemon=True).start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        stopped = self._stopped
+        while not stopped.is_set():
+            try:
+                conn = psycopg2.connect(**self._dsn)
+            except psycopg2.Error as e:
+                logger.warning("Could not listen for catalog changes: %s", e)
+                stopped.wait(RECONNECT_SECONDS)
+                continue
+            try:
+                conn.set_isolation_level(extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {CHANNEL}")
+                self._changed(conn)
+                self.ready.set()
+                self._listen(conn, stopped)
+            except (psycopg2.Error, OSError) as e:
+                logger.warning("Lost the catalog change listener connection: %s", e)
+                stopped.wait(RECONNECT_SECONDS)
+            finally:
+                conn.close()
+
+    def _listen(self, conn, stopped):
+        while not stopped.is_set():
+            if select.select([conn], [], [], POLL_SECONDS) == ([], [], []):
+                continue
+            conn.poll()
+            changed = False
+            while conn.notifies:
+                notification = conn.notifies.pop(0)
+                if notification.payload != process_token():
+                    changed = True
+            if changed:
+                self.received += 1
+                self._changed(conn)
+
+    def _changed(self, conn):
+        with conn.cursor() as cursor:
+            cursor.execute(DATA_VERSION_QUERY)
+            data_version, = cursor.fetchone()
+            if not self.with_lsn:
+                self.on_change(data_version=data_version)
+                return
+            cursor.execute(CURRENT_LSN_QUERY)
+            lsn, = cursor.fetchone()
+        self.on_change(lsn, data_version=data_version)
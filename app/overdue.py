@@ -0,0 +1,225 @@
+import base64
+import binascii
+import json
+import logging
+import time
+from datetime import date
+
+from . import circulation
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+DEFAULT_REPORT_SIZE = 50
+MAX_REPORT_SIZE = 500
+
+SWEEP_LOCK_ID = 7_201_305
+
+
+def sweep_overdue(conn, as_of=None, policy=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Recompute ``overdue_loans``: every open loan past due on ``as_of`` with its accrued fine.
+
+    Open loans are read from a server-side cursor ``chunk_size`` at a time and
+    each chunk's days overdue and fines are computed and inserted in one
+    statement, committed per chunk, so the sweep never holds long locks.
+    The rows are the new sweep's own; the previous sweep's are deleted when
+    it finishes, in the same transaction that marks it finished, so the
+    report keeps reading complete sweeps. Concurrent sweeps (cron overlapping
+    a manual run) take turns through an advisory lock. ``policy`` defaults
+    to the configured circulation.fine_policy. Returns the sweep summary.
+    """
+    as_of = as_of or date.today()
+    policy = policy or circulation.fine_policy
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (SWEEP_LOCK_ID,))
+    conn.commit()
+    try:
+        return _sweep(conn, as_of, policy, chunk_size, progress)
+    finally:
+        conn.rollback()
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (SWEEP_LOCK_ID,))
+        conn.commit()
+
+
+def _sweep(conn, as_of, policy, chunk_size, progress):
+    started = time.monotonic()
+
+    with conn.cursor() as cursor:
+        cursor.execute("""
+            INSERT INTO overdue_sweeps (as_of, per_day, grace_days, max_fine)
+            VALUES (%s, %s, %s, %s)
+            RETURNING sweep_id
+        """, (as_of, policy.per_day, policy.grace_days, policy.max_fine))
+        sweep_id = cursor.fetchone()[0]
+    conn.commit()
+
+    insert_query = f"""
+        INSERT INTO overdue_loans (borrow_id, sweep_id, book_id, user_id, due_date, days_overdue, accrued_fine)
+        SELECT
+            bo.borrow_id,
+            %s,
+            bo.book_id,
+            bo.user_id,
+            bo.due_date,
+            %s::date - bo.due_date,
+            {policy.sql('%s::date - bo.due_date')}
+        FROM borrows bo
+        WHERE bo.borrow_id = ANY(%s::int[])
+    """
+
+    loans = 0
+    # WITH HOLD keeps the cursor open across the per-chunk commits
+    with conn.cursor(name=f"overdue_sweep_{sweep_id}", withhold=True) as source, conn.cursor() as cursor:
+        source.itersize = chunk_size
+        source.execute("""
+            SELECT b.current_borrow_id
+            FROM books b
+            JOIN borrows bo ON bo.borrow_id = b.current_borrow_id
+            WHERE b.current_borrow_id IS NOT NULL AND bo.due_date < %s
+            ORDER BY b.current_borrow_id
+        """, (as_of,))
+        while True:
+            chunk = [row[0] for row in source.fetchmany(chunk_size)]
+            if not chunk:
+                break
+            cursor.execute(insert_query, [sweep_id, as_of, as_of] + policy.params() + [chunk])
+            conn.commit()
+            loans += len(chunk)
+            if progress:
+                progress(loans)
+
+    with conn.cursor() as cursor:
+        cursor.execute("DELETE FROM overdue_loans WHERE sweep_id <> %s", (sweep_id,))
+        cursor.execute("""
+            UPDATE overdue_sweeps
+            SET finished_at = now(),
+                loans = (SELECT COUNT(*) FROM overdue_loans WHERE sweep_id = %s),
+                total_fine = (SELECT COALESCE(SUM(accrued_fine), 0) FROM overdue_loans WHERE sweep_id = %s)
+            WHERE sweep_id = %s
+            RETURNING loans, total_fine
+        """, (sweep_id, sweep_id, sweep_id))
+        loans, total_fine = cursor.fetchone()
+        conn.commit()
+
+    seconds = time.monotonic() - started
+    logger.info("Overdue sweep %d as of %s: %d loans, %s accrued, %.1fs",
+                sweep_id, as_of, loans, total_fine, seconds)
+    return {
+        "sweep_id": sweep_id,
+        "as_of": as_of,
+        "loans": loans,
+        "total_fine": total_fine,
+        "seconds": seconds,
+    }
+
+
+def encode_cursor(due_date, borrow_id):
+    raw = json.dumps([due_date.isoformat(), borrow_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        if isinstance(key, list) and len(key) == 2 and isinstance(key[1], int):
+            return date.fromisoformat(key[0]), key[1]
+    except (binascii.Error, UnicodeError, ValueError, TypeError):
+        pass
+    raise ValueError("Malformed cursor")
+
+
+def parse_report_args(args):
+    """Validate /api/overdue query parameters; raises ValueError."""
+    try:
+        limit = int(args.get('limit', DEFAULT_REPORT_SIZE))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= MAX_REPORT_SIZE:
+        raise ValueError(f"limit must be between 1 and {MAX_REPORT_SIZE}")
+
+    user_id = args.get('user')
+    if user_id is not None:
+        try:
+            user_id = int(user_id)
+        except ValueError:
+            raise ValueError("user must be an integer id")
+
+    cursor = args.get('cursor')
+    return {
+        "limit": limit,
+        "user_id": user_id,
+        "after": decode_cursor(cursor) if cursor else None,
+    }
+
+
+def overdue_report(cursor, limit=DEFAULT_REPORT_SIZE, user_id=None, after=None):
+    """One page of the overdue report, longest overdue first.
+
+    Reads the precomputed ``overdue_loans`` of the last finished sweep,
+    leaving out loans returned since. ``sweep`` also carries the
+    ``outstanding_loans`` and ``outstanding_fine`` the report pages through:
+    those loans, for ``user_id`` if given. Returns ``(sweep, loans,
+    next_cursor)``; ``sweep`` is None if no sweep has completed.
+    """
+    cursor.execute("""
+        SELECT sweep_id, as_of, finished_at, loans, total_fine
+        FROM overdue_sweeps
+        WHERE finished_at IS NOT NULL
+        ORDER BY sweep_id DESC
+        LIMIT 1
+    """)
+    row = cursor.fetchone()
+    if row is None:
+        return None, [], None
+    sweep = dict(zip(("sweep_id", "as_of", "finished_at", "loans", "total_fine"), row))
+
+    conditions = ["o.sweep_id = %s"]
+    params = [sweep["sweep_id"]]
+    if user_id is not None:
+        conditions.append("o.user_id = %s")
+        params.append(user_id)
+
+    # The join with books drops loans returned since the sweep, from the totals as from the pages
+    cursor.execute(f"""
+        SELECT COUNT(*), COALESCE(SUM(o.accrued_fine), 0)
+        FROM overdue_loans o
+        JOIN books b ON b.current_borrow_id = o.borrow_id
+        WHERE {" AND ".join(conditions)}
+    """, params)
+    sweep["outstanding_loans"], sweep["outstanding_fine"] = cursor.fetchone()
+
+    if after is not None:
+        conditions.append("(o.due_date, o.borrow_id) > (%s, %s)")
+        params.extend(after)
+
+    # Fetch one extra row to know whether another page follows
+    report_query = f"""
+        SELECT o.borrow_id, o.book_id, b.title, o.user_id, u.name, o.due_date, o.days_overdue, o.accrued_fine
+        FROM overdue_loans o
+        JOIN books b ON b.current_borrow_id = o.borrow_id
+        JOIN users u ON u.user_id = o.user_id
+        WHERE {" AND ".join(conditions)}
+        ORDER BY o.due_date, o.borrow_id
+        LIMIT %s
+    """
+    cursor.execute(report_query, params + [limit + 1])
+    rows = cursor.fetchall()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    loans = [
+        {
+            "borrow_id": borrow_id,
+            "book": {"id": book_id, "title": title},
+            "user": {"id": loan_user_id, "name": name},
+            "due_date": due_date.isoformat(),
+            "days_overdue": days_overdue,
+            "accrued_fine": float(accrued_fine),
+        }
+        for borrow_id, book_id, title, loan_user_id, name, due_date, days_overdue, accrued_fine in rows
+    ]
+    next_cursor = encode_cursor(rows[-1][5], rows[-1][0]) if has_more else None
+    return sweep, loans, next_cursor
@@ -0,0 +1,359 @@
+import io
+import logging
+import threading
+import time
+
+try:
+    import numpy as np
+    from scipy import sparse
+except ImportError:  # optional: without them nothing is built and book pages show no recommendations
+    np = sparse = None
+
+from .analytics import committed_ids
+from .db import db_connection
+from .importer import copy_rows
+from .notify import announce_change
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOP_N = 10
+
+# Score of a neighbour: cosine similarity of the two books' borrowers, damped
+# for few co-borrowers by co / (co + SHRINKAGE), plus a bonus for sharing an
+# author and one proportional to the overlap (Jaccard) of their genres
+CO_BORROW_WEIGHT = 1.0
+AUTHOR_WEIGHT = 0.3
+GENRE_WEIGHT = 0.2
+SHRINKAGE = 5
+
+# Readers with more distinct books than this are left out of co-borrow counts
+MAX_READER_BOOKS = 1000
+
+# Books whose neighbours are computed per sparse product, bounding memory
+DEFAULT_CHUNK_SIZE = 2000
+
+# An incremental run affecting more than this share of the books rebuilds them all
+FULL_REBUILD_FRACTION = 0.25
+
+REFRESH_LOCK_ID = 7_201_303
+
+RECOMMENDATIONS_QUERY = """
+    SELECT r.recommended_book_id, c.title
+    FROM book_recommendations r
+    JOIN catalog_entries c ON c.book_id = r.recommended_book_id
+    WHERE r.book_id = %s
+    ORDER BY r.rank
+"""
+
+
+class RecommendationPolicy:
+    """How many neighbours are kept per book and how the signals are weighed."""
+
+    def __init__(self, top_n=DEFAULT_TOP_N, co_borrow_weight=CO_BORROW_WEIGHT, author_weight=AUTHOR_WEIGHT,
+                 genre_weight=GENRE_WEIGHT, shrinkage=SHRINKAGE, max_reader_books=MAX_READER_BOOKS):
+        self.top_n = top_n
+        self.co_borrow_weight = co_borrow_weight
+        self.author_weight = author_weight
+        self.genre_weight = genre_weight
+        self.shrinkage = shrinkage
+        self.max_reader_books = max_reader_books
+
+    def __repr__(self):
+        return (f"RecommendationPolicy(top_n={self.top_n}, co_borrow_weight={self.co_borrow_weight}, "
+                f"author_weight={self.author_weight}, genre_weight={self.genre_weight}, "
+                f"shrinkage={self.shrinkage}, max_reader_books={self.max_reader_books})")
+
+
+# Policy used by builds; set from [RECOMMENDATIONS] in config.ini
+recommendation_policy = RecommendationPolicy()
+
+
+def configure(**settings):
+    global recommendation_policy
+    recommendation_policy = RecommendationPolicy(**settings)
+
+
+def recommended_books(cursor, book_id):
+    """``{book_id: title}`` of the precomputed neighbours of ``book_id``, best first."""
+    cursor.execute(RECOMMENDATIONS_QUERY, (book_id,))
+    return dict(cursor.fetchall())
+
+
+def _read_pairs(cursor, query, params=None):
+    """The two integer columns of ``query`` as an ``(n, 2)`` array, read with COPY."""
+    buffer = io.BytesIO()
+    cursor.copy_expert(f"COPY ({cursor.mogrify(query, params).decode()}) TO STDOUT", buffer)
+    return np.fromstring(buffer.getvalue().decode('ascii'), dtype=np.int64, sep=' ').reshape(-1, 2)
+
+
+def _incidence(pairs, shape):
+    """0/1 CSR matrix with a one at every ``(row, column)`` of ``pairs``."""
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.int32), (pairs[:, 0], pairs[:, 1])), shape=shape
+    )
+    matrix.data[:] = 1  # duplicate pairs were summed
+    return matrix
+
+
+def _genre_masks(book_genres, book_count):
+    """One bit per genre for each book, in as many 64-bit words as the genre ids need."""
+    words = int(book_genres[:, 1].max(initial=0)) // 64 + 1
+    masks = np.zeros((book_count, words), dtype=np.uint64)
+    np.bitwise_or.at(masks, (book_genres[:, 0], book_genres[:, 1] // 64),
+                     np.left_shift(np.uint64(1), (book_genres[:, 1] % 64).astype(np.uint64)))
+    return masks
+
+
+def top_neighbours(targets, loans, borrowers, book_authors, book_genres, policy, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Best ``policy.top_n`` neighbours of each book in ``targets``.
+
+    ``loans`` holds ``(user_id, book_id)`` pairs of every user who borrowed a
+    target, ``borrowers[book_id]`` the number of distinct borrowers of each
+    book, and ``book_authors``/``book_genres`` the
+    ``(book_id, author_id)``/``(book_id, genre_id)`` pairs of the targets and
+    of the books they may be matched with. Ids index the matrices directly.
+
+    Candidates are the books co-borrowed with a target (one sparse product
+    of the target columns of the user x book matrix with the whole matrix)
+    and the books sharing an author with it; genres only adjust the score.
+    Readers of more than ``policy.max_reader_books`` books are left out of
+    the co-borrow counts: they link nearly every pair of books and would
+    dominate both the counts and the cost of the product.
+    Returns ``(book_id, rank, recommended_book_id, score, co_borrowers)`` rows.
+    """
+    book_count = int(max(borrowers.shape[0], targets.max(initial=0) + 1,
+                         book_authors[:, 0].max(initial=0) + 1, book_genres[:, 0].max(initial=0) + 1))
+    users = _incidence(loans, (int(loans[:, 0].max(initial=0)) + 1, book_count))
+    reader_books = np.diff(users.indptr)
+    if (reader_books > policy.max_reader_books).any():
+        users = sparse.diags((reader_books <= policy.max_reader_books).astype(np.int32), dtype=np.int32) @ users
+        users.eliminate_zeros()
+    users_by_book = users.tocsc()
+    authors = _incidence(book_authors, (book_count, int(book_authors[:, 1].max(initial=0)) + 1))
+    genres = _genre_masks(book_genres, book_count)
+    genre_counts = np.bitwise_count(genres).sum(axis=1)
+    borrowers = np.pad(borrowers, (0, book_count - len(borrowers))).astype(np.float64)
+
+    rows = []
+    for start in range(0, len(targets), chunk_size):
+        chunk = targets[start:start + chunk_size]
+
+        # Co-borrower counts (even part) and shared authors (odd bit) in one matrix,
+        # so the sum's structure is every candidate of every target, sorted by target
+        co = users_by_book[:, chunk].T @ users
+        shared = authors[chunk] @ authors.T
+        shared.data[:] = 1
+        candidates = (co * 2 + shared).tocoo()
+        row, col = candidates.row, candidates.col
+        co_count, shares_author = np.divmod(candidates.data, 2)
+        book = chunk[row]
+
+        keep = col != book
+        row, col, book = row[keep], col[keep], book[keep]
+        co_count, shares_author = co_count[keep].astype(np.float64), shares_author[keep]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cosine = np.nan_to_num(co_count / np.sqrt(borrowers[book] * borrowers[col]))
+        score = policy.co_borrow_weight * cosine * co_count / (co_count + policy.shrinkage)
+        score += policy.author_weight * shares_author
+
+        common_genres = np.bitwise_count(genres[book] & genres[col]).sum(axis=1)
+        union = genre_counts[book] + genre_counts[col] - common_genres
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score += policy.genre_weight * np.nan_to_num(common_genres / union)
+
+        # Best first within each book (one float sort key: row + 1 - score scaled below 1;
+        # stable, so ties stay in book id order); rank = position within the book's run
+        order = np.argsort(row + 1 - score / (score.max(initial=0) + 1), kind='stable')
+        row, col, score, co_count, book = row[order], col[order], score[order], co_count[order], book[order]
+        rank = np.arange(len(row)) - np.searchsorted(row, row, side='left')
+        keep = (rank < policy.top_n) & (score > 0)
+        rows.extend(zip(book[keep].tolist(), (rank[keep] + 1).tolist(), col[keep].tolist(),
+                        np.round(score[keep], 6).tolist(), co_count[keep].astype(np.int64).tolist()))
+    return rows
+
+
+def _borrower_counts(loans):
+    books, counts = np.unique(loans[:, 1], return_counts=True)
+    borrowers = np.zeros(int(books.max(initial=0)) + 1, dtype=np.int64)
+    borrowers[books] = counts
+    return borrowers
+
+
+def _load_full(cursor):
+    loans = _read_pairs(cursor, "SELECT DISTINCT user_id, book_id FROM borrows")
+    book_authors = _read_pairs(cursor, "SELECT book_id, author_id FROM book_authors")
+    book_genres = _read_pairs(cursor, "SELECT book_id, genre_id FROM book_genres")
+    cursor.execute("SELECT book_id FROM books ORDER BY book_id")
+    targets = np.array([row[0] for row in cursor.fetchall()], dtype=np.int64)
+    return targets, loans, _borrower_counts(loans), book_authors, book_genres
+
+
+def _load_affected(cursor, targets):
+    """What top_neighbours() needs for ``targets``, read through the indexes on book and user."""
+    target_list = targets.tolist()
+    loans = _read_pairs(cursor, """
+        SELECT DISTINCT bo.user_id, bo.book_id
+        FROM borrows bo
+        WHERE bo.user_id IN (SELECT user_id FROM borrows WHERE book_id = ANY(%s::int[]))
+    """, (target_list,))
+    book_authors = _read_pairs(cursor, """
+        SELECT book_id, author_id
+        FROM book_authors
+        WHERE author_id IN (SELECT author_id FROM book_authors WHERE book_id = ANY(%s::int[]))
+    """, (target_list,))
+    candidates = np.union1d(np.union1d(loans[:, 1], book_authors[:, 0]), targets).tolist()
+    book_genres = _read_pairs(cursor, "SELECT book_id, genre_id FROM book_genres WHERE book_id = ANY(%s::int[])",
+                              (candidates,))
+
+    # Borrower counts over every user, not only those loaded
+    counts = _read_pairs(cursor, """
+        SELECT book_id, COUNT(DISTINCT user_id)
+        FROM borrows
+        WHERE book_id = ANY(%s::int[])
+        GROUP BY book_id
+    """, (np.unique(loans[:, 1]).tolist(),))
+    borrowers = np.zeros(int(max(candidates, default=0)) + 1, dtype=np.int64)
+    borrowers[counts[:, 0]] = counts[:, 1]
+    return loans, borrowers, book_authors, book_genres
+
+
+def build_recommendations(conn, full=False, policy=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Bring ``book_recommendations`` up to date with the borrows table.
+
+    An incremental run (the default once a build has finished) reads only
+    the borrows after the last build's watermark, and recomputes the
+    neighbours of the books whose co-borrow counts they changed: the books
+    borrowed and every other book their borrowers had borrowed. Neighbours
+    of other books that point at those books keep their scores until a full
+    build, which cron should run now and then. With
+    ``full`` (or when most books are affected) every book is recomputed.
+    The rows are replaced in one transaction, so readers see either the old
+    or the new neighbours of a book. ``policy`` defaults to the configured
+    recommendation_policy. Returns the build summary, or None when no
+    borrow was made since the last build or the borrows stayed locked.
+    """
+    if sparse is None:
+        raise RuntimeError("Building recommendations needs numpy and scipy")
+    policy = policy or recommendation_policy
+    started = time.monotonic()
+
+    # Every borrow up to it has committed, so none is missed behind the watermark
+    committed = committed_ids(conn)
+    if committed is None:
+        return None
+    last_borrow_id = committed['borrows']
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT MAX(last_borrow_id) FROM recommendation_builds WHERE finished_at IS NOT NULL")
+        watermark = cursor.fetchone()[0]
+        full = full or watermark is None
+        if not full and last_borrow_id <= watermark:
+            conn.rollback()
+            return None
+
+        if not full:
+            # The borrowed books, and every book of their borrowers (except the
+            # readers top_neighbours() leaves out of the counts)
+            cursor.execute("""
+                WITH new_borrows AS (
+                    SELECT user_id, book_id FROM borrows WHERE borrow_id > %s
+                ),
+                readers AS (
+                    SELECT bo.user_id
+                    FROM borrows bo
+                    WHERE bo.user_id IN (SELECT user_id FROM new_borrows)
+                    GROUP BY bo.user_id
+                    HAVING COUNT(DISTINCT bo.book_id) <= %s
+                )
+                SELECT book_id FROM new_borrows
+                UNION
+                SELECT bo.book_id FROM borrows bo WHERE bo.user_id IN (SELECT user_id FROM readers)
+            """, (watermark, policy.max_reader_books))
+            targets = np.array(sorted(row[0] for row in cursor.fetchall()), dtype=np.int64)
+            cursor.execute("SELECT COUNT(*) FROM books")
+            if len(targets) > FULL_REBUILD_FRACTION * cursor.fetchone()[0]:
+                full = True
+
+        cursor.execute("""
+            INSERT INTO recommendation_builds (full_build, last_borrow_id)
+            VALUES (%s, %s)
+            RETURNING build_id
+        """, (full, last_borrow_id))
+        build_id = cursor.fetchone()[0]
+        conn.commit()
+
+        if full:
+            targets, loans, borrowers, book_authors, book_genres = _load_full(cursor)
+        elif len(targets):
+            loans, borrowers, book_authors, book_genres = _load_affected(cursor, targets)
+        loaded = time.monotonic()
+
+        rows = []
+        if len(targets):
+            rows = top_neighbours(targets, loans, borrowers, book_authors, book_genres, policy, chunk_size)
+        computed = time.monotonic()
+
+        if full:
+            cursor.execute("DELETE FROM book_recommendations")
+        else:
+            cursor.execute("DELETE FROM book_recommendations WHERE book_id = ANY(%s::int[])", (targets.tolist(),))
+        copy_rows(cursor, 'book_recommendations',
+                  ('book_id', 'rank', 'recommended_book_id', 'score', 'co_borrowers'), rows)
+        cursor.execute("""
+            UPDATE recommendation_builds
+            SET finished_at = now(), books = %s, recommendations = %s
+            WHERE build_id = %s
+        """, (len(targets), len(rows), build_id))
+        conn.commit()
+
+    seconds = time.monotonic() - started
+    logger.info("Recommendation build %d (%s): %d books, %d neighbours; load %.1fs, compute %.1fs, total %.1fs",
+                build_id, 'full' if full else 'incremental', len(targets), len(rows),
+                loaded - started, computed - loaded, seconds)
+    return {
+        "build_id": build_id,
+        "full": full,
+        "last_borrow_id": last_borrow_id,
+        "books": len(targets),
+        "recommendations": len(rows),
+        "seconds": seconds,
+    }
+
+
+class Refresher(threading.Thread):
+    """Background thread that runs an incremental build every ``interval`` seconds.
+
+    Runs in different processes take turns through an advisory lock. After a
+    build that changed anything the change is announced to every process,
+    and ``on_change`` is called for this one with the shared data version.
+    """
+
+    def __init__(self, interval, on_change=None):
+        super().__init__(name='recommendation-refresh', daemon=True)
+        self.interval = interval
+        self.on_change = on_change
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                with db_connection() as conn, conn.cursor() as cursor:
+                    cursor.execute("SELECT pg_try_advisory_lock(%s)", (REFRESH_LOCK_ID,))
+                    if not cursor.fetchone()[0]:
+                        continue
+                    try:
+                        summary = build_recommendations(conn)
+                        if summary:
+                            data_version = announce_change(conn)
+                    finally:
+                        cursor.execute("SELECT pg_advisory_unlock(%s)", (REFRESH_LOCK_ID,))
+                        conn.commit()
+            except Exception as e:
+                if not self._stopped.is_set():
+                    logger.error("Recommendation refresh failed: %s", e)
+                continue
+            if summary and self.on_change is not None:
+                self.on_change(data_version)
+
+    def stop(self):
+        self._stopped.set()
@@ -0,0 +1,234 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import psycopg2
+
+from .db import ConnectionPool, PoolTimeout, db_connection
+from .metrics import record_pool_wait, registry
+from .notify import CURRENT_LSN_QUERY
+
+logger = logging.getLogger(__name__)
+
+# Seconds a client's reads stay on the primary after its own borrow or return,
+# and the cookie carrying the end of that window between its requests
+READ_YOUR_WRITES_SECONDS = 5
+PRIMARY_READS_COOKIE = 'primary_reads_until'
+
+# Seconds a replica that refused connections is left alone before it is tried again
+RETRY_SECONDS = 30
+
+# On a server that is not (or no longer) a standby the replay position is NULL
+REPLAYED_LSN_QUERY = "SELECT COALESCE(pg_last_wal_replay_lsn(), pg_current_wal_lsn())::text"
+
+read_checkouts = registry.counter(
+    'db_read_checkouts_total', "Read-only connection checkouts, by the server that served them.", ('server',))
+replica_fallbacks = registry.counter(
+    'db_replica_fallbacks_total', "Reads sent to the primary although replicas are configured.", ('reason',))
+
+_primary_reads_until = ContextVar('primary_reads_until', default=0.0)
+
+
+def lsn_value(lsn):
+    """A WAL position like ``'16/B374D848'`` as a comparable integer."""
+    high, low = lsn.split('/')
+    return (int(high, 16) << 32) | int(low, 16)
+
+
+def parse_host(entry, default_port):
+    """``'host'`` or ``'host:port'`` as ``(host, port)``."""
+    host, sep, port = entry.strip().rpartition(':')
+    if not sep:
+        return entry.strip(), default_port
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid replica address: {entry!r}")
+    return host, port
+
+
+class Replica:
+    """One standby server: its pool in this process and what is known about it."""
+
+    def __init__(self, host, port, pool_settings):
+        self.host = host
+        self.port = port
+        self.name = f"{host}:{port}"
+        self.down_until = 0.0
+        self.replayed = 0  # highest WAL position seen replayed there
+        self._settings = dict(pool_settings, host=host, port=port)
+        self._pool = None
+        self._lock = threading.Lock()
+        self._inherited = []
+
+    @property
+    def pool(self):
+        pool = self._pool
+        if pool is not None and pool.pid == os.getpid():
+            return pool
+        with self._lock:
+            if self._pool is None or self._pool.pid != os.getpid():
+                if self._pool is not None:
+                    # Never closed here: that would end the parent process's sessions
+                    self._inherited.append(self._pool)
+                self._pool = ConnectionPool(**self._settings)
+            return self._pool
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pool.pid == os.getpid():
+                self._pool.closeall()
+                self._pool = None
+
+
+class ReplicaRouter:
+    """Sends read-only work to streaming replicas, round-robin.
+
+    A replica is skipped, and the read goes to the next one or finally to the
+    primary, when it refuses connections (it is then left alone for
+    ``retry_seconds``), when its pool is exhausted, or when it has not yet
+    replayed the latest change this process knows of. That last check keeps
+    the catalog cache from being filled with data older than the version it
+    is stored under: writers pass the primary's WAL position after commit to
+    ``note_write()``, and a replica only serves reads once it has replayed
+    that far.
+    """
+
+    def __init__(self, hosts, default_port, retry_seconds=RETRY_SECONDS, **pool_settings):
+        self.retry_seconds = retry_seconds
+        self.replicas = [Replica(host, port, pool_settings) for host, port in
+                         (parse_host(entry, default_port) for entry in hosts)]
+        self._lock = threading.Lock()
+        self._next = 0
+        self._required = 0
+
+    def note_write(self, lsn):
+        """Reads from now on must see the primary's WAL up to ``lsn``."""
+        value = lsn_value(lsn)
+        with self._lock:
+            if value > self._required:
+                self._required = value
+
+    def _rotation(self):
+        with self._lock:
+            start = self._next
+            self._next = (self._next + 1) % len(self.replicas)
+        return self.replicas[start:] + self.replicas[:start]
+
+    def _caught_up(self, replica, conn, required):
+        if replica.replayed >= required:
+            return True
+        with conn.cursor() as cursor:
+            cursor.execute(REPLAYED_LSN_QUERY)
+            replayed = lsn_value(cursor.fetchone()[0])
+        conn.rollback()
+        replica.replayed = max(replica.replayed, replayed)
+        return replayed >= required
+
+    def checkout(self):
+        """``(replica, connection)`` from the first usable replica, or None to use the primary."""
+        required = self._required
+        now = time.monotonic()
+        reason = 'down'
+        for replica in self._rotation():
+            if replica.down_until > now:
+                continue
+            pool = replica.pool
+            started = time.perf_counter()
+            try:
+                conn = pool.getconn()
+            except PoolTimeout:
+                reason = 'busy'
+                continue
+            except psycopg2.OperationalError as e:
+                logger.warning("Replica %s unavailable, retrying in %.0fs: %s", replica.name, self.retry_seconds, e)
+                replica.down_until = time.monotonic() + self.retry_seconds
+                continue
+            record_pool_wait(time.perf_counter() - started)
+            try:
+                if self._caught_up(replica, conn, required):
+                    return replica, conn
+                reason = 'lagging'
+            except psycopg2.Error as e:
+                logger.warning("Replica %s failed its replay check: %s", replica.name, e)
+                pool.putconn(conn, discard=True)
+                continue
+            pool.putconn(conn)
+        replica_fallbacks.inc(reason)
+        return None
+
+    def close(self):
+        for replica in self.replicas:
+            replica.close()
+
+    def stats(self):
+        return [
+            dict(replica.pool.stats(),
+                 server=replica.name,
+                 down=replica.down_until > time.monotonic(),
+                 replayed_lsn=replica.replayed)
+            for replica in self.replicas
+        ]
+
+
+router = None
+read_your_writes_seconds = READ_YOUR_WRITES_SECONDS
+
+
+def configure(hosts, default_port, read_your_writes=READ_YOUR_WRITES_SECONDS, retry_seconds=RETRY_SECONDS,
+              **pool_settings):
+    """Route reads to the replicas at ``hosts`` (``host`` or ``host:port`` strings), or to the primary if none."""
+    global router, read_your_writes_seconds
+    read_your_writes_seconds = read_your_writes
+    hosts = [host for host in hosts if host.strip()]
+    router = ReplicaRouter(hosts, default_port, retry_seconds, **pool_settings) if hosts else None
+
+
+def pin_primary_until(value):
+    """Send this request's reads to the primary until ``value`` (a unix time, as set in the cookie)."""
+    try:
+        until = float(value) if value else 0.0
+    except ValueError:
+        until = 0.0
+    _primary_reads_until.set(until)
+
+
+def primary_window_end():
+    """Unix time until which the client that just wrote should read from the primary."""
+    return time.time() + read_your_writes_seconds
+
+
+def record_write(conn):
+    """After committing on ``conn``, make later replica reads in this process wait for that change."""
+    if router is None:
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(CURRENT_LSN_QUERY)
+        lsn, = cursor.fetchone()
+    conn.rollback()
+    router.note_write(lsn)
+
+
+@contextmanager
+def read_connection():
+    """Like db_connection(), for work that only reads: served by a replica where possible."""
+    checkout = None
+    if router is not None:
+        if _primary_reads_until.get() > time.time():
+            replica_fallbacks.inc('read_your_writes')
+        else:
+            checkout = router.checkout()
+
+    if checkout is None:
+        read_checkouts.inc('primary')
+        with db_connection() as conn:
+            yield conn
+        return
+
+    replica, conn = checkout
+    read_checkouts.inc(replica.name)
+    try:
+        yield conn
+    finally:
+        replica.pool.putconn(conn)
@@ -0,0 +1,139 @@
+from abc import ABC, abstractmethod
+
+from psycopg2.extensions import parse_dsn
+
+from .catalog import DEFAULT_PAGE_SIZE, fetch_book_page, refresh_catalog_entries
+from .circulation import borrow_books, return_books
+from .db import close_pool, configure_pool, db_connection
+from .notify import notify_change
+from .recommendations import recommended_books
+from .replicas import read_connection, record_write
+from .search import DEFAULT_SEARCH_SIZE, DEFAULT_SUGGESTIONS, loan_choices, search_books
+from .viewer import VIEWER_QUERIES, viewer_info
+
+# Stores the benchmark can run by name; any other ``module:Class`` path works too
+STORES = {
+    'postgres': 'app.repository:PostgresRepository',
+}
+
+
+class LibraryRepository(ABC):
+    """The storage operations behind the catalog, viewer, borrow, return and search pages.
+
+    The routes and bench/store_benchmark.py only go through these methods,
+    so a store other than Postgres (such as the Neo4j and MongoDB variants of
+    the app) is compared or swapped in by implementing them. Books are
+    mappings shaped like catalog.row_to_book(), and page cursors are the
+    keys from catalog.decode_cursor() and search.decode_cursor(). A
+    rejected borrow or return is a result with ``status`` ``'error'`` and a
+    ``code`` from circulation.ERROR_STATUS, not an exception; storage
+    failures raise.
+    """
+
+    name = None
+
+    @classmethod
+    @abstractmethod
+    def connect(cls, target, connections):
+        """A repository for a standalone process (the benchmark) on the store at ``target``.
+
+        ``target`` is the store's connection string. At most
+        ``connections`` operations run at once.
+        """
+
+    @abstractmethod
+    def catalog_page(self, sort='book_id', limit=DEFAULT_PAGE_SIZE, after=None,
+                     available=None, genre_id=None, author_id=None):
+        """One keyset page of the catalog: ``(books, next_cursor)``."""
+
+    @abstractmethod
+    def loan_choices(self, kind, text, limit=DEFAULT_SUGGESTIONS, available=None):
+        """Books or users (``kind``) matching ``text`` for the borrow and return forms.
+
+        As search.loan_choices(): ``[{"id": ..., "name": ...}]``, at most ``limit`` long.
+        """
+
+    @abstractmethod
+    def entity(self, type, entity_id):
+        """``(info, borrower, recommended)`` for viewer.html; ``info`` is empty if there is no such entity."""
+
+    @abstractmethod
+    def borrow(self, book_id, user_id, borrow_date):
+        """Lend a book; returns the result as circulation.borrow_books() does."""
+
+    @abstractmethod
+    def return_book(self, book_id, return_date):
+        """Close the book's open loan and charge its fine; returns the result as circulation.return_books() does."""
+
+    @abstractmethod
+    def search(self, text, limit=DEFAULT_SEARCH_SIZE, after=None):
+        """Ranked matches for ``text``: ``(books, next_cursor, fuzzy)``, each book with a ``rank``."""
+
+    def close(self):
+        """Release the connections of a repository made by connect()."""
+
+
+class PostgresRepository(LibraryRepository):
+    """The library in Postgres: reads from the catalog_entries read model, through
+    replicas where configured; writes on the primary pool, keeping catalog_entries
+    current and announcing the change to the other processes.
+
+    ``on_change`` is called with the shared data version after each write
+    commits, for this process's caches.
+    """
+
+    name = 'postgres'
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+
+    @classmethod
+    def connect(cls, target, connections):
+        configure_pool(minconn=1, maxconn=connections, timeout=30, **parse_dsn(target))
+        return cls()
+
+    def catalog_page(self, sort='book_id', limit=DEFAULT_PAGE_SIZE, after=None,
+                     available=None, genre_id=None, author_id=None):
+        with read_connection() as conn, conn.cursor() as cursor:
+            return fetch_book_page(cursor, sort, limit, after, available, genre_id, author_id)
+
+    def loan_choices(self, kind, text, limit=DEFAULT_SUGGESTIONS, available=None):
+        with read_connection() as conn, conn.cursor() as cursor:
+            return loan_choices(cursor, kind, text, limit, available)
+
+    def entity(self, type, entity_id):
+        with read_connection() as conn, conn.cursor() as cursor:
+            cursor.execute(VIEWER_QUERIES[type], (entity_id,))
+            result = cursor.fetchone()
+            recommended = recommended_books(cursor, entity_id) if type == 'book' and result else {}
+        return viewer_info(type, result) + (recommended,)
+
+    def borrow(self, book_id, user_id, borrow_date):
+        # Claim the book, record the borrow and count it in one locked round trip
+        return self._write(borrow_books, [(1, book_id, user_id, borrow_date)])
+
+    def return_book(self, book_id, return_date):
+        # Close the open borrow, compute the fine and release the book in one locked round trip
+        return self._write(return_books, [(1, book_id, return_date)])
+
+    def _write(self, operation, rows):
+        with db_connection() as conn, conn.cursor() as cursor:
+            result, = operation(cursor, rows)
+            if result['status'] != 'ok':
+                conn.rollback()
+                return result
+
+            refresh_catalog_entries(cursor, [result['book_id']])
+            data_version = notify_change(cursor)
+            conn.commit()
+            record_write(conn)
+        if self.on_change is not None:
+            self.on_change(data_version)
+        return result
+
+    def search(self, text, limit=DEFAULT_SEARCH_SIZE, after=None):
+        with read_connection() as conn, conn.cursor() as cursor:
+            return search_books(cursor, text, limit, after)
+
+    def close(self):
+        close_pool()
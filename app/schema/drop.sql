@@ -1,3 +1,18 @@
+DROP TABLE IF EXISTS data_version CASCADE;
+DROP FUNCTION IF EXISTS bump_catalog_revision() CASCADE;
+DROP TABLE IF EXISTS catalog_revision CASCADE;
+DROP TABLE IF EXISTS book_loan_totals CASCADE;
+DROP TABLE IF EXISTS monthly_book_loans CASCADE;
+DROP TABLE IF EXISTS daily_shelf_loans CASCADE;
+DROP TABLE IF EXISTS daily_genre_loans CASCADE;
+DROP TABLE IF EXISTS daily_circulation CASCADE;
+DROP TABLE IF EXISTS rollup_watermarks CASCADE;
+DROP TABLE IF EXISTS book_recommendations CASCADE;
+DROP TABLE IF EXISTS recommendation_builds CASCADE;
+DROP TABLE IF EXISTS entity_descriptions CASCADE;
+DROP TABLE IF EXISTS overdue_loans CASCADE;
+DROP TABLE IF EXISTS overdue_sweeps CASCADE;
+DROP TABLE IF EXISTS catalog_entries CASCADE;
 DROP TABLE IF EXISTS book_publishers CASCADE;
 DROP TABLE IF EXISTS book_genres CASCADE;
 DROP TABLE IF EXISTS book_authors CASCADE;
@@ -8,3 +23,4 @@ DROP TABLE IF EXISTS genres CASCADE;
 DROP TABLE IF EXISTS authors CASCADE;
 DROP TABLE IF EXISTS books CASCADE;
 DROP TABLE IF EXISTS users CASCADE;
+DROP TABLE IF EXISTS schema_migrations CASCADE;
\ No newline at end of file
@@ -82,4 +82,4 @@ CREATE TABLE book_publishers (
     PRIMARY KEY (book_id, publisher_id),
     FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE,
     FOREIGN KEY (publisher_id) REFERENCES publishers(publisher_id) ON DELETE CASCADE
-);
\ No newline at end of file
+);
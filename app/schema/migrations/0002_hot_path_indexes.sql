@@ -0,0 +1,18 @@
+-- migrate: no-transaction
+-- Indexes for the hot read paths; built CONCURRENTLY so a live database keeps taking writes
+-- An interrupted build leaves an invalid index behind; the migration runner drops it
+-- and builds it again on the next upgrade, and only records the migration once all are valid
+
+-- Latest borrow of a book (catalog, viewer, return)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS borrows_book_id_borrow_id_idx ON borrows (book_id, borrow_id DESC);
+
+-- Loans of a user (viewer user page)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS borrows_user_id_idx ON borrows (user_id);
+
+-- Reverse lookups from an author, publisher or genre to its books (viewer pages)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_authors_author_id_idx ON book_authors (author_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_publishers_publisher_id_idx ON book_publishers (publisher_id);
+CREATE INDEX CONCURRENTLY IF NOT EXISTS book_genres_genre_id_idx ON book_genres (genre_id);
+
+-- Books currently on loan, ordered by title (return form)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS books_unavailable_title_idx ON books (title) WHERE is_available = FALSE;
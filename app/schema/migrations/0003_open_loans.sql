@@ -0,0 +1,90 @@
+-- Track each book's open loan directly instead of searching borrow history for it
+ALTER TABLE books ADD COLUMN current_borrow_id INT;
+
+ALTER TABLE books
+    ADD CONSTRAINT books_current_borrow_id_fkey
+    FOREIGN KEY (current_borrow_id) REFERENCES borrows(borrow_id) ON DELETE SET NULL;
+
+-- Backfill: the latest unreturned borrow of every book currently on loan
+UPDATE books b
+SET current_borrow_id = open_loans.borrow_id
+FROM (
+    SELECT DISTINCT ON (bo.book_id) bo.book_id, bo.borrow_id
+    FROM borrows bo
+    WHERE NOT EXISTS (SELECT 1 FROM returns r WHERE r.borrow_id = bo.borrow_id)
+    ORDER BY bo.book_id, bo.borrow_id DESC
+) open_loans
+WHERE b.book_id = open_loans.book_id
+    AND b.is_available = FALSE;
+
+-- A borrow can be the open loan of one book only; also serves borrow -> book lookups
+CREATE UNIQUE INDEX books_current_borrow_id_idx ON books (current_borrow_id) WHERE current_borrow_id IS NOT NULL;
+
+-- Catalog read model: one denormalized row per book, maintained by the application.
+-- It is created here rather than in 0001, so that 0001 is exactly the schema.sql of
+-- databases created before migrations existed (which are stamped at 1), and it is
+-- filled from the books already there once their open loans are known.
+CREATE TABLE IF NOT EXISTS catalog_entries (
+    book_id INT PRIMARY KEY,
+    title VARCHAR(255) NOT NULL,
+    is_available BOOLEAN NOT NULL,
+    authors JSONB NOT NULL DEFAULT '[]',
+    publishers JSONB NOT NULL DEFAULT '[]',
+    genres JSONB NOT NULL DEFAULT '[]',
+    author_ids INT[] NOT NULL DEFAULT '{}',
+    genre_ids INT[] NOT NULL DEFAULT '{}',
+    borrower_id INT,
+    borrower_name VARCHAR(100),
+    borrow_date DATE,
+    due_date DATE,
+    FOREIGN KEY (book_id) REFERENCES books(book_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS catalog_entries_title_idx ON catalog_entries (title, book_id);
+CREATE INDEX IF NOT EXISTS catalog_entries_author_ids_idx ON catalog_entries USING GIN (author_ids);
+CREATE INDEX IF NOT EXISTS catalog_entries_genre_ids_idx ON catalog_entries USING GIN (genre_ids);
+
+-- Backfill, as catalog.refresh_catalog_entries() builds the rows
+INSERT INTO catalog_entries (
+    book_id, title, is_available, authors, publishers, genres,
+    author_ids, genre_ids, borrower_id, borrower_name, borrow_date, due_date
+)
+SELECT
+    b.book_id,
+    b.title,
+    b.is_available,
+    COALESCE(a.authors, '[]'),
+    COALESCE(p.publishers, '[]'),
+    COALESCE(g.genres, '[]'),
+    COALESCE(a.author_ids, '{}'),
+    COALESCE(g.genre_ids, '{}'),
+    u.user_id,
+    u.name,
+    lb.borrow_date,
+    lb.due_date
+FROM books b
+LEFT JOIN LATERAL (
+    SELECT
+        jsonb_agg(jsonb_build_object('id', a.author_id, 'name', a.name) ORDER BY a.author_id) AS authors,
+        array_agg(a.author_id ORDER BY a.author_id) AS author_ids
+    FROM book_authors ba
+    JOIN authors a ON a.author_id = ba.author_id
+    WHERE ba.book_id = b.book_id
+) a ON TRUE
+LEFT JOIN LATERAL (
+    SELECT jsonb_agg(jsonb_build_object('id', p.publisher_id, 'name', p.name) ORDER BY p.publisher_id) AS publishers
+    FROM book_publishers bp
+    JOIN publishers p ON p.publisher_id = bp.publisher_id
+    WHERE bp.book_id = b.book_id
+) p ON TRUE
+LEFT JOIN LATERAL (
+    SELECT
+        jsonb_agg(jsonb_build_object('id', g.genre_id, 'name', g.name) ORDER BY g.genre_id) AS genres,
+        array_agg(g.genre_id ORDER BY g.genre_id) AS genre_ids
+    FROM book_genres bg
+    JOIN genres g ON g.genre_id = bg.genre_id
+    WHERE bg.book_id = b.book_id
+) g ON TRUE
+LEFT JOIN borrows lb ON lb.borrow_id = b.current_borrow_id
+LEFT JOIN users u ON u.user_id = lb.user_id
+ON CONFLICT (book_id) DO NOTHING;
@@ -0,0 +1,33 @@
+-- Full-text search over the catalog read model.
+-- The document is a generated column, so every write to catalog_entries keeps it current:
+-- title (weight A), author names (B), genre and publisher names (C).
+ALTER TABLE catalog_entries
+    ADD COLUMN search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', title), 'A')
+        || setweight(jsonb_to_tsvector('english', authors, '["string"]'), 'B')
+        || setweight(jsonb_to_tsvector('english', genres || publishers, '["string"]'), 'C')
+    ) STORED;
+
+CREATE INDEX catalog_entries_search_vector_idx ON catalog_entries USING GIN (search_vector);
+
+-- Author name autocomplete (prefix of the name)
+CREATE INDEX authors_name_prefix_idx ON authors (lower(name) text_pattern_ops);
+
+-- Typo-tolerant matching of titles and author names needs pg_trgm. Servers without
+-- the extension still migrate; search then matches whole words and prefixes only.
+DO $$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+EXCEPTION WHEN undefined_file OR feature_not_supported OR insufficient_privilege THEN
+    RAISE NOTICE 'pg_trgm is not available: search will not correct typos';
+END
+$$;
+
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+        CREATE INDEX catalog_entries_title_trgm_idx ON catalog_entries USING GIN (title gin_trgm_ops);
+        CREATE INDEX authors_name_trgm_idx ON authors USING GIN (name gin_trgm_ops);
+    END IF;
+END
+$$;
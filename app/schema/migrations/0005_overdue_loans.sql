@@ -0,0 +1,29 @@
+-- Runs of the overdue sweep (flask db sweep-overdue)
+CREATE TABLE overdue_sweeps (
+    sweep_id SERIAL PRIMARY KEY,
+    as_of DATE NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ,
+    loans INT,
+    total_fine DECIMAL(12,2),
+    per_day DECIMAL(10,2) NOT NULL,
+    grace_days INT NOT NULL,
+    max_fine DECIMAL(10,2)
+);
+
+-- Open loans past their due date with the fine accrued so far, as of the last sweep
+CREATE TABLE overdue_loans (
+    borrow_id INT PRIMARY KEY,
+    sweep_id INT NOT NULL,
+    book_id INT NOT NULL,
+    user_id INT NOT NULL,
+    due_date DATE NOT NULL,
+    days_overdue INT NOT NULL,
+    accrued_fine DECIMAL(10,2) NOT NULL,
+    FOREIGN KEY (borrow_id) REFERENCES borrows(borrow_id) ON DELETE CASCADE,
+    FOREIGN KEY (sweep_id) REFERENCES overdue_sweeps(sweep_id) ON DELETE CASCADE
+);
+
+-- Report order (longest overdue first) and per-user reports
+CREATE INDEX overdue_loans_due_date_idx ON overdue_loans (due_date, borrow_id);
+CREATE INDEX overdue_loans_user_id_idx ON overdue_loans (user_id, due_date, borrow_id);
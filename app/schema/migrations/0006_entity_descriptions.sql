@@ -0,0 +1,11 @@
+-- Generated descriptions of catalog entities (GET /api/description), kept so each
+-- entity costs one upstream model call. ``name`` is the title or name the text was
+-- generated for: a row whose name no longer matches the entity is regenerated.
+CREATE TABLE entity_descriptions (
+    entity_type TEXT NOT NULL,
+    entity_id INT NOT NULL,
+    name TEXT NOT NULL,
+    description TEXT NOT NULL,
+    fetched_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    PRIMARY KEY (entity_type, entity_id)
+);
@@ -0,0 +1,23 @@
+-- Runs of the recommendation build (flask db build-recommendations, or the background refresh).
+-- last_borrow_id is the watermark: the next incremental run starts from the borrows after it.
+CREATE TABLE recommendation_builds (
+    build_id SERIAL PRIMARY KEY,
+    full_build BOOLEAN NOT NULL,
+    last_borrow_id INT NOT NULL,
+    started_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    finished_at TIMESTAMPTZ,
+    books INT,
+    recommendations INT
+);
+
+-- Precomputed "patrons also borrowed" neighbours of each book, best first. Derived
+-- data rewritten in bulk by every build, so without foreign keys (whose per-row checks
+-- would dominate a full build); readers join catalog_entries, which skips removed books.
+CREATE TABLE book_recommendations (
+    book_id INT NOT NULL,
+    rank SMALLINT NOT NULL,
+    recommended_book_id INT NOT NULL,
+    score REAL NOT NULL,
+    co_borrowers INT NOT NULL,
+    PRIMARY KEY (book_id, rank)
+);
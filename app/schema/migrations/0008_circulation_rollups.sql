@@ -0,0 +1,50 @@
+-- Per-day circulation aggregates, maintained incrementally by `flask db rollup`
+-- (or the background refresh) from the borrows and returns added since the watermark.
+
+-- Highest borrow_id / return_id already counted in the rollups
+CREATE TABLE rollup_watermarks (
+    source TEXT PRIMARY KEY,
+    last_id INT NOT NULL,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Loans by borrow date; returns, late returns and fines collected by return date
+CREATE TABLE daily_circulation (
+    day DATE PRIMARY KEY,
+    loans INT NOT NULL DEFAULT 0,
+    returns INT NOT NULL DEFAULT 0,
+    late_returns INT NOT NULL DEFAULT 0,
+    fines DECIMAL(12,2) NOT NULL DEFAULT 0
+);
+
+-- Loans by borrow date and the book's genre (a book in two genres counts in both)
+CREATE TABLE daily_genre_loans (
+    day DATE NOT NULL,
+    genre_id INT NOT NULL,
+    loans INT NOT NULL,
+    PRIMARY KEY (day, genre_id)
+);
+
+-- Loans by borrow date and the book's shelf location ('' for books without one)
+CREATE TABLE daily_shelf_loans (
+    day DATE NOT NULL,
+    shelf_location VARCHAR(10) NOT NULL,
+    loans INT NOT NULL,
+    PRIMARY KEY (day, shelf_location)
+);
+
+-- Loans per book by month of the borrow date, for the most borrowed titles
+CREATE TABLE monthly_book_loans (
+    month DATE NOT NULL,
+    book_id INT NOT NULL,
+    loans INT NOT NULL,
+    PRIMARY KEY (month, book_id)
+);
+
+-- All-time loans per book, so the default most borrowed list is one index range
+CREATE TABLE book_loan_totals (
+    book_id INT PRIMARY KEY,
+    loans INT NOT NULL
+);
+
+CREATE INDEX book_loan_totals_loans_idx ON book_loan_totals (loans DESC, book_id);
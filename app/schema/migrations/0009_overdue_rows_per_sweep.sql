@@ -0,0 +1,12 @@
+-- Each overdue sweep writes its own rows, so the report reads exactly one finished
+-- sweep while the next one is running; older sweeps' rows are deleted when it finishes.
+ALTER TABLE overdue_loans DROP CONSTRAINT overdue_loans_pkey;
+ALTER TABLE overdue_loans ADD PRIMARY KEY (sweep_id, borrow_id);
+
+DROP INDEX overdue_loans_due_date_idx;
+DROP INDEX overdue_loans_user_id_idx;
+CREATE INDEX overdue_loans_due_date_idx ON overdue_loans (sweep_id, due_date, borrow_id);
+CREATE INDEX overdue_loans_user_id_idx ON overdue_loans (sweep_id, user_id, due_date, borrow_id);
+
+-- The foreign key on borrow_id lost its index with the old primary key
+CREATE INDEX overdue_loans_borrow_id_idx ON overdue_loans (borrow_id);
@@ -0,0 +1,2 @@
+-- Databases that applied 0008 before its index followed the <table>_<columns>_idx naming
+ALTER INDEX IF EXISTS idx_book_loan_totals_loans RENAME TO book_loan_totals_loans_idx;
@@ -0,0 +1,44 @@
+-- Identifies the current content of the catalog bundle: books' titles, their authors,
+-- publishers and genres. Loans update other columns of books and leave it alone.
+
+CREATE TABLE catalog_revision (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    -- The last transaction that changed that content; never reused, even after a reset
+    revision BIGINT NOT NULL
+);
+
+CREATE FUNCTION bump_catalog_revision() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    INSERT INTO catalog_revision (revision) VALUES (pg_current_xact_id()::text::bigint)
+    ON CONFLICT (singleton) DO UPDATE SET revision = EXCLUDED.revision;
+    RETURN NULL;
+END
+$$;
+
+CREATE TRIGGER books_catalog_revision
+    AFTER INSERT OR DELETE OR UPDATE OF book_id, title ON books
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_revision();
+CREATE TRIGGER books_catalog_revision_truncate
+    AFTER TRUNCATE ON books
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_revision();
+
+CREATE TRIGGER authors_catalog_revision
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON authors
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_revision();
+CREATE TRIGGER publishers_catalog_revision
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON publishers
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_revision();
+CREATE TRIGGER genres_catalog_revision
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON genres
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_revision();
+CREATE TRIGGER book_authors_catalog_revision
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON book_authors
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_revision();
+CREATE TRIGGER book_publishers_catalog_revision
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON book_publishers
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_revision();
+CREATE TRIGGER book_genres_catalog_revision
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON book_genres
+    FOR EACH STATEMENT EXECUTE FUNCTION bump_catalog_revision();
+
+INSERT INTO catalog_revision (revision) VALUES (pg_current_xact_id()::text::bigint);
@@ -0,0 +1,11 @@
+-- Counts committed changes to the data the app caches. Every write moves it on in the
+-- statement that announces the change, so it is shared by all processes and grows in
+-- commit order; the catalog and viewer ETags are derived from it.
+CREATE TABLE data_version (
+    singleton BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (singleton),
+    version BIGINT NOT NULL
+);
+
+-- Starts at the current time in microseconds, so a recreated database does not
+-- count through versions (and ETags) handed out before
+INSERT INTO data_version (version) VALUES ((extract(epoch FROM clock_timestamp()) * 1000000)::bigint);
@@ -0,0 +1,9 @@
+-- migrate: no-transaction
+-- The borrow and return forms look books and users up as they are typed instead of
+-- listing them all; built and dropped CONCURRENTLY so a live database keeps taking loans
+
+-- Borrower lookup (prefix of the name)
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_name_prefix_idx ON users (lower(name) text_pattern_ops);
+
+-- Only the return form's list of every borrowed book read this; the lookup uses catalog_entries
+DROP INDEX CONCURRENTLY IF EXISTS books_unavailable_title_idx;
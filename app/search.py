@@ -0,0 +1,314 @@
+import base64
+import binascii
+import json
+import re
+
+from .catalog import BOOK_COLUMNS, row_to_book
+
+DEFAULT_SEARCH_SIZE = 20
+MAX_SEARCH_SIZE = 100
+DEFAULT_SUGGESTIONS = 8
+MAX_SUGGESTIONS = 20
+
+MAX_QUERY_LENGTH = 200
+MAX_TERMS = 8
+
+# Must be the configuration catalog_entries.search_vector is built with (migration 0004)
+TEXT_SEARCH_CONFIG = 'english'
+
+WORD = re.compile(r'[^\W_]+')
+
+# Whether pg_trgm is installed in the database; looked up once per process
+_trigram = None
+
+
+def build_tsquery(text):
+    """``to_tsquery`` input matching every word of ``text``, the last one as a prefix.
+
+    Only letters and digits are kept, so the result is always valid syntax.
+    Returns None if ``text`` has no words.
+    """
+    words = WORD.findall(text.lower())[:MAX_TERMS]
+    if not words:
+        return None
+    return ' & '.join(words[:-1] + [words[-1] + ':*'])
+
+
+def encode_cursor(rank, book_id):
+    raw = json.dumps(['rank', rank, book_id], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise ValueError("Malformed cursor")
+    if (isinstance(key, list) and len(key) == 3 and key[0] == 'rank'
+            and isinstance(key[1], (int, float)) and isinstance(key[2], int)):
+        return key[1], key[2]
+    raise ValueError("Malformed cursor")
+
+
+def _query_text(args):
+    text = (args.get('q') or '').strip()
+    if not text:
+        raise ValueError("q is required")
+    if len(text) > MAX_QUERY_LENGTH:
+        raise ValueError(f"q must be at most {MAX_QUERY_LENGTH} characters")
+    return text
+
+
+def _limit(args, default, most):
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        raise ValueError("limit must be an integer")
+    if not 1 <= limit <= most:
+        raise ValueError(f"limit must be between 1 and {most}")
+    return limit
+
+
+def parse_search_args(args):
+    """Validate /api/search query parameters; raises ValueError."""
+    cursor = args.get('cursor')
+    return {
+        "text": _query_text(args),
+        "limit": _limit(args, DEFAULT_SEARCH_SIZE, MAX_SEARCH_SIZE),
+        "after": decode_cursor(cursor) if cursor else None,
+    }
+
+
+def parse_suggest_args(args):
+    """Validate /api/search/suggest query parameters; raises ValueError."""
+    return {
+        "text": _query_text(args),
+        "limit": _limit(args, DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS),
+    }
+
+
+def parse_choice_args(kind, args):
+    """Validate /api/loan-choices/<kind> query parameters; raises ValueError."""
+    text = _query_text(args)
+    if not WORD.search(text):
+        raise ValueError("q must contain a letter or digit")
+
+    available = args.get('available')
+    if available is not None:
+        if kind != 'books':
+            raise ValueError("available only applies to books")
+        if available.lower() not in ('true', 'false'):
+            raise ValueError("available must be 'true' or 'false'")
+        available = available.lower() == 'true'
+
+    return {
+        "text": text,
+        "limit": _limit(args, DEFAULT_SUGGESTIONS, MAX_SUGGESTIONS),
+        "available": available,
+    }
+
+
+def choice_statement(kind, text, limit=DEFAULT_SUGGESTIONS, available=None):
+    """``(sql, params)`` of loan_choices."""
+    params = {
+        "id": int(text) if text.isdigit() else None,
+        "limit": limit,
+    }
+
+    if kind == 'books':
+        where = ""
+        if available is not None:
+            where = "AND c.is_available = %(available)s"
+            params["available"] = available
+        params.update(config=TEXT_SEARCH_CONFIG, tsquery=build_tsquery(text))
+        choice_query = f"""
+            SELECT c.book_id, c.title
+            FROM catalog_entries c
+            WHERE (c.book_id = %(id)s OR c.search_vector @@ to_tsquery(%(config)s::regconfig, %(tsquery)s))
+                {where}
+            ORDER BY (c.book_id = %(id)s) IS TRUE DESC, c.title, c.book_id
+            LIMIT %(limit)s
+        """
+    else:
+        params["prefix"] = text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        choice_query = """
+            SELECT user_id, name
+            FROM users
+            WHERE user_id = %(id)s OR lower(name) LIKE %(prefix)s
+            ORDER BY (user_id = %(id)s) IS TRUE DESC, lower(name), user_id
+            LIMIT %(limit)s
+        """
+    return choice_query, params
+
+
+def choice_results(rows):
+    return [{"id": choice_id, "name": name} for choice_id, name in rows]
+
+
+def loan_choices(cursor, kind, text, limit=DEFAULT_SUGGESTIONS, available=None):
+    """Lookup for the borrow and return forms: books or users matching ``text``.
+
+    A number also matches the book or user with that id, which comes first.
+    Books match like search_books (every word, the last as a prefix) and can
+    be narrowed to ``available`` or borrowed ones; users match the start of
+    the name. Returns ``[{"id": ..., "name": ...}]``, at most ``limit`` long.
+    """
+    cursor.execute(*choice_statement(kind, text, limit, available))
+    return choice_results(cursor.fetchall())
+
+
+def has_trigram(cursor):
+    global _trigram
+    if _trigram is None:
+        cursor.execute("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")
+        _trigram = cursor.fetchone()[0]
+    return _trigram
+
+
+def search_books(cursor, text, limit=DEFAULT_SEARCH_SIZE, after=None):
+    """Ranked full-text search of the catalog; returns ``(books, next_cursor, fuzzy)``.
+
+    Every word must match the title, an author, a genre or a publisher (the
+    last word as a prefix, for search-as-you-type). Every match is ranked,
+    so the best ones come first however broad the query; results are ordered
+    by rank and paged with a ``(rank, book_id)`` keyset cursor.
+
+    If nothing matches and pg_trgm is installed, the first page falls back to
+    titles and authors similar to ``text``, so a typo still finds the book;
+    ``fuzzy`` is then True and there is no next page.
+    """
+    tsquery = build_tsquery(text)
+    if tsquery is None:
+        return [], None, False
+
+    params = [TEXT_SEARCH_CONFIG, tsquery]
+    where = ""
+    if after is not None:
+        where = "WHERE c.rank < %s::real OR (c.rank = %s::real AND c.book_id > %s)"
+        params.extend([after[0], after[0], after[1]])
+
+    # Fetch one extra row to know whether another page follows
+    search_query = f"""
+        SELECT *
+        FROM (
+            SELECT {BOOK_COLUMNS}, ts_rank(c.search_vector, q.query) AS rank
+            FROM catalog_entries c, to_tsquery(%s::regconfig, %s) AS q(query)
+            WHERE c.search_vector @@ q.query
+        ) c
+        {where}
+        ORDER BY c.rank DESC, c.book_id
+        LIMIT %s
+    """
+    cursor.execute(search_query, params + [limit + 1])
+    rows = cursor.fetchall()
+
+    if not rows and after is None and has_trigram(cursor):
+        return _similar_books(cursor, text, limit), None, True
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    books = []
+    for row in rows:
+        book = row_to_book(row)
+        book["rank"] = row[-1]
+        books.append(book)
+    next_cursor = encode_cursor(rows[-1][-1], rows[-1][0]) if has_more else None
+    return books, next_cursor, False
+
+
+def _similar_books(cursor, text, limit):
+    similar_query = f"""
+        WITH similar_authors AS (
+            SELECT author_id, word_similarity(%(text)s, name) AS score
+            FROM authors
+            WHERE %(text)s <%% name
+            ORDER BY score DESC
+            LIMIT 50
+        )
+        SELECT {BOOK_COLUMNS}, score AS rank
+        FROM (
+            SELECT c.*, GREATEST(word_similarity(%(text)s, c.title), a.score) AS score
+            FROM catalog_entries c
+            LEFT JOIN LATERAL (
+                SELECT MAX(sa.score) AS score FROM similar_authors sa WHERE sa.author_id = ANY(c.author_ids)
+            ) a ON TRUE
+            WHERE %(text)s <%% c.title
+               OR c.author_ids && (SELECT COALESCE(array_agg(author_id), '{{}}') FROM similar_authors)
+        ) c
+        ORDER BY score DESC, c.book_id
+        LIMIT %(limit)s
+    """
+    cursor.execute(similar_query, {"text": text, "limit": limit})
+    books = []
+    for row in cursor.fetchall():
+        book = row_to_book(row)
+        book["rank"] = row[-1]
+        books.append(book)
+    return books
+
+
+def suggest(cursor, text, limit=DEFAULT_SUGGESTIONS):
+    """Autocomplete: the best matching titles, and author names starting like ``text``.
+
+    Titles are ranked as in search_books, so books whose title matches come
+    first; authors match the start of the name. With pg_trgm both lists are
+    topped up with similar spellings.
+    Returns ``{"titles": [...], "authors": [...]}``.
+    """
+    titles = []
+    tsquery = build_tsquery(text)
+    if tsquery is not None:
+        title_query = """
+            SELECT book_id, title
+            FROM (
+                SELECT c.book_id, c.title, ts_rank(c.search_vector, q.query) AS rank
+                FROM catalog_entries c, to_tsquery(%s::regconfig, %s) AS q(query)
+                WHERE c.search_vector @@ q.query
+            ) c
+            ORDER BY rank DESC, title, book_id
+            LIMIT %s
+        """
+        cursor.execute(title_query, (TEXT_SEARCH_CONFIG, tsquery, limit))
+        titles = cursor.fetchall()
+
+    prefix = text.lower().replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+    author_query = """
+        SELECT author_id, name
+        FROM authors
+        WHERE lower(name) LIKE %s
+        ORDER BY lower(name), author_id
+        LIMIT %s
+    """
+    cursor.execute(author_query, (prefix, limit))
+    authors = cursor.fetchall()
+
+    if (len(titles) < limit or len(authors) < limit) and has_trigram(cursor):
+        similar_titles_query = """
+            SELECT book_id, title
+            FROM catalog_entries
+            WHERE %(text)s <%% title AND NOT book_id = ANY(%(seen)s)
+            ORDER BY word_similarity(%(text)s, title) DESC, book_id
+            LIMIT %(limit)s
+        """
+        cursor.execute(similar_titles_query, {
+            "text": text, "seen": [row[0] for row in titles], "limit": limit - len(titles),
+        })
+        titles += cursor.fetchall()
+
+        similar_authors_query = """
+            SELECT author_id, name
+            FROM authors
+            WHERE %(text)s <%% name AND NOT author_id = ANY(%(seen)s)
+            ORDER BY word_similarity(%(text)s, name) DESC, author_id
+            LIMIT %(limit)s
+        """
+        cursor.execute(similar_authors_query, {
+            "text": text, "seen": [row[0] for row in authors], "limit": limit - len(authors),
+        })
+        authors += cursor.fetchall()
+
+    return {
+        "titles": [{"book_id": book_id, "title": title} for book_id, title in titles],
+        "authors": [{"id": author_id, "name": name} for author_id, name in authors],
+    }
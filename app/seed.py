@@ -0,0 +1,196 @@
+import hashlib
+import logging
+import time
+
+from psycopg2 import DatabaseError
+
+from .catalog import refresh_catalog_entries
+from .migrations import MIGRATIONS_DIR, discover_migrations, migrate
+
+logger = logging.getLogger(__name__)
+
+DROP_SQL = 'schema/drop.sql'
+SEED_DATA_SQL = 'schema/data.sql'
+
+# Pristine copy of the seeded tables, restored by a reset instead of rebuilding
+SNAPSHOT_SCHEMA = 'seed_snapshot'
+
+# Tables put back by a reset, parents before children (drop.sql in reverse)
+RESET_TABLES = (
+    'users',
+    'books',
+    'authors',
+    'genres',
+    'publishers',
+    'borrows',
+    'returns',
+    'book_authors',
+    'book_genres',
+    'book_publishers',
+    'catalog_entries',
+    'overdue_sweeps',
+    'overdue_loans',
+    'recommendation_builds',
+    'book_recommendations',
+    'rollup_watermarks',
+    'daily_circulation',
+    'daily_genre_loans',
+    'daily_shelf_loans',
+    'monthly_book_loans',
+    'book_loan_totals',
+)
+
+# Tables a reset leaves alone: the migration history, the catalog revision,
+# which the triggers on the restored tables move on themselves, the data
+# version, which must never go back, and the generated descriptions, paid for
+# upstream and still valid for the entity ids a reset restores (a full rebuild
+# drops them, and synthetic.generate_library() clears them)
+KEPT_TABLES = ('schema_migrations', 'catalog_revision', 'data_version', 'entity_descriptions')
+
+# Columns referencing a table restored later: table -> (key column, column).
+# They are restored once every table is back.
+DEFERRED_COLUMNS = {
+    'books': ('book_id', 'current_borrow_id'),
+}
+
+
+class SnapshotUnavailable(Exception):
+    pass
+
+
+def seed_fingerprint(directory=MIGRATIONS_DIR, data_file=SEED_DATA_SQL):
+    """Hash of every migration and the seed data; a snapshot is only valid for the same hash."""
+    digest = hashlib.sha256()
+    for version, name, path in discover_migrations(directory):
+        digest.update(f"{version:04d}_{name}\n".encode())
+        with open(path, 'rb') as f:
+            digest.update(f.read())
+    with open(data_file, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def take_snapshot(cursor, fingerprint):
+    """Copy the freshly seeded tables and sequence positions into the snapshot schema."""
+    cursor.execute("""
+        SELECT table_name
+        FROM information_schema.tables
+        WHERE table_schema = 'public' AND table_type = 'BASE TABLE'
+    """)
+    unknown = {row[0] for row in cursor.fetchall()} - set(RESET_TABLES) - set(KEPT_TABLES)
+    if unknown:
+        raise SnapshotUnavailable(f"Tables not listed in RESET_TABLES: {', '.join(sorted(unknown))}")
+
+    statements = [
+        f"DROP SCHEMA IF EXISTS {SNAPSHOT_SCHEMA} CASCADE",
+        f"CREATE SCHEMA {SNAPSHOT_SCHEMA}",
+    ]
+    statements += [f"CREATE TABLE {SNAPSHOT_SCHEMA}.{table} AS TABLE public.{table}" for table in RESET_TABLES]
+    statements += [
+        f"""CREATE TABLE {SNAPSHOT_SCHEMA}._sequences AS
+            SELECT sequencename, last_value FROM pg_sequences WHERE schemaname = 'public'""",
+        f"CREATE TABLE {SNAPSHOT_SCHEMA}._meta (fingerprint TEXT NOT NULL, taken_at TIMESTAMPTZ NOT NULL DEFAULT now())",
+    ]
+    cursor.execute(';\n'.join(statements))
+    cursor.execute(f"INSERT INTO {SNAPSHOT_SCHEMA}._meta (fingerprint) VALUES (%s)", (fingerprint,))
+
+
+def restore_snapshot(cursor, fingerprint):
+    """Put every table back to the snapshot in one round trip.
+
+    Raises SnapshotUnavailable if there is no snapshot or it was taken for
+    other migrations or seed data. Run it in a transaction of its own: the
+    TRUNCATE briefly locks out every other request.
+    """
+    cursor.execute("SELECT to_regclass(%s)", (f"{SNAPSHOT_SCHEMA}._meta",))
+    if cursor.fetchone()[0] is None:
+        raise SnapshotUnavailable("no snapshot has been taken")
+    cursor.execute(f"SELECT fingerprint FROM {SNAPSHOT_SCHEMA}._meta")
+    row = cursor.fetchone()
+    if row is None or row[0] != fingerprint:
+        raise SnapshotUnavailable("snapshot was taken for other migrations or seed data")
+
+    cursor.execute("""
+        SELECT table_name, array_agg(column_name::text ORDER BY ordinal_position)
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = ANY(%s) AND is_generated = 'NEVER'
+        GROUP BY table_name
+    """, (list(RESET_TABLES),))
+    columns = dict(cursor.fetchall())
+    missing = set(RESET_TABLES) - set(columns)
+    if missing:
+        raise SnapshotUnavailable(f"tables missing from the database: {', '.join(sorted(missing))}")
+
+    statements = [f"TRUNCATE {', '.join(RESET_TABLES)} RESTART IDENTITY"]
+    for table in RESET_TABLES:
+        deferred = DEFERRED_COLUMNS.get(table, (None, None))[1]
+        column_list = ', '.join(column for column in columns[table] if column != deferred)
+        statements.append(
+            f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {SNAPSHOT_SCHEMA}.{table}"
+        )
+    for table, (key, column) in DEFERRED_COLUMNS.items():
+        statements.append(f"""
+            UPDATE {table} t
+            SET {column} = s.{column}
+            FROM {SNAPSHOT_SCHEMA}.{table} s
+            WHERE t.{key} = s.{key} AND s.{column} IS NOT NULL
+        """)
+    statements.append(f"""
+        SELECT setval(format('public.%I', sequencename)::regclass, last_value)
+        FROM {SNAPSHOT_SCHEMA}._sequences
+        WHERE last_value IS NOT NULL
+    """)
+    cursor.execute(';\n'.join(statements))
+
+
+def rebuild_database(conn):
+    """Drop everything, migrate, load the seed data and build the catalog read model."""
+    with conn.cursor() as cursor:
+        with open(DROP_SQL, 'r') as f:
+            cursor.execute(f.read())
+        conn.commit()
+        logger.info("All tables dropped successfully.")
+
+        applied = migrate(conn)
+        logger.info("Database schema initialized (%d migrations applied).", len(applied))
+
+        with open(SEED_DATA_SQL, 'r') as f:
+            cursor.execute(f.read())
+        conn.commit()
+        logger.info("Initial data loaded into the database.")
+
+        refresh_catalog_entries(cursor)
+        conn.commit()
+        logger.info("Catalog read model built.")
+
+
+def reset_seed_data(conn, full=False):
+    """Reset the database to the seed data; returns ``(mode, seconds)``.
+
+    The snapshot is restored when it matches the current migrations and seed
+    data ('snapshot'). Otherwise, or with ``full``, the database is rebuilt
+    from scratch and a new snapshot is taken ('full').
+    """
+    started = time.monotonic()
+    fingerprint = seed_fingerprint()
+
+    if not full:
+        try:
+            with conn.cursor() as cursor:
+                restore_snapshot(cursor, fingerprint)
+            conn.commit()
+            return 'snapshot', time.monotonic() - started
+        except (SnapshotUnavailable, DatabaseError) as e:
+            conn.rollback()
+            logger.info("Seed snapshot not used (%s); rebuilding the database.", e)
+
+    rebuild_database(conn)
+    try:
+        with conn.cursor() as cursor:
+            take_snapshot(cursor, fingerprint)
+        conn.commit()
+        logger.info("Seed snapshot taken.")
+    except (SnapshotUnavailable, DatabaseError) as e:
+        conn.rollback()
+        logger.warning("Could not take a seed snapshot: %s", e)
+    return 'full', time.monotonic() - started
@@ -0,0 +1,33 @@
+// description.js
+
+/**
+ * Loads the generated description of the entity shown on the viewer page
+ * (#description's data-type and data-id) and renders it from Markdown.
+ */
+async function loadDescription() {
+    const container = document.getElementById('description');
+    const type = container.dataset.type;
+    const id = container.dataset.id;
+    if (!type || !id) {
+        return;
+    }
+
+    try {
+        const response = await fetch(`/api/description?type=${encodeURIComponent(type)}&id=${encodeURIComponent(id)}`);
+        if (response.status === 503) {
+            // Not configured, or the model endpoint is down: keep the placeholder
+            return;
+        } else if (!response.ok) {
+            throw new Error('Could not load the description.');
+        }
+
+        const data = await response.json();
+        const descriptionHTML = DOMPurify.sanitize(marked.parse(data.description || 'No description available.'));
+        container.innerHTML = `<h2>Description</h2>${descriptionHTML}`;
+    } catch (error) {
+        console.error('Error fetching description:', error);
+        container.innerHTML = `<p>${error.message}</p>`;
+    }
+}
+
+window.addEventListener('DOMContentLoaded', loadDescription);
@@ -1,49 +1,20 @@
-window.onload = function () {
-    // Fetch all XML data concurrently
-    Promise.all([
-        fetch('/static/data/authors.xml').then(response => response.text()),
-        fetch('/static/data/publishers.xml').then(response => response.text()),
-        fetch('/static/data/books.xml').then(response => response.text()),
-        fetch('/static/data/genres.xml').then(response => response.text()) // Fetch genres.xml
-    ]).then(([authorsData, publishersData, booksData, genresData]) => {
-        const parser = new DOMParser();
-
-        // Parse authors.xml
-        const authorsDoc = parser.parseFromString(authorsData, "application/xml");
-        const authors = {};
-        const authorsList = authorsDoc.getElementsByTagName('Author');
-        for (let i = 0; i < authorsList.length; i++) {
-            const author = authorsList[i];
-            const id = author.getAttribute('id');
-            const name = author.getElementsByTagName('Name')[0].textContent;
-            authors[id] = name;
-        }
-
-        // Parse publishers.xml
-        const publishersDoc = parser.parseFromString(publishersData, "application/xml");
-        const publishers = {};
-        const publishersList = publishersDoc.getElementsByTagName('Publisher');
-        for (let i = 0; i < publishersList.length; i++) {
-            const publisher = publishersList[i];
-            const id = publisher.getAttribute('id');
-            const name = publisher.getElementsByTagName('Name')[0].textContent;
-            publishers[id] = name;
-        }
-
-        // Parse genres.xml
-        const genresDoc = parser.parseFromString(genresData, "application/xml");
-        const genres = {};
-        const genresList = genresDoc.getElementsByTagName('Genre');
-        for (let i = 0; i < genresList.length; i++) {
-            const genre = genresList[i];
-            const id = genre.getAttribute('id');
-            const name = genre.getElementsByTagName('Name')[0].textContent;
-            genres[id] = name;
-        }
+/**
+ * Fetches the catalog bundle: one compact JSON document with every book and
+ * the authors, publishers and genres they refer to. /api/catalog-bundle
+ * redirects to a content-hashed URL the browser keeps until the data changes.
+ * @returns {Promise<Object>} The parsed bundle.
+ */
+async function fetchCatalogBundle() {
+    const response = await fetch('/api/catalog-bundle');
+    if (!response.ok) {
+        throw new Error(`Failed to fetch the catalog: ${response.statusText}`);
+    }
+    return response.json();
+}
 
-        // Parse books.xml
-        const booksDoc = parser.parseFromString(booksData, "application/xml");
-        const books = booksDoc.getElementsByTagName('Book');
+window.onload = function () {
+    fetchCatalogBundle().then(catalog => {
+        const { authors, publishers, genres } = catalog;
         const bookTable = document.getElementById('book-table');
         const borrowBookSelect = document.getElementById('borrowBookId');
         const returnBookSelect = document.getElementById('returnBookId');
@@ -51,69 +22,53 @@ window.onload = function () {
         // Retrieve borrowing data from LocalStorage
         const borrowingData = JSON.parse(localStorage.getItem('borrowingData')) || {};
 
+        const onLoan = new Set(Array.from(returnBookSelect.options, option => option.value));
+
         // Clear existing options
         borrowBookSelect.innerHTML = '<option value="">Select a Book</option>';
         returnBookSelect.innerHTML = '<option value="">Select a Book</option>';
 
-        for (let i = 0; i < books.length; i++) {
-            const book = books[i];
-            const id = book.getAttribute('id');
-            const title = book.getElementsByTagName('Title')[0].textContent;
-
-            // Fetch Author
-            const authorElement = book.getElementsByTagName('Author')[0];
-            const authorHref = authorElement.getAttribute('xlink:href');
-            const authorId = authorHref.split('#')[1];
-            const authorName = authors[authorId] || 'Unknown';
-
-            // Fetch Publisher
-            const publisherElement = book.getElementsByTagName('Publisher')[0];
-            const publisherHref = publisherElement.getAttribute('xlink:href');
-            const publisherId = publisherHref.split('#')[1];
-            const publisherName = publishers[publisherId] || 'Unknown';
-
-            // Fetch Genre
-            const genreElement = book.getElementsByTagName('Genre')[0];
-            const genreHref = genreElement.getAttribute('xlink:href');
-            const genreId = genreHref.split('#')[1];
-            const genreName = genres[genreId] || 'Unknown';
+        // Links to the viewer page of each related entity
+        const links = (type, names, ids) => ids
+            .map(entityId => `<a href="viewer.html?type=${type}&id=${entityId}" target="_blank">${names[entityId] || 'Unknown'}</a>`)
+            .join(', ');
 
+        for (const [id, title, authorIds, publisherIds, genreIds] of catalog.books) {
             // Create table row for each book
             const row = document.createElement('tr');
             row.setAttribute('data-id', id);
 
-            // Check if book is borrowed
-            const isBorrowed = borrowingData[id] ? true : false;
+            // Check if book is borrowed: the bundle leaves availability out (it
+            // changes with every loan), the return list holds the books on loan
+            const isBorrowed = Boolean(borrowingData[id]) || onLoan.has(String(id));
+            const borrowing = borrowingData[id] || {};
 
             // Populate row with book details, including genre
             row.innerHTML = `<td>${id}</td>
-                             <td><a href="viewer.html?file=books.xml&id=${id}" target="_blank">${title}</a></td>
-                             <td><a href="viewer.html?file=authors.xml&id=${authorId}" target="_blank">${authorName}</a></td>
-                             <td><a href="viewer.html?file=publishers.xml&id=${publisherId}" target="_blank">${publisherName}</a></td>
-                             <td><a href="viewer.html?file=genres.xml&id=${genreId}" target="_blank">${genreName}</a></td>
-                             <td>${isBorrowed ? borrowingData[id].borrowerName : ''}</td>
-                             <td>${isBorrowed ? borrowingData[id].borrowDate : ''}</td>
-                             <td>${isBorrowed ? borrowingData[id].returnDate : ''}</td>
+                             <td><a href="viewer.html?type=book&id=${id}" target="_blank">${title}</a></td>
+                             <td>${links('author', authors, authorIds)}</td>
+                             <td>${links('publisher', publishers, publisherIds)}</td>
+                             <td>${links('genre', genres, genreIds)}</td>
+                             <td>${borrowing.borrowerName || ''}</td>
+                             <td>${borrowing.borrowDate || ''}</td>
+                             <td>${borrowing.returnDate || ''}</td>
                              <td>${isBorrowed ? 'Borrowed' : 'Present'}</td>`;
             bookTable.appendChild(row);
 
             // Populate the appropriate dropdown
+            const option = document.createElement('option');
+            option.value = id;
+            option.textContent = `${id} - ${title}`;
             if (!isBorrowed) {
                 // Add book to Borrow dropdown
-                const option = document.createElement('option');
-                option.value = id;
-                option.textContent = `${id} - ${title}`;
                 borrowBookSelect.appendChild(option);
             } else {
                 // Add book to Return dropdown
-                const returnOption = document.createElement('option');
-                returnOption.value = id;
-                returnOption.textContent = `${id} - ${title}`;
-                returnBookSelect.appendChild(returnOption);
+                returnBookSelect.appendChild(option);
             }
         }
     }).catch(error => {
-        console.error('Error fetching or parsing XML files:', error);
+        console.error('Error fetching the catalog:', error);
     });
 };
 
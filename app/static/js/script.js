@@ -13,4 +13,44 @@ document.getElementById('borrowForm').addEventListener('submit', function (e) {
 
 document.getElementById('returnForm').addEventListener('submit', function (e) {
     alert('Book returned successfully!');
-});
\ No newline at end of file
+});
+
+// Borrow and return lookups: refill each input's datalist from its data-lookup URL as the user types
+document.querySelectorAll('input[data-lookup]').forEach(function (input) {
+    const choices = document.getElementById(input.getAttribute('list'));
+    let timer = null;
+    let controller = null;
+
+    input.addEventListener('input', function () {
+        clearTimeout(timer);
+        const text = input.value.trim();
+        if (!text) {
+            return;
+        }
+        timer = setTimeout(async function () {
+            if (controller) {
+                controller.abort();
+            }
+            controller = new AbortController();
+            const separator = input.dataset.lookup.includes('?') ? '&' : '?';
+            try {
+                const response = await fetch(`${input.dataset.lookup}${separator}q=${encodeURIComponent(text)}`,
+                                             {signal: controller.signal});
+                if (!response.ok) {
+                    return;
+                }
+                const data = await response.json();
+                choices.replaceChildren(...data.choices.map(function (choice) {
+                    const option = document.createElement('option');
+                    option.value = choice.id;
+                    option.textContent = choice.name;
+                    return option;
+                }));
+            } catch (error) {
+                if (error.name !== 'AbortError') {
+                    console.error('Error looking up choices:', error);
+                }
+            }
+        }, 200);
+    });
+});
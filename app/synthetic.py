@@ -0,0 +1,215 @@
+import logging
+import random
+import time
+from datetime import date, timedelta
+from itertools import accumulate
+
+from dateutil.relativedelta import relativedelta
+
+from . import circulation
+from .catalog import refresh_catalog_entries
+from .importer import copy_rows
+from .seed import RESET_TABLES
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 10000
+
+GENRES = (
+    'Fiction', 'Mystery', 'Fantasy', 'Romance', 'Science Fiction', 'Thriller', 'Young Adult',
+    'Biography', 'History', 'Children', 'Crime', 'Horror', 'Self-Help', 'Adventure', 'Poetry',
+    'Philosophy', 'Travel', 'Cooking', 'Science', 'Art', 'Religion', 'Drama', 'Humor', 'Classics',
+)
+
+FIRST_NAMES = (
+    'Anna', 'Ben', 'Clara', 'David', 'Elena', 'Felix', 'Greta', 'Hugo', 'Ines', 'Jonas', 'Kira',
+    'Lukas', 'Mara', 'Niklas', 'Olga', 'Paul', 'Quinn', 'Rosa', 'Simon', 'Tara', 'Umar', 'Vera',
+    'Wei', 'Xenia', 'Yusuf', 'Zoe',
+)
+LAST_NAMES = (
+    'Adler', 'Becker', 'Chen', 'Dietrich', 'Engel', 'Fischer', 'Garcia', 'Hoffmann', 'Ito',
+    'Jung', 'Keller', 'Lang', 'Meyer', 'Nowak', 'Okafor', 'Peters', 'Quist', 'Richter', 'Schmidt',
+    'Tanaka', 'Ulrich', 'Vogel', 'Weber', 'Yilmaz', 'Zimmer',
+)
+TITLE_WORDS = (
+    'Silent', 'Golden', 'Hidden', 'Last', 'Broken', 'Winter', 'Midnight', 'Distant', 'Burning',
+    'Forgotten', 'Glass', 'Iron', 'Secret', 'Lost', 'Northern', 'Crimson', 'Wild', 'Quiet',
+)
+TITLE_NOUNS = (
+    'River', 'Garden', 'Kingdom', 'Letter', 'Harbor', 'Orchard', 'Mountain', 'Library', 'Empire',
+    'Voyage', 'Shadow', 'Bridge', 'Promise', 'Island', 'Machine', 'Storm', 'Crown', 'House',
+)
+PUBLISHER_WORDS = ('House', 'Press', 'Books', 'Publishing', 'Editions')
+
+
+def _zipf_weights(count, exponent=1.1):
+    """Cumulative weights where the n-th item is picked ~1/n^exponent as often as the first."""
+    return list(accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+
+def _isbn13(number):
+    digits = f"978{number:09d}"
+    total = sum(int(d) * (3 if i % 2 else 1) for i, d in enumerate(digits))
+    return digits + str((10 - total % 10) % 10)
+
+
+def _person(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+
+def _title(rng):
+    title = f"The {rng.choice(TITLE_WORDS)} {rng.choice(TITLE_NOUNS)}"
+    if rng.random() < 0.3:
+        title += f" of {rng.choice(TITLE_WORDS)} {rng.choice(TITLE_NOUNS)}"
+    return title
+
+
+def _picks(rng, population, cum_weights, most):
+    """Up to ``most`` distinct weighted picks, sorted."""
+    picked = set(rng.choices(population, cum_weights=cum_weights, k=rng.randint(1, most)))
+    return sorted(picked)
+
+
+def generate_library(conn, book_count=1000, user_count=200, author_count=None, publisher_count=None,
+                     years=3, loans_per_year=4, until=None, seed=1, chunk_size=DEFAULT_CHUNK_SIZE,
+                     progress=None, policy=None):
+    """Replace all data with a synthetic library; returns counts per table and the time taken.
+
+    The output only depends on the arguments: the same ``seed`` and ``until``
+    always produce the same library. Author, genre and user popularity follow
+    a Zipf distribution and book popularity a Pareto one, so a few books,
+    genres and readers account for most loans, as in a real library.
+
+    Each book gets ``years`` of borrow/return history ending at ``until``
+    (default today) averaging ``loans_per_year`` loans; loans still running at
+    ``until`` stay open. Rows are generated and COPYed ``chunk_size`` books
+    at a time, so memory stays bounded. Late returns are fined by ``policy``
+    (default: the configured circulation.fine_policy), as a return through
+    the app would be.
+    """
+    policy = policy or circulation.fine_policy
+    rng = random.Random(seed)
+    until = until or date.today()
+    start = until - timedelta(days=int(365 * years))
+    author_count = author_count or max(1, book_count // 4)
+    publisher_count = publisher_count or max(1, min(200, book_count // 50))
+    started = time.monotonic()
+    counts = dict.fromkeys(RESET_TABLES, 0)
+
+    author_ids = range(1, author_count + 1)
+    author_weights = _zipf_weights(author_count, exponent=0.8)
+    genre_ids = range(1, len(GENRES) + 1)
+    genre_weights = _zipf_weights(len(GENRES))
+    publisher_ids = range(1, publisher_count + 1)
+    publisher_weights = _zipf_weights(publisher_count)
+    user_ids = range(1, user_count + 1)
+    user_weights = _zipf_weights(user_count, exponent=0.7)
+
+    books_borrowed = [0] * (user_count + 1)
+    borrow_id = 0
+    return_id = 0
+
+    with conn.cursor() as cursor:
+        # Generated entities reuse the seed ids: their descriptions go too
+        cursor.execute(f"TRUNCATE {', '.join(RESET_TABLES)}, entity_descriptions RESTART IDENTITY")
+
+        copy_rows(cursor, 'users', ('user_id', 'name', 'email', 'tel_no', 'books_borrowed'), (
+            (user_id, _person(rng), f"user{user_id}@example.com",
+             f"({rng.randint(200, 999)}) {rng.randint(200, 999)}-{rng.randint(0, 9999):04d}"
+             if rng.random() < 0.7 else '', 0)
+            for user_id in user_ids
+        ))
+        copy_rows(cursor, 'authors', ('author_id', 'name'), ((i, _person(rng)) for i in author_ids))
+        copy_rows(cursor, 'genres', ('genre_id', 'name'), enumerate(GENRES, start=1))
+        copy_rows(cursor, 'publishers', ('publisher_id', 'name'), (
+            (i, f"{rng.choice(LAST_NAMES)} {rng.choice(PUBLISHER_WORDS)}") for i in publisher_ids
+        ))
+        counts.update(users=user_count, authors=author_count, genres=len(GENRES), publishers=publisher_count)
+
+        for first in range(1, book_count + 1, chunk_size):
+            books, book_authors, book_genres, book_publishers, borrows, returns = [], [], [], [], [], []
+            open_loans = []
+
+            for book_id in range(first, min(first + chunk_size, book_count + 1)):
+                genres = _picks(rng, genre_ids, genre_weights, 3)
+                books.append((
+                    book_id,
+                    _title(rng),
+                    _isbn13(book_id),
+                    rng.choices((1, 2, 3, 4), weights=(80, 12, 5, 3))[0],
+                    rng.randint(1950, until.year),
+                    f"{chr(ord('A') + genres[0] - 1)}{rng.randint(1, 9)}",
+                ))
+                book_authors += [(book_id, a) for a in _picks(rng, author_ids, author_weights, 2)]
+                book_genres += [(book_id, g) for g in genres]
+                book_publishers.append((book_id, rng.choices(publisher_ids, cum_weights=publisher_weights)[0]))
+
+                # Loans arrive as a Poisson process whose rate is the book's popularity
+                rate = loans_per_year * rng.paretovariate(1.5) / 3 / 365
+                day = start + timedelta(days=int(rng.expovariate(rate))) if rate else until + timedelta(days=1)
+                while day <= until:
+                    borrow_id += 1
+                    user_id = rng.choices(user_ids, cum_weights=user_weights)[0]
+                    due = day + relativedelta(months=1)
+                    borrows.append((borrow_id, user_id, book_id, day, due))
+                    returned = day + timedelta(days=int(rng.triangular(2, 60, 14)))
+                    if returned > until:
+                        open_loans.append((book_id, borrow_id))
+                        books_borrowed[user_id] += 1
+                        break
+                    return_id += 1
+                    late = max((returned - due).days, 0)
+                    returns.append((return_id, borrow_id, returned, policy.fine(late), late > 0))
+                    day = returned + timedelta(days=1 + int(rng.expovariate(rate)))
+
+            copy_rows(cursor, 'books', ('book_id', 'title', 'isbn', 'edition', 'publication_year', 'shelf_location'),
+                      books)
+            copy_rows(cursor, 'book_authors', ('book_id', 'author_id'), book_authors)
+            copy_rows(cursor, 'book_genres', ('book_id', 'genre_id'), book_genres)
+            copy_rows(cursor, 'book_publishers', ('book_id', 'publisher_id'), book_publishers)
+            copy_rows(cursor, 'borrows', ('borrow_id', 'user_id', 'book_id', 'borrow_date', 'due_date'), borrows)
+            copy_rows(cursor, 'returns', ('return_id', 'borrow_id', 'return_date', 'fine', 'overdue_status'),
+                      returns)
+            if open_loans:
+                cursor.execute("""
+                    UPDATE books b
+                    SET is_available = FALSE, current_borrow_id = o.borrow_id
+                    FROM unnest(%s::int[], %s::int[]) AS o(book_id, borrow_id)
+                    WHERE b.book_id = o.book_id
+                """, [list(column) for column in zip(*open_loans)])
+
+            counts['books'] += len(books)
+            counts['book_authors'] += len(book_authors)
+            counts['book_genres'] += len(book_genres)
+            counts['book_publishers'] += len(book_publishers)
+            counts['borrows'] += len(borrows)
+            counts['returns'] += len(returns)
+            if progress:
+                progress(counts)
+
+        borrowing = [(user_id, books_borrowed[user_id]) for user_id in user_ids if books_borrowed[user_id]]
+        if borrowing:
+            cursor.execute("""
+                UPDATE users u
+                SET books_borrowed = n.borrowed
+                FROM unnest(%s::int[], %s::int[]) AS n(user_id, borrowed)
+                WHERE u.user_id = n.user_id
+            """, [list(column) for column in zip(*borrowing)])
+
+        # Explicit ids were written, so move every sequence past them
+        for table, id_column in (('users', 'user_id'), ('books', 'book_id'), ('authors', 'author_id'),
+                                 ('genres', 'genre_id'), ('publishers', 'publisher_id'),
+                                 ('borrows', 'borrow_id'), ('returns', 'return_id')):
+            cursor.execute(
+                f"SELECT setval(pg_get_serial_sequence(%s, %s), GREATEST(MAX({id_column}), 1), MAX({id_column}) IS NOT NULL) FROM {table}",
+                (table, id_column)
+            )
+
+        cursor.execute("ANALYZE")
+        refresh_catalog_entries(cursor)
+        counts['catalog_entries'] = counts['books']
+        conn.commit()
+
+    seconds = time.monotonic() - started
+    logger.info("Synthetic library generated in %.1fs: %s", seconds, counts)
+    return counts, seconds
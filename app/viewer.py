@@ -0,0 +1,140 @@
+# Books listed on an author, publisher or genre page, by title; the page
+# shows how many there are and links to the catalog filtered to all of them
+VIEWER_BOOK_LIMIT = 100
+
+# Rows shown on each viewer page, in the order the query returns them
+VIEWER_COLUMNS = {
+    "book": ['Title', 'Edition', 'ISBN', 'Publication Year', 'Shelf Location', 'Status', 'Author', 'Publisher', 'Genre'],
+    "author": ['Name', 'Books', 'Total Books'],
+    "publisher": ["Name", 'Books', 'Total Books'],
+    "genre": ["Name", 'Books', 'Total Books'],
+    "user": ["Name", "Email", "Tel-No", "Borrowed Books"]
+}
+
+# One round trip per page: related entities are aggregated into JSON arrays of [id, name]
+VIEWER_QUERIES = {
+    "book": """
+        SELECT
+            b.title,
+            b.edition,
+            b.isbn,
+            b.publication_year,
+            b.shelf_location,
+            b.is_available,
+            COALESCE((
+                SELECT json_agg(json_build_array(a.author_id, a.name) ORDER BY a.name)
+                FROM book_authors ba
+                JOIN authors a ON a.author_id = ba.author_id
+                WHERE ba.book_id = b.book_id
+            ), '[]'),
+            COALESCE((
+                SELECT json_agg(json_build_array(p.publisher_id, p.name) ORDER BY p.name)
+                FROM book_publishers bp
+                JOIN publishers p ON p.publisher_id = bp.publisher_id
+                WHERE bp.book_id = b.book_id
+            ), '[]'),
+            COALESCE((
+                SELECT json_agg(json_build_array(g.genre_id, g.name) ORDER BY g.name)
+                FROM book_genres bg
+                JOIN genres g ON g.genre_id = bg.genre_id
+                WHERE bg.book_id = b.book_id
+            ), '[]'),
+            br.name,
+            br.email,
+            br.tel_no
+        FROM books b
+        LEFT JOIN borrows bo ON bo.borrow_id = b.current_borrow_id
+        LEFT JOIN users br ON br.user_id = bo.user_id
+        WHERE b.book_id = %s
+    """,
+    "author": f"""
+        SELECT
+            a.name,
+            COALESCE((
+                SELECT json_agg(json_build_array(b.book_id, b.title) ORDER BY b.title)
+                FROM (
+                    SELECT b.book_id, b.title
+                    FROM book_authors ba
+                    JOIN books b ON b.book_id = ba.book_id
+                    WHERE ba.author_id = a.author_id
+                    ORDER BY b.title
+                    LIMIT {VIEWER_BOOK_LIMIT}
+                ) b
+            ), '[]'),
+            (SELECT COUNT(*) FROM book_authors ba WHERE ba.author_id = a.author_id)
+        FROM authors a
+        WHERE a.author_id = %s
+    """,
+    "publisher": f"""
+        SELECT
+            p.name,
+            COALESCE((
+                SELECT json_agg(json_build_array(b.book_id, b.title) ORDER BY b.title)
+                FROM (
+                    SELECT b.book_id, b.title
+                    FROM book_publishers bp
+                    JOIN books b ON b.book_id = bp.book_id
+                    WHERE bp.publisher_id = p.publisher_id
+                    ORDER BY b.title
+                    LIMIT {VIEWER_BOOK_LIMIT}
+                ) b
+            ), '[]'),
+            (SELECT COUNT(*) FROM book_publishers bp WHERE bp.publisher_id = p.publisher_id)
+        FROM publishers p
+        WHERE p.publisher_id = %s
+    """,
+    "genre": f"""
+        SELECT
+            g.name,
+            COALESCE((
+                SELECT json_agg(json_build_array(b.book_id, b.title) ORDER BY b.title)
+                FROM (
+                    SELECT b.book_id, b.title
+                    FROM book_genres bg
+                    JOIN books b ON b.book_id = bg.book_id
+                    WHERE bg.genre_id = g.genre_id
+                    ORDER BY b.title
+                    LIMIT {VIEWER_BOOK_LIMIT}
+                ) b
+            ), '[]'),
+            (SELECT COUNT(*) FROM book_genres bg WHERE bg.genre_id = g.genre_id)
+        FROM genres g
+        WHERE g.genre_id = %s
+    """,
+    "user": """
+        SELECT
+            u.name,
+            u.email,
+            u.tel_no,
+            COALESCE((
+                SELECT json_agg(json_build_array(b.book_id, b.title) ORDER BY b.title)
+                FROM borrows bo
+                JOIN books b ON b.current_borrow_id = bo.borrow_id
+                WHERE bo.user_id = u.user_id
+            ), '[]')
+        FROM users u
+        WHERE u.user_id = %s
+    """
+}
+
+
+def viewer_info(type, result):
+    """Shape a viewer query row for viewer.html; returns ``(info, borrower)``."""
+    if not result:
+        return {}, None
+
+    column = VIEWER_COLUMNS[type]
+    info = dict(zip(column, result))
+
+    # Related entities arrive as [[id, name], ...]
+    for key in ('Author', 'Publisher', 'Genre', 'Books', 'Borrowed Books'):
+        if key in info:
+            info[key] = {related_id: name for related_id, name in info[key]}
+
+    # If book is not available, add borrower details
+    borrower = None
+    if type == 'book' and not info["Status"]:
+        borrower_result = result[len(column):]
+        borrower = dict(zip(VIEWER_COLUMNS['user'], borrower_result)) if borrower_result[0] is not None else {}
+
+    return info, borrower
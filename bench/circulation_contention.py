@@ -0,0 +1,167 @@
+"""Hammer /borrow and /return from parallel clients and check loan invariants.
+
+Each worker repeatedly picks a random book from a small hot set and tries to
+borrow it (or return it, if it believes the book is out). Conflicts (409) are
+expected; anything that corrupts state is not. After the run the database is
+checked for double loans and books_borrowed drift.
+
+    python bench/circulation_contention.py --url http://127.0.0.1:5001 \
+        --dsn "host=127.0.0.1 dbname=library user=admin password=secret"
+
+The defaults are 16 clients for 10 s. The before/after figures for the
+atomic borrow and return routes were measured against the dev server
+(`flask run -p 5001`) with 12 clients for 5 s, the other options at
+their defaults:
+
+    python bench/circulation_contention.py --url http://127.0.0.1:5001 \
+        --dsn "host=127.0.0.1 dbname=library user=admin password=secret" \
+        --threads 12 --seconds 5
+"""
+import argparse
+import random
+import threading
+import time
+from collections import Counter
+from datetime import date
+
+import psycopg2
+import requests
+
+
+INVARIANT_QUERIES = {
+    "books with more than one open loan": """
+        SELECT COUNT(*) FROM (
+            SELECT bo.book_id
+            FROM borrows bo
+            LEFT JOIN returns r ON r.borrow_id = bo.borrow_id
+            WHERE r.return_id IS NULL
+            GROUP BY bo.book_id
+            HAVING COUNT(*) > 1
+        ) t
+    """,
+    "unavailable books without an open loan": """
+        SELECT COUNT(*)
+        FROM books b
+        WHERE b.is_available = FALSE
+            AND NOT EXISTS (
+                SELECT 1
+                FROM borrows bo
+                LEFT JOIN returns r ON r.borrow_id = bo.borrow_id
+                WHERE bo.book_id = b.book_id AND r.return_id IS NULL
+            )
+    """,
+    "books whose open-loan reference disagrees with availability": """
+        SELECT COUNT(*)
+        FROM books b
+        LEFT JOIN returns r ON r.borrow_id = b.current_borrow_id
+        WHERE (b.current_borrow_id IS NULL) <> b.is_available
+            OR r.return_id IS NOT NULL
+    """,
+    "users whose books_borrowed drifted": """
+        SELECT COUNT(*)
+        FROM users u
+        WHERE u.books_borrowed <> (
+            SELECT COUNT(*)
+            FROM borrows bo
+            LEFT JOIN returns r ON r.borrow_id = bo.borrow_id
+            WHERE bo.user_id = u.user_id AND r.return_id IS NULL
+        )
+    """,
+}
+
+
+def worker(url, book_ids, user_ids, deadline, counts, lock, seed):
+    rng = random.Random(seed)
+    session = requests.Session()
+    today = date.today().isoformat()
+    local = Counter()
+
+    while time.monotonic() < deadline:
+        book_id = rng.choice(book_ids)
+        if rng.random() < 0.5:
+            action = 'borrow'
+            response = session.post(f"{url}/borrow", data={
+                'borrowBookId': book_id,
+                'borrowerName': rng.choice(user_ids),
+                'borrowDate': today,
+            }, allow_redirects=False)
+        else:
+            action = 'return'
+            response = session.post(f"{url}/return", data={
+                'returnBookId': book_id,
+                'returnDate': today,
+            }, allow_redirects=False)
+
+        if response.status_code == 302:
+            local[f"{action}_ok"] += 1
+        elif response.status_code == 409:
+            local[f"{action}_conflict"] += 1
+        else:
+            local[f"{action}_error_{response.status_code}"] += 1
+
+    with lock:
+        counts.update(local)
+
+
+def check_invariants(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            violations = {}
+            for label, query in INVARIANT_QUERIES.items():
+                cursor.execute(query)
+                violations[label] = cursor.fetchone()[0]
+        return violations
+    finally:
+        conn.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5001')
+    parser.add_argument('--dsn', default='host=127.0.0.1 dbname=library user=admin password=secret')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--books', type=int, default=5, help="size of the contended book set")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT book_id FROM books ORDER BY book_id LIMIT %s", (args.books,))
+        book_ids = [row[0] for row in cursor.fetchall()]
+        cursor.execute("SELECT user_id FROM users ORDER BY user_id")
+        user_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+
+    counts = Counter()
+    lock = threading.Lock()
+    started = time.monotonic()
+    deadline = started + args.seconds
+    threads = [
+        threading.Thread(target=worker, args=(args.url, book_ids, user_ids, deadline, counts, lock, args.seed + i))
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    total = sum(counts.values())
+    committed = counts['borrow_ok'] + counts['return_ok']
+    print(f"{args.threads} clients, {len(book_ids)} books, {elapsed:.1f}s")
+    print(f"requests:  {total} ({total / elapsed:.1f}/s)")
+    print(f"committed: {committed} ({committed / elapsed:.1f}/s)")
+    for key in sorted(counts):
+        print(f"  {key}: {counts[key]}")
+
+    violations = check_invariants(args.dsn)
+    for label, count in violations.items():
+        print(f"{label}: {count}")
+    if any(violations.values()):
+        raise SystemExit("Loan invariants violated")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Local stand-in for the description model endpoint.
+
+Answers POSTs like Gemini's generateContent after --delay-ms, failing a
+--fail-rate fraction of them with a 503, and counts the calls it receives
+(GET /stats), so caching, coalescing and circuit breaking can be checked
+without an API key. Run it, then point [DESCRIPTIONS] in app/config.ini at it:
+
+    python bench/description_stub.py --port 8089 --delay-ms 1500
+    API_URL=http://127.0.0.1:8089/generate
+    API_KEY=stub
+
+With the app up, open the same viewer page from several clients at once:
+/stats shows one call per entity however many clients waited for it.
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "DescriptionStub/1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            with self.server.lock:
+                self._send_json(200, dict(self.server.stats))
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            prompt = json.loads(self.rfile.read(length))['contents'][0]['parts'][0]['text']
+        except (ValueError, KeyError, IndexError, TypeError):
+            self._send_json(400, {'error': 'bad request'})
+            return
+
+        with self.server.lock:
+            self.server.stats['calls'] += 1
+        time.sleep(self.server.delay)
+
+        if random.random() < self.server.fail_rate:
+            with self.server.lock:
+                self.server.stats['failures'] += 1
+            self._send_json(503, {'error': {'code': 503, 'message': 'stub failure'}})
+            return
+        text = f"**Stub description.** Generated for: {prompt[:200]}"
+        self._send_json(200, {'candidates': [{'content': {'parts': [{'text': text}]}}]})
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, delay=0.0, fail_rate=0.0):
+        super().__init__(address, StubHandler)
+        self.delay = delay
+        self.fail_rate = fail_rate
+        self.lock = threading.Lock()
+        self.stats = {'calls': 0, 'failures': 0}
+
+    def start(self):
+        """Serve from a background thread; returns the endpoint URL."""
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/generate"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--delay-ms', type=float, default=500, help="time taken by every call")
+    parser.add_argument('--fail-rate', type=float, default=0.0, help="fraction of calls answered with a 503")
+    args = parser.parse_args()
+
+    server = StubServer((args.host, args.port), delay=args.delay_ms / 1000, fail_rate=args.fail_rate)
+    print(f"Description stub on http://{args.host}:{args.port}/generate (stats at /stats)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,295 @@
+"""End-to-end load benchmark: concurrent mixed reads and writes against the app.
+
+Generate a library, start the app, then drive it:
+
+    flask db generate --books 50000 --users 5000 --seed 1 --yes   (in app/)
+    python bench/load_test.py --url http://127.0.0.1:5001 \
+        --dsn "host=127.0.0.1 dbname=library user=admin password=secret"
+
+Every client thread picks operations from a weighted mix (--mix) and records
+the latency of each request. p50/p95/p99 latency and throughput per endpoint
+are printed and saved as JSON under bench/results/, named after the current
+commit; pass an earlier result file to --compare to see the difference.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import date, datetime, timezone
+
+import psycopg2
+import requests
+
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+DEFAULT_MIX = "index=30,api_books=15,viewer_book=15,viewer_user=10,viewer_author=10,borrow=10,return=10"
+
+# Query strings for the catalog pages, from a plain first page to filtered and sorted ones
+PAGE_VARIANTS = ("", "?sort=title", "?available=true", "?genre={genre}", "?author={author}")
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (choose from {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def op_index(client):
+    variant = client.rng.choice(PAGE_VARIANTS)
+    return client.session.get(client.url + "/" + variant.format(**client.random_ids()))
+
+
+def op_api_books(client):
+    variant = client.rng.choice(PAGE_VARIANTS).replace('?', '&')
+    return client.session.get(client.url + "/api/books?limit=50" + variant.format(**client.random_ids()))
+
+
+def op_viewer_book(client):
+    return client.session.get(client.url + "/viewer.html", params={'type': 'book', 'id': client.random_ids()['book']})
+
+
+def op_viewer_user(client):
+    return client.session.get(client.url + "/viewer.html", params={'type': 'user', 'id': client.random_ids()['user']})
+
+
+def op_viewer_author(client):
+    return client.session.get(client.url + "/viewer.html",
+                              params={'type': 'author', 'id': client.random_ids()['author']})
+
+
+def op_borrow(client):
+    ids = client.random_ids()
+    response = client.session.post(client.url + "/borrow", data={
+        'borrowBookId': ids['book'],
+        'borrowerName': ids['user'],
+        'borrowDate': client.today,
+    }, allow_redirects=False)
+    if response.status_code == 302:
+        client.borrowed.append(ids['book'])
+    return response
+
+
+def op_return(client):
+    # Mostly return what this client borrowed, so returns are not all conflicts
+    book_id = client.borrowed.popleft() if client.borrowed else client.random_ids()['book']
+    return client.session.post(client.url + "/return", data={
+        'returnBookId': book_id,
+        'returnDate': client.today,
+    }, allow_redirects=False)
+
+
+OPERATIONS = {
+    'index': op_index,
+    'api_books': op_api_books,
+    'viewer_book': op_viewer_book,
+    'viewer_user': op_viewer_user,
+    'viewer_author': op_viewer_author,
+    'borrow': op_borrow,
+    'return': op_return,
+}
+
+
+class Client:
+    def __init__(self, url, dataset, seed):
+        self.url = url
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self.session = requests.Session()
+        self.today = date.today().isoformat()
+        self.borrowed = deque(maxlen=1000)
+
+    def random_ids(self):
+        return {
+            'book': self.rng.randint(1, self.dataset['books']),
+            'user': self.rng.randint(1, self.dataset['users']),
+            'author': self.rng.randint(1, self.dataset['authors']),
+            'genre': self.rng.choice(self.dataset['genre_ids']),
+        }
+
+
+def worker(url, dataset, mix, seed, measure_from, deadline, results, lock):
+    client = Client(url, dataset, seed)
+    names = list(mix)
+    weights = list(mix.values())
+    local = defaultdict(lambda: {'latencies': [], 'ok': 0, 'rejected': 0, 'errors': 0})
+
+    while True:
+        name = client.rng.choices(names, weights=weights)[0]
+        started = time.perf_counter()
+        try:
+            status = OPERATIONS[name](client).status_code
+        except requests.RequestException:
+            status = None
+        finished = time.perf_counter()
+        if finished >= deadline:
+            break
+        if started < measure_from:
+            continue
+
+        stats = local[name]
+        stats['latencies'].append(finished - started)
+        if status is None or status >= 500:
+            stats['errors'] += 1
+        elif status >= 400:
+            # Conflicts and unknown ids are expected under a random mix
+            stats['rejected'] += 1
+        else:
+            stats['ok'] += 1
+
+    with lock:
+        for name, stats in local.items():
+            merged = results[name]
+            merged['latencies'].extend(stats['latencies'])
+            for key in ('ok', 'rejected', 'errors'):
+                merged[key] += stats[key]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, ok, rejected, errors, seconds):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'requests': len(latencies),
+        'ok': ok,
+        'rejected': rejected,
+        'errors': errors,
+        'throughput': round(len(latencies) / seconds, 1),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+    }
+
+
+def load_dataset(dsn):
+    conn = psycopg2.connect(dsn)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT
+                    (SELECT COALESCE(MAX(book_id), 1) FROM books),
+                    (SELECT COALESCE(MAX(user_id), 1) FROM users),
+                    (SELECT COALESCE(MAX(author_id), 1) FROM authors),
+                    (SELECT COALESCE(array_agg(genre_id), ARRAY[1]) FROM genres),
+                    (SELECT COUNT(*) FROM borrows)
+            """)
+            books, users, authors, genre_ids, borrows = cursor.fetchone()
+        return {'books': books, 'users': users, 'authors': authors, 'genre_ids': genre_ids, 'borrows': borrows}
+    finally:
+        conn.close()
+
+
+def current_commit():
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=repo, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_report(report, baseline=None):
+    print(f"commit {report['commit']}: {report['threads']} clients, {report['seconds']:.1f}s measured, "
+          f"{report['dataset']['books']} books, {report['dataset']['users']} users")
+    header = f"{'endpoint':<14}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ok':>8}{'4xx':>6}{'err':>6}"
+    print(header)
+    rows = dict(report['endpoints'], total=report['total'])
+    for name, stats in rows.items():
+        line = (f"{name:<14}{stats['throughput']:>9.1f}{stats['p50_ms'] or 0:>9.2f}{stats['p95_ms'] or 0:>9.2f}"
+                f"{stats['p99_ms'] or 0:>9.2f}{stats['ok']:>8}{stats['rejected']:>6}{stats['errors']:>6}")
+        before = (baseline or {}).get('endpoints', {}).get(name) if name != 'total' else (baseline or {}).get('total')
+        if before and before.get('p95_ms') and stats['p95_ms']:
+            line += (f"   vs {baseline['commit']}: req/s {stats['throughput'] - before['throughput']:+.1f}, "
+                     f"p95 {(stats['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}%")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:5001')
+    parser.add_argument('--dsn', default='host=127.0.0.1 dbname=library user=admin password=secret')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=30, help="measured duration")
+    parser.add_argument('--warmup', type=float, default=5, help="seconds of load before measuring starts")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f"weights (default: {DEFAULT_MIX})")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help="result file (default: bench/results/<timestamp>-<commit>.json)")
+    parser.add_argument('--compare', help="earlier result file to compare against")
+    args = parser.parse_args()
+    mix = args.mix
+
+    dataset = load_dataset(args.dsn)
+    results = defaultdict(lambda: {'latencies': [], 'ok': 0, 'rejected': 0, 'errors': 0})
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + args.warmup
+    deadline = measure_from + args.seconds
+    threads = [
+        threading.Thread(target=worker, args=(args.url, dataset, mix, args.seed + i, measure_from, deadline,
+                                              results, lock))
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    endpoints = {name: summarize(seconds=args.seconds, **results[name]) for name in mix if name in results}
+    report = {
+        'commit': current_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'url': args.url,
+        'threads': args.threads,
+        'seconds': args.seconds,
+        'warmup': args.warmup,
+        'seed': args.seed,
+        'mix': mix,
+        'dataset': {key: value for key, value in dataset.items() if key != 'genre_ids'},
+        'endpoints': endpoints,
+        'total': summarize(
+            [latency for stats in results.values() for latency in stats['latencies']],
+            sum(stats['ok'] for stats in results.values()),
+            sum(stats['rejected'] for stats in results.values()),
+            sum(stats['errors'] for stats in results.values()),
+            args.seconds,
+        ),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+
+    output = args.output
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"{stamp}-{report['commit']}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""Logging overhead benchmark: request latency with a slow log sink, per logging mode.
+
+Runs the app in-process on a threaded werkzeug server and drives it with
+concurrent clients while log records go to a stream that takes --write-delay-ms
+per write (a full disk, a slow pipe, a blocked collector). Run it from the
+repository root with the database up:
+
+    python bench/logging_overhead.py --write-delay-ms 2
+
+Modes:
+    sync           every record written by the thread that logged it, at DEBUG
+                   (what the app did before logging went through a queue)
+    queue          records handed to a background writer through a bounded queue
+    queue-sampled  as queue, keeping 10% of the werkzeug access log
+"""
+import argparse
+import configparser
+import os
+import sys
+import threading
+import time
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(os.path.join(ROOT, 'app'))
+
+from werkzeug.serving import make_server  # noqa: E402
+
+from app.app import app  # noqa: E402
+from app import logs  # noqa: E402
+
+MODES = {
+    'sync': {'LOGGING': {'LEVEL': 'DEBUG', 'FORMAT': 'text', 'ASYNC': 'false'}},
+    'queue': {'LOGGING': {'LEVEL': 'INFO', 'FORMAT': 'json', 'ASYNC': 'true'}},
+    'queue-sampled': {'LOGGING': {'LEVEL': 'INFO', 'FORMAT': 'json', 'ASYNC': 'true'},
+                      'LOGGING.SAMPLING': {'werkzeug': '0.1'}},
+}
+
+
+class SlowStream:
+    """A log sink where every write takes ``delay`` seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.writes = 0
+
+    def write(self, text):
+        time.sleep(self.delay)
+        self.writes += 1
+
+    def flush(self):
+        pass
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def drive(url, threads, seconds):
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + seconds
+
+    def client():
+        session = requests.Session()
+        local = []
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            session.get(url)
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    workers = [threading.Thread(target=client) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return sorted(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--path', default='/api/books?limit=20')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10)
+    parser.add_argument('--write-delay-ms', type=float, default=2)
+    parser.add_argument('--modes', default=','.join(MODES))
+    args = parser.parse_args()
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}{args.path}"
+
+    print(f"{args.threads} clients, {args.seconds:.0f}s per mode, {args.write_delay_ms} ms per log write")
+    print(f"{'mode':<15}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'written':>9}{'dropped':>9}{'sampled':>9}")
+    for mode in args.modes.split(','):
+        config = configparser.ConfigParser()
+        config.read_dict(MODES[mode])
+        stream = SlowStream(args.write_delay_ms / 1000)
+        logs.configure_logging(config, stream=stream)
+        drive(url, args.threads, 1)  # warm up the pool and the caches
+        stats_before = logs.stats()
+        latencies = drive(url, args.threads, args.seconds)
+        stats = logs.stats()
+        logs.stop_logging()
+        ms = lambda value: value * 1000
+        print(f"{mode:<15}{len(latencies) / args.seconds:>9.1f}{ms(percentile(latencies, 0.50)):>9.2f}"
+              f"{ms(percentile(latencies, 0.95)):>9.2f}{ms(percentile(latencies, 0.99)):>9.2f}{stream.writes:>9}"
+              f"{stats['dropped'] - stats_before['dropped']:>9}"
+              f"{stats['sampled_out'] - stats_before['sampled_out']:>9}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
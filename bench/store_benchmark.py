@@ -0,0 +1,332 @@
+"""Store benchmark: the same generated workload against any library repository.
+
+Every store implements app.repository.LibraryRepository. Load the same
+synthetic library into each (for Postgres, `flask db generate --books 50000
+--users 5000 --seed 1 --yes` in app/), then run from the repository root:
+
+    python bench/store_benchmark.py --store postgres \\
+        --target "host=127.0.0.1 dbname=library user=admin password=secret" --books 50000 --users 5000
+    python bench/store_benchmark.py --store mongo_repository:MongoRepository --target mongodb://127.0.0.1 \\
+        --books 50000 --users 5000 --compare bench/results/<postgres run>.json
+
+--store is a name from app.repository.STORES or a ``module:Class`` path.
+Before anything runs, each client's operations are drawn from --mix with
+--seed over the ids and vocabulary `flask db generate` uses, so every store
+gets exactly the same calls in the same order. Borrows and returns change
+the data: regenerate it before each run to compare stores. The first
+--warmup operations of every client are not measured. p50/p95/p99 latency
+and throughput per operation are printed and saved as JSON under
+bench/results/.
+"""
+import argparse
+import importlib
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import date, datetime, timezone
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+INVOKED_FROM = os.getcwd()
+sys.path.insert(0, ROOT)
+os.chdir(os.path.join(ROOT, 'app'))
+
+from app.repository import STORES  # noqa: E402
+from app.synthetic import GENRES, LAST_NAMES, TITLE_NOUNS, TITLE_WORDS  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, 'bench', 'results')
+
+DEFAULT_MIX = ("catalog=25,entity_book=15,entity_user=10,entity_author=10,entity_genre=5,search=15,"
+               "borrow=10,return=10")
+
+SEARCH_WORDS = TITLE_WORDS + TITLE_NOUNS + LAST_NAMES + GENRES
+
+
+def op_catalog(client):
+    variant = client.rng.randrange(6)
+    if variant == 0:
+        return 'catalog_page', {}
+    if variant == 1:
+        return 'catalog_page', {'sort': 'title'}
+    if variant == 2:
+        return 'catalog_page', {'available': True}
+    if variant == 3:
+        return 'catalog_page', {'genre_id': client.rng.randint(1, len(GENRES))}
+    if variant == 4:
+        return 'catalog_page', {'author_id': client.rng.randint(1, client.dataset['authors'])}
+    # A page deep in the catalog, as reached by following next_cursor
+    return 'catalog_page', {'after': (client.rng.randint(1, client.dataset['books']),)}
+
+
+def entity_op(type, dimension):
+    def op(client):
+        return 'entity', {'type': type, 'entity_id': client.rng.randint(1, client.dataset[dimension])}
+    return op
+
+
+def op_search(client):
+    words = client.rng.sample(SEARCH_WORDS, client.rng.randint(1, 2))
+    text = ' '.join(words).lower()
+    if client.rng.random() < 0.3:
+        # Search-as-you-type: the last word is still being typed
+        text = text[:len(text) - client.rng.randint(1, max(1, len(words[-1]) - 2))]
+    return 'search', {'text': text}
+
+
+def op_borrow(client):
+    book_id = client.rng.randint(1, client.dataset['books'])
+    client.borrowed.append(book_id)
+    return 'borrow', {'book_id': book_id, 'user_id': client.rng.randint(1, client.dataset['users']),
+                      'borrow_date': client.today}
+
+
+def op_return(client):
+    # Mostly return what this client borrowed, so returns are not all conflicts
+    book_id = client.borrowed.popleft() if client.borrowed else client.rng.randint(1, client.dataset['books'])
+    return 'return_book', {'book_id': book_id, 'return_date': client.today}
+
+
+OPERATIONS = {
+    'catalog': op_catalog,
+    'entity_book': entity_op('book', 'books'),
+    'entity_user': entity_op('user', 'users'),
+    'entity_author': entity_op('author', 'authors'),
+    'entity_genre': entity_op('genre', 'genres'),
+    'entity_publisher': entity_op('publisher', 'publishers'),
+    'search': op_search,
+    'borrow': op_borrow,
+    'return': op_return,
+}
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in OPERATIONS:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (choose from {', '.join(OPERATIONS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def load_store(spec):
+    """The repository class for a STORES name or a ``module:Class`` path."""
+    module_name, _, class_name = STORES.get(spec, spec).partition(':')
+    if not class_name:
+        raise SystemExit(f"unknown store {spec!r}: use one of {', '.join(STORES)} or module:Class")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class Client:
+    """State of one simulated client while its operations are generated."""
+
+    def __init__(self, dataset, seed, today):
+        self.dataset = dataset
+        self.rng = random.Random(seed)
+        self.today = today
+        self.borrowed = deque(maxlen=1000)
+
+
+def build_workload(mix, dataset, seed, clients, operations, today):
+    """Per client, ``operations`` ``(name, method, kwargs)``; only depends on the arguments."""
+    names = list(mix)
+    weights = list(mix.values())
+    workload = []
+    for number in range(clients):
+        client = Client(dataset, seed + number, today)
+        calls = []
+        for name in client.rng.choices(names, weights=weights, k=operations):
+            method, kwargs = OPERATIONS[name](client)
+            calls.append((name, method, kwargs))
+        workload.append(calls)
+    return workload
+
+
+def is_rejected(method, result):
+    # Conflicts and unknown ids are expected under a random mix
+    if method in ('borrow', 'return_book'):
+        return result['status'] != 'ok'
+    if method == 'entity':
+        return not result[0]
+    return False
+
+
+def worker(repository, calls, warmup, barrier, results, errors, lock):
+    local = defaultdict(lambda: {'latencies': [], 'ok': 0, 'rejected': 0, 'errors': 0})
+    for index, (name, method, kwargs) in enumerate(calls):
+        if index == warmup:
+            barrier.wait()
+        started = time.perf_counter()
+        try:
+            result = getattr(repository, method)(**kwargs)
+            outcome = 'rejected' if is_rejected(method, result) else 'ok'
+        except Exception as e:
+            outcome = 'errors'
+            with lock:
+                errors[f"{name}: {type(e).__name__}: {e}"] += 1
+        finished = time.perf_counter()
+        if index < warmup:
+            continue
+        stats = local[name]
+        stats['latencies'].append(finished - started)
+        stats[outcome] += 1
+    if len(calls) <= warmup:
+        barrier.wait()
+
+    with lock:
+        for name, stats in local.items():
+            merged = results[name]
+            merged['latencies'].extend(stats['latencies'])
+            for key in ('ok', 'rejected', 'errors'):
+                merged[key] += stats[key]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(fraction * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, ok, rejected, errors, seconds):
+    latencies = sorted(latencies)
+    ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'operations': len(latencies),
+        'ok': ok,
+        'rejected': rejected,
+        'errors': errors,
+        'throughput': round(len(latencies) / seconds, 1),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'max_ms': ms(latencies[-1] if latencies else None),
+    }
+
+
+def current_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return commit + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_report(report, baseline=None):
+    print(f"{report['store']} at commit {report['commit']}: {report['threads']} clients, "
+          f"{report['seconds']:.1f}s measured, {report['dataset']['books']} books, {report['dataset']['users']} users")
+    header = f"{'operation':<18}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'ok':>8}{'rej':>6}{'err':>6}"
+    print(header)
+    rows = dict(report['operations'], total=report['total'])
+    for name, stats in rows.items():
+        line = (f"{name:<18}{stats['throughput']:>9.1f}{stats['p50_ms'] or 0:>9.2f}{stats['p95_ms'] or 0:>9.2f}"
+                f"{stats['p99_ms'] or 0:>9.2f}{stats['ok']:>8}{stats['rejected']:>6}{stats['errors']:>6}")
+        before = (baseline or {}).get('operations', {}).get(name) if name != 'total' else (baseline or {}).get('total')
+        if before and before.get('p95_ms') and stats['p95_ms']:
+            line += (f"   vs {baseline['store']}: ops/s {stats['throughput'] - before['throughput']:+.1f}, "
+                     f"p95 {(stats['p95_ms'] / before['p95_ms'] - 1) * 100:+.0f}%")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--store', default='postgres', help=f"{', '.join(STORES)} or module:Class")
+    parser.add_argument('--target', default='host=127.0.0.1 dbname=library user=admin password=secret',
+                        help="the store's connection string")
+    parser.add_argument('--books', type=int, required=True, help="as passed to flask db generate")
+    parser.add_argument('--users', type=int, required=True, help="as passed to flask db generate")
+    parser.add_argument('--authors', type=int, help="default: books / 4, as flask db generate")
+    parser.add_argument('--publishers', type=int, help="default: books / 50, at most 200, as flask db generate")
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--operations', type=int, default=2000, help="measured operations per client")
+    parser.add_argument('--warmup', type=int, default=100, help="operations per client before measuring starts")
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX, help=f"weights (default: {DEFAULT_MIX})")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--date', type=date.fromisoformat, default=date.today(), help="borrow and return date")
+    parser.add_argument('--output', help="result file (default: bench/results/store-<store>-<timestamp>-<commit>.json)")
+    parser.add_argument('--compare', help="earlier result file to compare against")
+    args = parser.parse_args()
+
+    store = load_store(args.store)
+    dataset = {
+        'books': args.books,
+        'users': args.users,
+        'authors': args.authors or max(1, args.books // 4),
+        'publishers': args.publishers or max(1, min(200, args.books // 50)),
+        'genres': len(GENRES),
+    }
+    workload = build_workload(args.mix, dataset, args.seed, args.threads, args.warmup + args.operations, args.date)
+
+    repository = store.connect(args.target, connections=args.threads)
+    results = defaultdict(lambda: {'latencies': [], 'ok': 0, 'rejected': 0, 'errors': 0})
+    errors = defaultdict(int)
+    lock = threading.Lock()
+    measured = []
+    barrier = threading.Barrier(args.threads + 1)
+    threads = [
+        threading.Thread(target=worker, args=(repository, calls, args.warmup, barrier, results, errors, lock))
+        for calls in workload
+    ]
+    try:
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        measured.append(time.perf_counter())
+        for thread in threads:
+            thread.join()
+        measured.append(time.perf_counter())
+    finally:
+        repository.close()
+    seconds = measured[1] - measured[0]
+
+    report = {
+        'store': store.name or args.store,
+        'commit': current_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'threads': args.threads,
+        'seconds': seconds,
+        'operations_per_client': args.operations,
+        'warmup': args.warmup,
+        'seed': args.seed,
+        'mix': args.mix,
+        'dataset': dataset,
+        'operations': {name: summarize(seconds=seconds, **results[name]) for name in args.mix if name in results},
+        'total': summarize(
+            [latency for stats in results.values() for latency in stats['latencies']],
+            sum(stats['ok'] for stats in results.values()),
+            sum(stats['rejected'] for stats in results.values()),
+            sum(stats['errors'] for stats in results.values()),
+            seconds,
+        ),
+    }
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(INVOKED_FROM, args.compare)) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    for message, count in sorted(errors.items(), key=lambda item: -item[1])[:10]:
+        print(f"  {count} x {message}")
+
+    output = os.path.join(INVOKED_FROM, args.output) if args.output else None
+    if not output:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        output = os.path.join(RESULTS_DIR, f"store-{report['store']}-{stamp}-{report['commit']}.json")
+    with open(output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,17 @@
+#!/bin/bash
+# Starts a hot standby of the db service. On first start the data directory is
+# cloned from the primary with pg_basebackup; -R writes the standby.signal and
+# primary_conninfo that make it follow the primary from then on.
+set -e
+
+if [ ! -s "$PGDATA/PG_VERSION" ]; then
+    until pg_isready -h "$PRIMARY_HOST" -p 5432 -q; do
+        echo "Waiting for $PRIMARY_HOST..."
+        sleep 2
+    done
+    export PGPASSWORD="$REPLICATION_PASSWORD"
+    pg_basebackup -h "$PRIMARY_HOST" -p 5432 -U replicator -D "$PGDATA" -R -X stream
+    chmod 700 "$PGDATA"
+fi
+
+exec postgres -c hot_standby=on -c hot_standby_feedback=on